@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+from fix_policy import CompilesPolicy
+
+# 修正候補を適用した状態で agent を実行するための起動スクリプト。
+# プロジェクトのファイルは書き換えず、修正後のファイルだけを置いたオーバーレイ用のディレクトリを作り、
+# import 時にプロジェクトのファイルの代わりにオーバーレイのファイルを読み込ませる。
+# 引数: オーバーレイのディレクトリ、project_root、agent のスクリプト（project_root からの相対パス）
+BOOTSTRAP = r"""
+import os, sys, runpy
+import importlib.util
+from importlib.machinery import PathFinder
+
+overlay_dir, project_root, script = sys.argv[1:4]
+overlay = {}
+for dirpath, _, filenames in os.walk(overlay_dir):
+    for name in filenames:
+        if name.endswith(".py"):
+            path = os.path.join(dirpath, name)
+            overlay[os.path.normcase(os.path.relpath(path, overlay_dir))] = path
+
+class OverlayFinder:
+    @classmethod
+    def find_spec(cls, name, path=None, target=None):
+        spec = PathFinder.find_spec(name, path, target)
+        if spec is None or not spec.origin:
+            return spec
+        try:
+            rel = os.path.normcase(os.path.relpath(spec.origin, project_root))
+        except ValueError:
+            return spec
+        if rel not in overlay:
+            return spec
+        return importlib.util.spec_from_file_location(
+            name, overlay[rel], submodule_search_locations=spec.submodule_search_locations)
+
+sys.meta_path.insert(0, OverlayFinder)
+# 新しく作るファイル（プロジェクトにないモジュール）はオーバーレイから import する
+sys.path[:1] = [project_root, overlay_dir]
+os.chdir(project_root)
+script_path = os.path.join(project_root, script)
+sys.argv = [script_path]
+runpy.run_path(overlay.get(os.path.normcase(script), script_path), run_name="__main__")
+"""
+
+
+class CandidateResult:
+    def __init__(self, index, ok, reason="", elapsed=0.0):
+        self.index = index
+        self.ok = ok
+        self.reason = reason
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return f"CandidateResult({self.index}, ok={self.ok}, {self.reason!r}, {self.elapsed:.2f}s)"
+
+
+def check_compiles(proposal):
+    """
+    proposal（FixProposal）を自動モードの compiles ポリシーと同じ条件で確かめる。
+    修正前から文法エラーが複数あったファイルでは、元のエラーより後ろに残ったエラーは許す。
+    採用できれば None、できなければ理由を返す。
+    """
+    return CompilesPolicy().check(proposal)
+
+
+def _fully_compiles(new_texts):
+    for relpath, text in new_texts.items():
+        if not relpath.endswith(".py"):
+            continue
+        try:
+            compile(text, relpath, "exec", dont_inherit=True)
+        except (SyntaxError, ValueError):
+            return False
+    return True
+
+
+def _write_overlay(overlay_dir, new_texts):
+    for relpath, text in new_texts.items():
+        path = os.path.join(overlay_dir, relpath)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            f.write(text)
+
+
+def validate_candidate(index, project_root, proposal, agent_script=None, timeout=60.0, cancel_path=None):
+    """
+    1 つの候補（FixProposal）を検証する（プロセスプールのワーカーで実行される）。
+    1. 修正後のファイルがコンパイルできるか（check_compiles）
+    2. agent_script を指定した場合は、オーバーレイで候補を適用した状態で agent を実行し、
+       Traceback を出さずに終わるか（timeout 秒たってもエラーが出ていなければ合格とする）
+       後ろの行の文法エラーが残っている候補は agent を実行できないので、1. だけで合格とする。
+    cancel_path のファイルが作られたら（他の候補が先に合格したら）agent を停止して打ち切る。
+    """
+    started = time.monotonic()
+    new_texts = proposal.new_texts
+    reason = check_compiles(proposal)
+    if reason:
+        return CandidateResult(index, False, f"コンパイルエラー: {reason}", time.monotonic() - started)
+    if not agent_script:
+        return CandidateResult(index, True, "コンパイル成功", time.monotonic() - started)
+    if not _fully_compiles(new_texts):
+        return CandidateResult(index, True, "元のエラーを修正（後ろの行の文法エラーは次の回で直す）",
+                               time.monotonic() - started)
+
+    overlay_dir = tempfile.mkdtemp(prefix=f"selfmade-candidate{index}-")
+    try:
+        _write_overlay(overlay_dir, new_texts)
+        env = dict(os.environ, PYTHONUNBUFFERED="1", PYTHONDONTWRITEBYTECODE="1")
+        with tempfile.TemporaryFile() as out, tempfile.TemporaryFile() as err:
+            process = subprocess.Popen(
+                [sys.executable, "-c", BOOTSTRAP, overlay_dir, project_root, agent_script],
+                cwd=project_root, stdout=out, stderr=err, env=env
+            )
+            deadline = started + timeout
+            while process.poll() is None:
+                if cancel_path and os.path.exists(cancel_path):
+                    process.kill()
+                    process.wait()
+                    return CandidateResult(index, False, "中止（他の候補が先に合格）", time.monotonic() - started)
+                if time.monotonic() >= deadline:
+                    process.kill()
+                    process.wait()
+                    return CandidateResult(index, True, f"{timeout:.0f} 秒間エラーなし", time.monotonic() - started)
+                time.sleep(0.05)
+            err.seek(0)
+            stderr = err.read().decode("utf-8", "replace")
+
+        elapsed = time.monotonic() - started
+        if process.returncode == 0 and "Traceback" not in stderr:
+            return CandidateResult(index, True, "agent の実行成功", elapsed)
+        last_line = next((l for l in reversed(stderr.strip().splitlines()) if l.strip()), "")
+        return CandidateResult(index, False, f"agent の実行失敗（終了コード {process.returncode}）: {last_line}", elapsed)
+    finally:
+        shutil.rmtree(overlay_dir, ignore_errors=True)
+
+
+def evaluate_candidates(project_root, candidates, agent_script=None, timeout=60.0, max_workers=None):
+    """
+    複数の候補（FixProposal のリスト）をプロセスプールで並行して検証し、最初に合格した候補を選ぶ。
+    合格した候補が出た時点で、残りの候補の検証は打ち切る。
+    戻り値: (合格した候補の番号 or None, [CandidateResult, ...])
+    """
+    if not candidates:
+        return None, []
+    if len(candidates) == 1:
+        result = validate_candidate(0, project_root, candidates[0], agent_script, timeout)
+        return (0 if result.ok else None), [result]
+
+    # multiprocessing の import は重いので、候補が複数あるときだけ行う
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    cancel_dir = tempfile.mkdtemp(prefix="selfmade-cancel-")
+    cancel_path = os.path.join(cancel_dir, "cancel")
+    winner = None
+    results = []
+    try:
+        # 検証のほとんどは agent の終了待ちなので、CPU 数より多く並べてよい
+        workers = max_workers or min(len(candidates), max(4, os.cpu_count() or 1))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [
+                pool.submit(validate_candidate, i, project_root, proposal, agent_script, timeout, cancel_path)
+                for i, proposal in enumerate(candidates)
+            ]
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result = future.result()
+                results.append(result)
+                if result.ok and winner is None:
+                    winner = result.index
+                    # 実行中の候補には停止を伝え、まだ始まっていない候補は取り消す
+                    open(cancel_path, "w").close()
+                    for f in futures:
+                        f.cancel()
+    finally:
+        shutil.rmtree(cancel_dir, ignore_errors=True)
+    return winner, sorted(results, key=lambda r: r.index)
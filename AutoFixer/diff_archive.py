@@ -0,0 +1,191 @@
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+INDEX_FILENAME = "index.sqlite3"
+DIFF_TARGET_PATTERN = re.compile(r"^diff --git a/(.+?) b/")
+
+# done_dir → DiffArchive
+_archives = {}
+
+
+def _targets_in_diff(diff_filepath):
+    """
+    差分ファイルの "diff --git a/... b/..." 行から対象ファイルの相対パスを取り出す。
+    """
+    targets = []
+    try:
+        with open(diff_filepath, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                m = DIFF_TARGET_PATTERN.match(line)
+                if m and m.group(1) not in targets:
+                    targets.append(m.group(1))
+    except OSError:
+        pass
+    return targets
+
+
+def _split_archived_name(filename):
+    """
+    "Script.py-03-dff.txt" → ("Script.py", 3)。連番付きでなければ None。
+    """
+    if not filename.endswith("-dff.txt"):
+        return None
+    parts = filename[:-len("-dff.txt")].rsplit("-", 1)
+    if len(parts) == 2 and parts[1].isdigit():
+        return parts[0], int(parts[1])
+    return None
+
+
+class DiffArchive:
+    """
+    Diff/done に移動した差分ファイルの索引（SQLite）。
+    連番の払い出しをディレクトリの走査なしで行い、対象ファイルごとの履歴を検索できるようにする。
+    索引がない状態で開いたときだけ、既存の done ディレクトリを 1 回走査して取り込む。
+    """
+
+    def __init__(self, done_dir):
+        self.done_dir = done_dir
+        os.makedirs(done_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(done_dir, INDEX_FILENAME))
+        self.conn.row_factory = sqlite3.Row
+        self._create_tables()
+        if self._get_meta("bootstrapped") is None:
+            self._bootstrap()
+
+    def _create_tables(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                );
+                CREATE TABLE IF NOT EXISTS sequences (
+                    base_name TEXT PRIMARY KEY,
+                    last_seq INTEGER NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS patches (
+                    id INTEGER PRIMARY KEY,
+                    base_name TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    filename TEXT NOT NULL,
+                    archived_at TEXT NOT NULL,
+                    error_signature TEXT,
+                    reverted INTEGER NOT NULL DEFAULT 0,
+                    UNIQUE (base_name, seq)
+                );
+                CREATE TABLE IF NOT EXISTS patch_targets (
+                    patch_id INTEGER NOT NULL REFERENCES patches(id),
+                    target_file TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_patch_targets_file ON patch_targets (target_file);
+                CREATE INDEX IF NOT EXISTS idx_patches_signature ON patches (error_signature);
+            """)
+            # reverted 列がなかった頃の索引
+            columns = [row["name"] for row in self.conn.execute("PRAGMA table_info(patches)")]
+            if "reverted" not in columns:
+                self.conn.execute("ALTER TABLE patches ADD COLUMN reverted INTEGER NOT NULL DEFAULT 0")
+
+    def _get_meta(self, key):
+        row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def _insert_patch(self, base_name, seq, filename, archived_at, error_signature, targets):
+        cur = self.conn.execute(
+            "INSERT INTO patches (base_name, seq, filename, archived_at, error_signature) VALUES (?, ?, ?, ?, ?)",
+            (base_name, seq, filename, archived_at, error_signature)
+        )
+        self.conn.executemany(
+            "INSERT INTO patch_targets (patch_id, target_file) VALUES (?, ?)",
+            [(cur.lastrowid, t) for t in targets]
+        )
+
+    def _bootstrap(self):
+        """
+        既存の done ディレクトリの差分ファイルを索引に取り込む（初回のみ）。
+        """
+        with self.conn:
+            with os.scandir(self.done_dir) as it:
+                for entry in it:
+                    parsed = _split_archived_name(entry.name)
+                    if not parsed:
+                        continue
+                    base_name, seq = parsed
+                    archived_at = datetime.fromtimestamp(entry.stat().st_mtime).isoformat(timespec="seconds")
+                    self.conn.execute(
+                        "INSERT OR IGNORE INTO patches (base_name, seq, filename, archived_at) VALUES (?, ?, ?, ?)",
+                        (base_name, seq, entry.name, archived_at)
+                    )
+                    row = self.conn.execute(
+                        "SELECT id FROM patches WHERE base_name = ? AND seq = ?", (base_name, seq)
+                    ).fetchone()
+                    self.conn.executemany(
+                        "INSERT INTO patch_targets (patch_id, target_file) VALUES (?, ?)",
+                        [(row["id"], t) for t in _targets_in_diff(entry.path)]
+                    )
+            self.conn.execute("""
+                INSERT OR REPLACE INTO sequences (base_name, last_seq)
+                SELECT base_name, MAX(seq) FROM patches GROUP BY base_name
+            """)
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('bootstrapped', ?)",
+                              (datetime.now().isoformat(timespec="seconds"),))
+
+    def max_sequence(self, base_name):
+        row = self.conn.execute("SELECT last_seq FROM sequences WHERE base_name = ?", (base_name,)).fetchone()
+        return row["last_seq"] if row else 0
+
+    def archive(self, diff_filepath, error_signature=None):
+        """
+        diff_filepath を done_dir に連番付きで移動し、索引に登録する。
+        戻り値: 移動先のパス
+        """
+        base_name = os.path.basename(diff_filepath).replace("-dff.txt", "")
+        targets = _targets_in_diff(diff_filepath)
+        archived_at = datetime.now().isoformat(timespec="seconds")
+        with self.conn:
+            self.conn.execute("""
+                INSERT INTO sequences (base_name, last_seq) VALUES (?, 1)
+                ON CONFLICT (base_name) DO UPDATE SET last_seq = last_seq + 1
+            """, (base_name,))
+            next_seq = self.max_sequence(base_name)
+            new_filename = f"{base_name}-{next_seq:02d}-dff.txt"
+            dest_path = os.path.join(self.done_dir, new_filename)
+            self._insert_patch(base_name, next_seq, new_filename, archived_at, error_signature, targets)
+            # 移動に失敗したら例外で索引への登録も取り消される
+            os.rename(diff_filepath, dest_path)
+        return dest_path
+
+    def mark_reverted(self, archived_path):
+        """
+        archive() した差分を、適用後に元に戻したものとして記録する（過去の修正の例として使わない）。
+        """
+        with self.conn:
+            self.conn.execute("UPDATE patches SET reverted = 1 WHERE filename = ?", (os.path.basename(archived_path),))
+
+    def fixes_for_file(self, target_file):
+        """
+        target_file（プロジェクトルートからの相対パス、"/" 区切り）に適用した差分を古い順に返す。
+        """
+        rows = self.conn.execute("""
+            SELECT p.base_name, p.seq, p.filename, p.archived_at, p.error_signature
+            FROM patches p JOIN patch_targets t ON t.patch_id = p.id
+            WHERE t.target_file = ?
+            ORDER BY p.archived_at, p.id
+        """, (target_file.replace("\\", "/"),)).fetchall()
+        return [dict(row, path=os.path.join(self.done_dir, row["filename"])) for row in rows]
+
+    def fixes_for_signature(self, error_signature):
+        rows = self.conn.execute("""
+            SELECT base_name, seq, filename, archived_at, error_signature
+            FROM patches WHERE error_signature = ?
+            ORDER BY archived_at, id
+        """, (error_signature,)).fetchall()
+        return [dict(row, path=os.path.join(self.done_dir, row["filename"])) for row in rows]
+
+
+def get_archive(done_dir):
+    key = os.path.abspath(done_dir)
+    if key not in _archives:
+        _archives[key] = DiffArchive(key)
+    return _archives[key]
@@ -0,0 +1,141 @@
+import re
+
+# コードフェンスの開始行（例: "```python", "```python agents/foo.py", "~~~py"）
+OPEN_FENCE_PATTERN = re.compile(r"^[ \t]*(`{3,}|~{3,})[ \t]*([^\s`:]*)[ \t:]*(.*?)\s*$")
+# ファイル名らしい文字列（例: "agents/foo.py", "Config\\config.json"）
+PATH_PATTERN = re.compile(r"([\w.\-]+(?:[/\\][\w.\-]+)*\.[A-Za-z]\w*)")
+# コードの 1 行目のコメントに書かれたファイル名（例: "# agents/foo.py", "# file: foo.py"）
+COMMENT_PATH_PATTERN = re.compile(r"^\s*(?:#|//)\s*(?:(?:file|filename|path|ファイル)\s*[:：]\s*)?([\w.\-]+(?:[/\\][\w.\-]+)*\.\w+)\s*$",
+                                  re.IGNORECASE)
+
+PYTHON_LANGS = ("python", "py", "python3")
+
+
+class CodeBlock:
+    """
+    回答の中の 1 つのコードフェンス。
+    lang は言語名（"python" など。なければ ""）、hint は変更対象のファイル名の手がかり（なければ None）。
+    end は回答の先頭から閉じフェンスの行末までの文字数（そこまでで回答を打ち切れる）。
+    """
+
+    def __init__(self, lang, code, hint=None, end=None):
+        self.lang = lang
+        self.code = code
+        self.hint = hint
+        self.end = end
+
+    @property
+    def is_python(self):
+        return self.lang.lower() in PYTHON_LANGS
+
+    def __repr__(self):
+        return f"CodeBlock({self.lang!r}, {len(self.code)} chars, hint={self.hint!r})"
+
+
+def _path_in(text):
+    match = PATH_PATTERN.search(text or "")
+    return match.group(1) if match else None
+
+
+class FenceParser:
+    """
+    回答を少しずつ受け取り（ストリーミング）、コードフェンスが閉じた時点でそのブロックを返す。
+    回答全体が届くのを待たずにコードを取り出せる。
+
+        parser = FenceParser()
+        for text in chunks:
+            for block in parser.feed(text):
+                ...
+        blocks = parser.close()   # 最後まで閉じなかったブロック
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.consumed = 0
+        self._partial = ""
+        self._last_prose = ""
+        self._fence = None
+        self._lang = ""
+        self._info = ""
+        self._prose_hint = None
+        self._lines = []
+
+    @property
+    def in_block(self):
+        return self._fence is not None
+
+    def feed(self, text):
+        """
+        text を追加し、新しく閉じたコードブロックのリストを返す。
+        """
+        completed = []
+        self._partial += text
+        while True:
+            newline = self._partial.find("\n")
+            if newline < 0:
+                break
+            line = self._partial[:newline + 1]
+            self._partial = self._partial[newline + 1:]
+            self.consumed += len(line)
+            block = self._feed_line(line)
+            if block is not None:
+                completed.append(block)
+        return completed
+
+    def close(self):
+        """
+        回答の終わり。改行で終わっていない最後の行を処理し、新しく閉じたブロックを返す。
+        閉じフェンスがないまま終わったブロックも、そこまでの内容で返す。
+        """
+        completed = []
+        if self._partial:
+            line, self._partial = self._partial, ""
+            self.consumed += len(line)
+            block = self._feed_line(line)
+            if block is not None:
+                completed.append(block)
+        if self._fence is not None:
+            completed.append(self._finish())
+        return completed
+
+    def _feed_line(self, line):
+        text = line.rstrip("\r\n")
+        if self._fence is None:
+            match = OPEN_FENCE_PATTERN.match(text)
+            if match:
+                self._fence = match.group(1)
+                self._lang = match.group(2)
+                self._info = match.group(3)
+                self._prose_hint = _path_in(self._last_prose)
+                self._lines = []
+            elif text.strip():
+                self._last_prose = text
+            return None
+
+        stripped = text.strip()
+        if stripped and stripped[0] == self._fence[0] and set(stripped) == {self._fence[0]} \
+                and len(stripped) >= len(self._fence):
+            return self._finish()
+        self._lines.append(line)
+        return None
+
+    def _finish(self):
+        code = "".join(self._lines)
+        first_line = next((l for l in self._lines if l.strip()), "")
+        comment = COMMENT_PATH_PATTERN.match(first_line)
+        hint = _path_in(self._info) or (comment.group(1) if comment else None) or self._prose_hint
+        block = CodeBlock(self._lang, code, hint, self.consumed)
+        self.blocks.append(block)
+        self._fence = None
+        self._last_prose = ""
+        self._lines = []
+        return block
+
+
+def parse_blocks(text):
+    """
+    回答全体からコードブロックをすべて取り出す（出現順）。
+    """
+    parser = FenceParser()
+    blocks = parser.feed(text)
+    return blocks + parser.close()
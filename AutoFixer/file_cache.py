@@ -0,0 +1,222 @@
+import os
+import mmap
+import shutil
+import tempfile
+from itertools import accumulate
+
+from timing import count
+
+# これより大きいファイルはメモリに読み込まず mmap で開く
+MMAP_THRESHOLD = 8 * 1024 * 1024
+
+# ファイルパス → CachedFile
+_cache = {}
+
+
+class CachedFile:
+    """
+    1 ファイル分の内容（bytes または mmap）と行頭オフセットの索引。
+    offsets[i] は i 行目（0 始まり）の先頭バイト位置。行の索引は必要な行まで遅延して作る。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        st = os.stat(path)
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self._mmap = None
+        if self.size >= MMAP_THRESHOLD:
+            with open(path, "rb") as f:
+                self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data = self._mmap
+            self.offsets = [0]
+            self._complete = self.size == 0
+        else:
+            with open(path, "rb") as f:
+                self.data = f.read()
+            self._set_offsets_from_bytes()
+            count("bytes_read", self.size)
+
+    def _set_offsets_from_bytes(self):
+        # split は C で実行されるので、Python で 1 行ずつ find するより速い
+        lengths = [len(l) + 1 for l in self.data.split(b"\n")]
+        offsets = [0] + list(accumulate(lengths))
+        # 最後の要素は「ファイル末尾 + 1」なので取り除く。末尾が改行で終わる場合は空行も除く
+        offsets.pop()
+        if len(offsets) > 1 and offsets[-1] >= len(self.data):
+            offsets.pop()
+        if not self.data:
+            offsets = []
+        self.offsets = offsets
+        self._complete = True
+
+    def is_stale(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return st.st_mtime_ns != self.mtime_ns or st.st_size != self.size
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+
+    def _index_until(self, line_count):
+        """
+        line_count 行分（またはファイル末尾まで）の行頭オフセットを用意する。
+        """
+        offsets = self.offsets
+        while not self._complete and len(offsets) < line_count + 1:
+            pos = self.data.find(b"\n", offsets[-1])
+            if pos == -1 or pos + 1 >= self.size:
+                self._complete = True
+                break
+            offsets.append(pos + 1)
+
+    def line_count(self):
+        self._index_until(float("inf"))
+        return len(self.offsets)
+
+    def line_span(self, first, last):
+        """
+        first〜last 行目（1 始まり、両端を含む）のバイト範囲 (開始, 終了) を返す。
+        """
+        self._index_until(last + 1)
+        count = len(self.offsets)
+        first = max(1, first)
+        last = min(last, count)
+        if first > last:
+            pos = self.offsets[first - 1] if first <= count else self.size
+            return pos, pos
+        start = self.offsets[first - 1]
+        end = self.offsets[last] if last < count else self.size
+        return start, end
+
+    def lines(self, first, last):
+        """
+        first〜last 行目（1 始まり、両端を含む）を改行コード付きの文字列リストで返す。
+        ファイル全体ではなく、その範囲だけをデコードする。
+        """
+        start, end = self.line_span(first, last)
+        # str.splitlines は \x0c なども改行扱いするので "\n" だけで分割する
+        parts = self.data[start:end].decode("utf-8").split("\n")
+        lines = [p + "\n" for p in parts[:-1]]
+        if parts[-1]:
+            lines.append(parts[-1])
+        return lines
+
+
+def get_file(filepath):
+    """
+    filepath のキャッシュを返す。mtime かサイズが変わっていれば読み直す。
+    """
+    key = os.path.abspath(filepath)
+    entry = _cache.get(key)
+    if entry is None or entry.is_stale():
+        if entry is not None:
+            entry.close()
+        entry = CachedFile(key)
+        _cache[key] = entry
+    return entry
+
+
+def invalidate(filepath):
+    entry = _cache.pop(os.path.abspath(filepath), None)
+    if entry is not None:
+        entry.close()
+
+
+def read_line_range(filepath, first, last):
+    return get_file(filepath).lines(first, last)
+
+
+def read_all_lines(filepath):
+    entry = get_file(filepath)
+    return entry.lines(1, entry.line_count())
+
+
+def line_count(filepath):
+    return get_file(filepath).line_count()
+
+
+def detect_newline(filepath):
+    """
+    ファイルの 1 行目の改行コードを返す（改行がなければ os.linesep）。
+    """
+    entry = get_file(filepath)
+    first = entry.lines(1, 1)
+    if first and first[0].endswith("\r\n"):
+        return "\r\n"
+    if first and first[0].endswith("\n"):
+        return "\n"
+    return os.linesep
+
+
+def splice_lines(filepath, first, last, new_text):
+    """
+    first〜last 行目（1 始まり、両端を含む）を new_text で置き換えてファイルに書き込む。
+    last = first - 1 なら first 行目の前に挿入する。
+    new_text は改行コードを含めてそのまま書き込む。
+
+    write_text と同じく一時ファイルに書いてから置き換えるので、途中で失敗しても
+    元のファイルが中途半端な状態で残ることはない。置換位置の前後はキャッシュの内容をそのまま使う。
+    """
+    entry = get_file(filepath)
+    start, end = entry.line_span(first, last)
+    new_bytes = new_text.encode("utf-8")
+    data = None if entry._mmap is not None else entry.data
+
+    def write(f):
+        with memoryview(entry.data) as view:
+            f.write(view[:start])
+            f.write(new_bytes)
+            f.write(view[end:])
+
+    _replace_file(filepath, write)
+
+    if data is not None:
+        updated = CachedFile.__new__(CachedFile)
+        updated.path = os.path.abspath(filepath)
+        updated._mmap = None
+        updated.data = data[:start] + new_bytes + data[end:]
+        updated._set_offsets_from_bytes()
+        st = os.stat(filepath)
+        updated.mtime_ns = st.st_mtime_ns
+        updated.size = st.st_size
+        _cache[updated.path] = updated
+    return True
+
+
+def write_text(filepath, text):
+    """
+    ファイル全体を text で書き換え、キャッシュを破棄する。
+    同じディレクトリの一時ファイルに書いてから置き換えるので、
+    途中で失敗しても元のファイルが中途半端な状態で残ることはない。
+    text は改行コードを含めてそのまま書き込む。
+    """
+    invalidate(filepath)
+    _replace_file(filepath, lambda f: f.write(text.encode("utf-8")))
+
+
+def _replace_file(filepath, write):
+    """
+    write(f) でバイナリの一時ファイル f（filepath と同じディレクトリ）に書き込み、filepath と置き換える。
+    置き換える直前に filepath のキャッシュを破棄する。
+    """
+    directory = os.path.dirname(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+            written = f.tell()
+        if os.path.exists(filepath):
+            shutil.copymode(filepath, tmp_path)
+        # Windows では mmap 中のファイルを置き換えられないので先に閉じる
+        invalidate(filepath)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    count("bytes_written", written)
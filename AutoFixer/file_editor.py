@@ -1,39 +1,42 @@
 import os
 import difflib
+import textwrap
 from pathlib import Path
 
+import file_cache
+from timing import timed
+from symbol_index import find_symbol
+
 def read_lines(filepath):
-    with open(filepath, "r", encoding="utf-8") as f:
-        return f.readlines()
+    return file_cache.read_all_lines(filepath)
 
+@timed("file_editor.read_context_lines")
 def read_context_lines(filepath, lineno, context):
     """
     指定された行番号を中心に前後の context 行数を含めて返す。
+    ファイル全体ではなく、その範囲の行だけを読み出す。
     戻り値: [(行番号, 行テキスト), ...]
     """
-    lines = read_lines(filepath)
-    start = max(0, lineno - context - 1)
-    end = min(len(lines), lineno + context)
-    return [(i + 1, lines[i].rstrip()) for i in range(start, end)]
+    start = max(1, lineno - context)
+    lines = file_cache.read_line_range(filepath, start, lineno + context)
+    return [(start + i, line.rstrip()) for i, line in enumerate(lines)]
 
 def read_target_line_only(filepath, lineno):
-    with open(filepath, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-    if 1 <= lineno <= len(lines):
-        return lines[lineno - 1]
-    return ""
+    if lineno < 1:
+        return ""
+    lines = file_cache.read_line_range(filepath, lineno, lineno)
+    return lines[0] if lines else ""
 
 
+@timed("file_editor.replace_line_in_file")
 def replace_line_in_file(filepath, lineno, new_line):
     """
     指定ファイルの lineno（1始まり）の行を new_line に置き換える。
     元の改行コード（\n または \r\n）を保持して上書きする。
     """
     try:
-        lines = read_lines(filepath)
-        if 1 <= lineno <= len(lines):
-            old_line = lines[lineno - 1]
-
+        old_line = read_target_line_only(filepath, lineno)
+        if old_line:
             # 改行コードを判別
             if old_line.endswith('\r\n'):
                 newline = '\r\n'
@@ -42,54 +45,98 @@ def replace_line_in_file(filepath, lineno, new_line):
             else:
                 newline = ''
 
-            lines[lineno - 1] = new_line.rstrip() + newline
-
-            with open(filepath, "w", encoding="utf-8") as f:
-                f.writelines(lines)
-            return True
+            return file_cache.splice_lines(filepath, lineno, lineno, new_line.rstrip() + newline)
         else:
             return False
     except Exception as e:
         print(f"行置換エラー: {e}")
         return False
 
-def replace_function_in_file(filepath, function_name, new_code):
+def _function_replacement(filepath, function_name, new_code):
     """
-    指定ファイル内の function_name に一致する関数定義を new_code で置換。
-    関数定義の開始〜次の関数/クラス定義の直前までを対象とする。
+    function_name の定義を new_code で置き換えるための (開始行, 終了行, 新しいテキスト) を返す。
+    行番号は 1 始まりで終了行を含む。見つからなければ None。
     """
     try:
-        lines = read_lines(filepath)
-        start = end = None
+        symbol = find_symbol(filepath, function_name)
+    except SyntaxError:
+        symbol = None
+        start, end = _find_function_by_scan(read_lines(filepath), function_name)
+    else:
+        if symbol is None:
+            start = end = None
+        else:
+            start, end = symbol.start - 1, symbol.end
 
-        for i, line in enumerate(lines):
-            if line.strip().startswith(f"def {function_name}("):
-                start = i
-                break
+    if start is None:
+        return None
 
-        if start is None:
-            print(f"関数 {function_name} が見つかりません。")
-            return False
+    code = textwrap.dedent(new_code).strip()
+    # 新しいコードにデコレータがなければ、元の @staticmethod などは残して def 行から置き換える
+    if symbol and symbol.def_line > symbol.start and not code.startswith("@"):
+        start = symbol.def_line - 1
 
-        # 関数終了行を検出
-        for j in range(start + 1, len(lines)):
-            if lines[j].strip().startswith(("def ", "class ")):
-                end = j
-                break
-        if end is None:
-            end = len(lines)
+    # 差し替え（インデントを元の定義に揃える）
+    indent = symbol.indent if symbol else 0
+    body = textwrap.indent(code, " " * indent)
+    newline = file_cache.detect_newline(filepath)
+    new_text = "".join(l + newline for l in body.splitlines())
+    return start + 1, end, new_text
 
-        # 差し替え
-        new_lines = [l + "\n" for l in new_code.strip().splitlines()]
-        lines[start:end] = new_lines
-
-        with open(filepath, "w", encoding="utf-8") as f:
-            f.writelines(lines)
-        return True
+@timed("file_editor.replace_function_in_file")
+def replace_function_in_file(filepath, function_name, new_code):
+    """
+    指定ファイル内の function_name に一致する関数・メソッド・クラス定義を new_code で置換。
+    function_name は "関数名" または "クラス名.メソッド名"。
+    ast のシンボルインデックスで位置（デコレータを含む開始行〜終了行）を求め、
+    new_code のインデントは置換先に合わせる。
+    ファイルが ast で解析できない場合は、行頭の "def 関数名(" から次の def/class までを対象とする。
+    """
+    try:
+        replacement = _function_replacement(filepath, function_name, new_code)
+        if replacement is None:
+            print(f"関数 {function_name} が見つかりません。")
+            return False
+        return file_cache.splice_lines(filepath, *replacement)
     except Exception as e:
         print(f"関数置換エラー: {e}")
         return False
 
+def preview_function_replacement(filepath, function_name, new_code):
+    """
+    replace_function_in_file と同じ置換をしたあとのファイル全体のテキストを返す（書き込まない）。
+    関数が見つからなければ None。
+    """
+    replacement = _function_replacement(filepath, function_name, new_code)
+    if replacement is None:
+        return None
+    first, last, new_text = replacement
+    lines = read_lines(filepath)
+    return "".join(lines[:first - 1]) + new_text + "".join(lines[last:])
+
+def _find_function_by_scan(lines, function_name):
+    """
+    ast で解析できないファイル用。行頭の "def 関数名(" から次の def/class の直前までを返す。
+    戻り値: (開始インデックス, 終了インデックス) 見つからなければ (None, None)
+    """
+    start = end = None
+    for i, line in enumerate(lines):
+        if line.strip().startswith(f"def {function_name}("):
+            start = i
+            break
+
+    if start is None:
+        return None, None
+
+    # 関数終了行を検出
+    for j in range(start + 1, len(lines)):
+        if lines[j].strip().startswith(("def ", "class ")):
+            end = j
+            break
+    if end is None:
+        end = len(lines)
+    return start, end
+
 def write_new_class_file(project_root, class_name, code):
     """
     指定された class_name を元に、project_root 配下に <class_name>.py を新規作成。
@@ -108,88 +155,173 @@ def write_new_class_file(project_root, class_name, code):
         print(f"ファイル作成エラー: {e}")
         return False
 
-def generate_diff_file(original_lines, new_lines, context_line_info, target_filepath, output_dir,lineno, context):
+def default_project_root(target_filepath):
+    project_root = os.environ.get("PROJECT_ROOT")
+    if not project_root:
+        project_root = os.path.abspath(os.path.join(target_filepath, os.pardir, os.pardir))
+    return project_root
+
+class DiffBatch:
+    """
+    複数ファイル・複数箇所の修正をためておき、1 つのパッチ（unified diff）にまとめる。
+    各修正は「start_lineno 行目から始まる original_lines を new_lines に置き換える」形で登録する。
+    ハンクの行番号はファイル全体の差分から求めるので、同じファイルに何箇所修正があっても正しくなる。
+    """
+
+    def __init__(self, project_root=None, context=3):
+        self.project_root = project_root
+        self.context = context
+        # 絶対パス → [(開始行番号(1始まり), 元の行リスト, 新しい行リスト), ...]
+        self.fixes = {}
+        # 絶対パス → [各修正の error_signature, ...]（fixes と同じ順）
+        self.signatures = {}
+
+    def __len__(self):
+        return sum(len(v) for v in self.fixes.values())
+
+    def add_fix(self, target_filepath, start_lineno, original_lines, new_lines, error_signature=None):
+        """
+        修正を登録する。original_lines / new_lines は改行なし・末尾の空白は無視して比較する。
+        error_signature は parts() で修正ごとに Diff/done の索引に記録するためのもの。
+        """
+        target_filepath = os.path.abspath(target_filepath)
+        self.fixes.setdefault(target_filepath, []).append(
+            (start_lineno, [l.rstrip() for l in original_lines], [l.rstrip() for l in new_lines])
+        )
+        self.signatures.setdefault(target_filepath, []).append(error_signature)
+
+    def _replacements(self, lines, fixes):
+        """
+        各修正を変更のある最小範囲の置換 (開始index, 終了index, 新しい行) に分解する。
+        修正前の内容がファイルと合わない場合や、修正同士が重なる場合は ValueError。
+        """
+        replacements = []
+        for start_lineno, original, new in fixes:
+            base = start_lineno - 1
+            actual = [l.rstrip() for l in lines[base:base + len(original)]]
+            if actual != original:
+                raise ValueError(f"{start_lineno} 行目からの内容が修正前の内容と一致しません")
+            matcher = difflib.SequenceMatcher(None, original, new, autojunk=False)
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                if tag != "equal":
+                    replacements.append((base + i1, base + i2, new[j1:j2]))
+
+        # 同じエラーに対する同じ修正が 2 回登録されても 1 つとして扱う
+        unique = {(start, end, tuple(new)) for start, end, new in replacements}
+        replacements = sorted(unique)
+        for prev, cur in zip(replacements, replacements[1:]):
+            if cur[0] < prev[1] or cur[0] == prev[0]:
+                raise ValueError(f"{prev[0] + 1} 行目付近の修正が重なっています")
+        return [(start, end, list(new)) for start, end, new in replacements]
+
+    @timed("file_editor.DiffBatch.render")
+    def render(self):
+        """
+        登録された修正をまとめたパッチを文字列で返す。
+        """
+        out = []
+        for target_filepath in sorted(self.fixes):
+            project_root = self.project_root or default_project_root(target_filepath)
+            # WindowsのバックスラッシュをUNIXスタイルに変換（Git apply対策）
+            rel_path = os.path.relpath(target_filepath, start=project_root).replace("\\", "/")
+
+            raw_lines = file_cache.read_all_lines(target_filepath)
+            lines = [l.rstrip("\r\n") for l in raw_lines]
+            new_lines = list(lines)
+            # 後ろから置き換えれば前の修正の行番号がずれない
+            for start, end, replacement in reversed(self._replacements(lines, self.fixes[target_filepath])):
+                new_lines[start:end] = replacement
+
+            # 改行で終わっていないファイルは、修正後も最後の行を改行なしにする
+            old_text_lines = [l + "\n" for l in lines]
+            new_text_lines = [l + "\n" for l in new_lines]
+            if raw_lines and not raw_lines[-1].endswith("\n"):
+                for text_lines in (old_text_lines, new_text_lines):
+                    if text_lines:
+                        text_lines[-1] = text_lines[-1][:-1]
+
+            hunks = list(difflib.unified_diff(
+                old_text_lines,
+                new_text_lines,
+                fromfile=f"a/{rel_path}",
+                tofile=f"b/{rel_path}",
+                lineterm="\n",
+                n=self.context  # 前後の行のコンテキスト
+            ))
+            if hunks:
+                out.append(f"diff --git a/{rel_path} b/{rel_path}")
+                for line in hunks:
+                    if line.endswith("\n"):
+                        out.append(line[:-1])
+                    else:
+                        out.append(line)
+                        out.append("\\ No newline at end of file")
+        return "".join(line + "\n" for line in out)
+
+    def parts(self):
+        """
+        登録された修正を 1 件ずつのパッチにする（適用前に呼ぶこと）。
+        戻り値: [(対象ファイルの絶対パス, パッチの文字列, error_signature), ...]
+        """
+        result = []
+        for target_filepath in sorted(self.fixes):
+            for fix, signature in zip(self.fixes[target_filepath], self.signatures[target_filepath]):
+                single = DiffBatch(self.project_root, self.context)
+                single.fixes[target_filepath] = [fix]
+                single.signatures[target_filepath] = [signature]
+                result.append((target_filepath, single.render(), signature))
+        return result
+
+    def write(self, diff_filename):
+        with open(diff_filename, "w", encoding="utf-8", newline="\n") as f:
+            f.write(self.render())
+        print(f"✅ 差分ファイルを生成しました: {diff_filename}")
+        return diff_filename
+
+@timed("file_editor.generate_diff_file")
+def generate_diff_file(original_lines, new_lines, context_line_info, target_filepath, output_dir,lineno, context, batch=None, project_root=None, error_signature=None):
     """
     差分ファイル（unified diff 形式）を <元ファイル名>-dff.txt として保存する。
+    batch（DiffBatch）を渡した場合はファイルに書かず、batch に修正を追加するだけにする。
 
     Parameters:
     - original_lines: 修正前の行リスト（str）
     - new_lines: 修正後の行リスト（str）
-    - context_line_info: [(行番号, 行内容)] のリスト（見た目確認のため）
+    - context_line_info: [(行番号, 行内容)] のリスト（original_lines の先頭の行番号を取得する）
     - target_filepath: 修正対象の .py ファイルの絶対パス
     - output_dir: 差分ファイルの保存先（通常は BASE_DIR/Diff）
     -- lineno:エラー発生の行番号
+    - context: 差分の前後に含める行数
+    - batch: 修正をためておく DiffBatch
+    - project_root: 差分のパスの基準（省略時は target_filepath の 2 つ上のフォルダ）
+    - error_signature: batch に追加する修正のエラー内容（"エラー種別: メッセージ"）
     """
-    project_root = os.environ.get("PROJECT_ROOT")
-    if not project_root:
-        project_root = os.path.abspath(os.path.join(target_filepath, os.pardir, os.pardir))
-
-    # WindowsのバックスラッシュをUNIXスタイルに変換（Git apply対策）
-    rel_path = os.path.relpath(target_filepath, start=project_root).replace("\\", "/")
-    #rel_path = os.path.basename(target_filepath)
-    diff_header = f"diff --git a/{rel_path} b/{rel_path}"
-    filename = Path(target_filepath).name
-    diff_filename = os.path.join(output_dir, f"{filename}-dff.txt")
-
-
-    diff = [diff_header] + list(difflib.unified_diff(
-        original_lines,
-        new_lines,
-        fromfile=f"a/{rel_path}",
-        tofile=f"b/{rel_path}",
-        lineterm="",
-        n=context  # 前後の行のコンテキスト
-    ))
-
-    # context_line_info の最初の行番号を取得
-    # start_lineno = lineno
     start_lineno = context_line_info[0][0]
-    # 削除行数・追加行数を算出
-    delete_count = len(original_lines)
-    add_count = len(new_lines)
-
-    # ハンクヘッダー（@@ -x +x @@）の行番号を書き換え
-    diff = list(diff)
-    for i, line in enumerate(diff):
-        if line.startswith("@@ "):
-            # diff[i] = f"@@ -{start_lineno} +{start_lineno} @@"
-            diff[i] = f"@@ -{start_lineno},{delete_count} +{start_lineno},{add_count} @@"
-            break
-    newline_code = os.linesep # 改行コードの取得
-    with open(diff_filename, "w", encoding="utf-8", newline="\n") as f:
-        for line in diff:
-            if not line.endswith("\n"):
-                f.write(line + "\n")
-            else:
-                f.write(line)
-
+    if batch is not None:
+        batch.add_fix(target_filepath, start_lineno, original_lines, new_lines, error_signature)
+        return None
 
-    print(f"✅ 差分ファイルを生成しました: {diff_filename}")
+    single = DiffBatch(project_root, context=context)
+    single.add_fix(target_filepath, start_lineno, original_lines, new_lines)
+    filename = Path(target_filepath).name
+    return single.write(os.path.join(output_dir, f"{filename}-dff.txt"))
 
 def get_max_sequence_in_done(base_name, done_dir):
     """
     done_dir 内の base_name に関連するファイル名の最大連番を取得する。
     例: base_name='Script.py' → Script.py-01-dff.txt を探す。
+    done_dir の索引（diff_archive）を参照するので、ディレクトリは走査しない。
     """
-    max_seq = 0
-    for filename in os.listdir(done_dir):
-        if filename.startswith(base_name) and filename.endswith("-dff.txt"):
-            parts = filename.replace("-dff.txt", "").split("-")
-            if len(parts) >= 2 and parts[-1].isdigit():
-                seq = int(parts[-1])
-                if seq > max_seq:
-                    max_seq = seq
-    return max_seq
+    from diff_archive import get_archive
+    return get_archive(done_dir).max_sequence(base_name)
 
-def move_diff_to_done(diff_filepath, done_dir):
+@timed("file_editor.move_diff_to_done")
+def move_diff_to_done(diff_filepath, done_dir, error_signature=None):
     """
     diff_filepath を done_dir に移動し、連番付きファイル名にする。
+    移動した差分は対象ファイル・エラー内容（error_signature）とともに索引に登録する。
     """
-    os.makedirs(done_dir, exist_ok=True)
-    base_name = os.path.basename(diff_filepath).replace("-dff.txt", "")
-    max_seq = get_max_sequence_in_done(base_name, done_dir)
-    next_seq = max_seq + 1
-    new_filename = f"{base_name}-{next_seq:02d}-dff.txt"
-    dest_path = os.path.join(done_dir, new_filename)
-    os.rename(diff_filepath, dest_path)
+    from diff_archive import get_archive
+    dest_path = get_archive(done_dir).archive(diff_filepath, error_signature)
     print(f"✅ 差分ファイルを {dest_path} に移動しました。")
+    return dest_path
@@ -0,0 +1,345 @@
+import os
+import re
+import json
+import random
+import difflib
+import hashlib
+import keyword
+from datetime import datetime
+
+from diff_archive import get_archive
+
+# 1 行のコードを字句に分ける（文法エラーのある行でも分けられるよう tokenize は使わない）
+TOKEN_PATTERN = re.compile(r"""
+    (?P<comment>\#.*)
+  | (?P<string>[rRbBuUfF]{0,2}(?:'''|\"\"\"|'(?:[^'\\\n]|\\.)*'?|"(?:[^"\\\n]|\\.)*"?))
+  | (?P<number>\d[\w.]*)
+  | (?P<name>[^\W\d]\w*)
+  | (?P<op>\*\*=?|//=?|->|:=|[<>=!]=|<<=?|>>=?|[-+*/%&|^@]=|\S)
+""", re.VERBOSE)
+QUOTED_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"")
+NUMBER_PATTERN = re.compile(r"\b\d+(\.\d+)?\b")
+# diff の 1 ハンクで、これより多くの行を変えた修正は 1 行の修正の例として使わない
+MAX_PAIRED_LINES = 3
+# 類似度の計算でのエラー種別・メッセージの重み
+TYPE_WEIGHT = 4
+MESSAGE_WEIGHT = 2
+
+NUM_PERM = 64
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)
+_PERMS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+# done_dir → FixIndex
+_indexes = {}
+
+
+class Token:
+    def __init__(self, kind, text, start, end):
+        self.kind = kind
+        self.text = text
+        self.start = start
+        self.end = end
+
+    @property
+    def shape(self):
+        """
+        識別子・数値・文字列を種類だけにした字句（キーワードはそのまま）。
+        """
+        if self.kind == "name" and not keyword.iskeyword(self.text):
+            return "N"
+        if self.kind == "number":
+            return "0"
+        if self.kind == "string":
+            return "S"
+        return self.text
+
+
+def tokenize_line(line):
+    return [Token(m.lastgroup, m.group(), m.start(), m.end())
+            for m in TOKEN_PATTERN.finditer(line) if m.lastgroup != "comment"]
+
+
+def code_shape(line):
+    """
+    行の「形」。例: "if count == 10" → "if N == 0"
+    """
+    return " ".join(t.shape for t in tokenize_line(line))
+
+
+def split_signature(signature):
+    """
+    "NameError: name 'foo' is not defined" → ("NameError", "name S is not defined")
+    """
+    exc_type, _, message = (signature or "").partition(":")
+    message = QUOTED_PATTERN.sub("S", message.strip().lower())
+    message = NUMBER_PATTERN.sub("0", message)
+    return exc_type.strip(), message
+
+
+def features(signature, line):
+    """
+    MinHash に使う特徴の集合（エラー種別・メッセージの単語 2-gram・行の形の字句 3-gram）。
+    行の形が違っても同じエラーなら似ているとみなせるよう、エラー種別とメッセージは重みを付けて
+    （番号を付けて複数個）入れる。
+    """
+    exc_type, message = split_signature(signature)
+    result = {f"t{i}:{exc_type}" for i in range(TYPE_WEIGHT)}
+    words = message.split()
+    for i in range(max(1, len(words) - 1)):
+        result.update(f"m{k}:{' '.join(words[i:i + 2])}" for k in range(MESSAGE_WEIGHT))
+    shape = [t.shape for t in tokenize_line(line)]
+    padded = ["^"] + shape + ["$"]
+    result.update(f"s:{' '.join(padded[i:i + 3])}" for i in range(max(1, len(padded) - 2)))
+    return result
+
+
+def minhash(feature_set):
+    hashes = [int.from_bytes(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest(), "big")
+              for f in feature_set]
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS]
+
+
+def similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+def _band_keys(signature):
+    return [f"{band}:" + hashlib.blake2b(json.dumps(signature[band * ROWS:(band + 1) * ROWS]).encode(),
+                                         digest_size=8).hexdigest()
+            for band in range(BANDS)]
+
+
+def changed_line_pairs(diff_text):
+    """
+    差分から「変更前の行 → 変更後の行」の組を取り出す。
+    削除行と追加行が同じ数だけ続く箇所（1〜MAX_PAIRED_LINES 行）だけを対象にする。
+    """
+    pairs = []
+    removed, added = [], []
+
+    def flush():
+        if removed and len(removed) == len(added) and len(removed) <= MAX_PAIRED_LINES:
+            pairs.extend((old, new) for old, new in zip(removed, added) if old.strip() != new.strip())
+        removed.clear()
+        added.clear()
+
+    for line in diff_text.splitlines():
+        if line.startswith(("---", "+++")):
+            flush()
+        elif line.startswith("-"):
+            if added:
+                flush()
+            removed.append(line[1:])
+        elif line.startswith("+"):
+            added.append(line[1:])
+        else:
+            flush()
+    flush()
+    return pairs
+
+
+def transfer_edit(before, after, line):
+    """
+    過去の修正（before → after）と同じ変更を line に当てはめた行を返す。当てはめられなければ None。
+    - line の形が before と同じなら、字句の位置を対応させて変更を写す（識別子などは line のものを使う）
+    - 形が違っても、行末（行頭）に記号を足すだけの修正ならそのまま行末（行頭）に足す
+    """
+    old_tokens, new_tokens, cur_tokens = tokenize_line(before), tokenize_line(after), tokenize_line(line)
+    if not cur_tokens:
+        return None
+    matcher = difflib.SequenceMatcher(a=[t.text for t in old_tokens], b=[t.text for t in new_tokens], autojunk=False)
+    opcodes = [op for op in matcher.get_opcodes() if op[0] != "equal"]
+    if not opcodes:
+        return None
+
+    def gap_after(tokens, text, i):
+        return text[tokens[i].end:tokens[i + 1].start] if i + 1 < len(tokens) else ""
+
+    if [t.shape for t in old_tokens] == [t.shape for t in cur_tokens]:
+        old_texts = [t.text for t in old_tokens]
+        pieces = []
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                for i in range(i1, i2):
+                    # line の最後の字句の後に字句を足す場合は、変更後の行の空白を使う
+                    gap = gap_after(cur_tokens, line, i) if i + 1 < len(cur_tokens) \
+                        else gap_after(new_tokens, after, j1 + i - i1)
+                    pieces.append(cur_tokens[i].text + gap)
+                continue
+            for j in range(j1, j2):
+                token = new_tokens[j]
+                text = token.text
+                # 変更後の行にある変更前の識別子などは、line の対応する字句に置き換える
+                if token.kind in ("name", "string", "number") and token.shape != token.text \
+                        and text in old_texts:
+                    text = cur_tokens[old_texts.index(text)].text
+                pieces.append(text + gap_after(new_tokens, after, j))
+        indent = line[:len(line) - len(line.lstrip())]
+        # 行末のコメントは残す
+        return indent + "".join(pieces).rstrip() + line[cur_tokens[-1].end:].rstrip()
+
+    if len(opcodes) == 1 and opcodes[0][0] == "insert":
+        _, i1, _, j1, j2 = opcodes[0]
+        inserted = new_tokens[j1:j2]
+        if all(t.kind == "op" for t in inserted):
+            text = after[inserted[0].start:inserted[-1].end]
+            if i1 == len(old_tokens):
+                spacing = after[new_tokens[j1 - 1].end:inserted[0].start] if j1 else ""
+                end = cur_tokens[-1].end
+                return line[:end] + spacing + text + line[end:].rstrip()
+            if i1 == 0:
+                stripped = line.lstrip()
+                spacing = after[inserted[-1].end:new_tokens[j2].start] if j2 < len(new_tokens) else ""
+                return line[:len(line) - len(stripped)] + text + spacing + stripped
+    return None
+
+
+class Suggestion:
+    """
+    過去の修正から作った 1 行の修正案。
+    """
+
+    def __init__(self, new_line, score, example):
+        self.new_line = new_line
+        self.score = score
+        self.example = example
+
+    @property
+    def source(self):
+        return self.example.get("filename") or "?"
+
+    def __repr__(self):
+        return f"Suggestion({self.new_line!r}, score={self.score:.2f}, from={self.source})"
+
+
+class FixIndex:
+    """
+    Diff/done に適用済みの差分を、エラーの内容（エラー種別・正規化したメッセージ・該当行の形）で
+    引けるようにした索引。DiffArchive と同じ SQLite に保存する。
+    MinHash と LSH（バンド分割）で、似たエラーの過去の修正を全件を調べずに探す。
+    """
+
+    def __init__(self, done_dir):
+        self.archive = get_archive(done_dir)
+        self.conn = self.archive.conn
+        self._create_tables()
+
+    def _create_tables(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS fix_sources (
+                    patch_id INTEGER PRIMARY KEY
+                );
+                CREATE TABLE IF NOT EXISTS fix_examples (
+                    id INTEGER PRIMARY KEY,
+                    patch_id INTEGER,
+                    error_signature TEXT,
+                    before_line TEXT NOT NULL,
+                    after_line TEXT NOT NULL,
+                    shape TEXT NOT NULL,
+                    minhash TEXT NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS fix_bands (
+                    band_key TEXT NOT NULL,
+                    example_id INTEGER NOT NULL REFERENCES fix_examples(id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_fix_bands_key ON fix_bands (band_key);
+                CREATE INDEX IF NOT EXISTS idx_fix_examples_shape ON fix_examples (shape);
+            """)
+
+    def add_example(self, error_signature, before_line, after_line, patch_id=None):
+        signature = minhash(features(error_signature, before_line))
+        cur = self.conn.execute("""
+            INSERT INTO fix_examples (patch_id, error_signature, before_line, after_line, shape, minhash, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (patch_id, error_signature, before_line, after_line, code_shape(before_line),
+              json.dumps(signature), datetime.now().isoformat(timespec="seconds")))
+        self.conn.executemany("INSERT INTO fix_bands (band_key, example_id) VALUES (?, ?)",
+                              [(key, cur.lastrowid) for key in _band_keys(signature)])
+
+    def refresh(self):
+        """
+        まだ取り込んでいない Diff/done の差分を索引に追加する。戻り値: 追加した修正の例の数
+        適用後に元に戻した差分（reverted）は取り込まない。
+        """
+        rows = self.conn.execute("""
+            SELECT id, filename, error_signature FROM patches
+            WHERE reverted = 0 AND id NOT IN (SELECT patch_id FROM fix_sources)
+        """).fetchall()
+        added = 0
+        with self.conn:
+            for row in rows:
+                try:
+                    with open(os.path.join(self.archive.done_dir, row["filename"]), "r", encoding="utf-8", errors="replace") as f:
+                        pairs = changed_line_pairs(f.read())
+                except OSError:
+                    pairs = []
+                for before, after in pairs:
+                    self.add_example(row["error_signature"] or "", before, after, row["id"])
+                    added += 1
+                self.conn.execute("INSERT INTO fix_sources (patch_id) VALUES (?)", (row["id"],))
+        return added
+
+    def _candidates(self, signature, shape):
+        keys = _band_keys(signature)
+        placeholders = ",".join("?" * len(keys))
+        rows = self.conn.execute(f"""
+            SELECT e.*, p.filename FROM fix_examples e LEFT JOIN patches p ON p.id = e.patch_id
+            WHERE e.id IN (
+                SELECT example_id FROM fix_bands WHERE band_key IN ({placeholders})
+                UNION
+                SELECT id FROM fix_examples WHERE shape = ?
+            )
+            -- 取り込んだ後で元に戻された修正は使わない
+            AND COALESCE(p.reverted, 0) = 0
+        """, (*keys, shape)).fetchall()
+        return [dict(row) for row in rows]
+
+    def suggest(self, error_signature, line, min_similarity=0.3, limit=5):
+        """
+        error_signature のエラーが出た行 line に使えそうな修正案を、似ている順に最大 limit 個返す。
+        """
+        self.refresh()
+        signature = minhash(features(error_signature, line))
+        exc_type = split_signature(error_signature)[0]
+        scored = []
+        for example in self._candidates(signature, code_shape(line)):
+            # エラー内容が記録されていない修正は、どのエラーにも一致してしまうので使わない
+            if not example["error_signature"]:
+                continue
+            score = similarity(signature, json.loads(example["minhash"]))
+            # エラー種別が違う修正は使わない（エラーの側の種別が不明な場合を除く）
+            example_type = split_signature(example["error_signature"])[0]
+            if example_type and exc_type and example_type != exc_type:
+                continue
+            if score >= min_similarity:
+                scored.append((score, example["id"], example))
+
+        suggestions = []
+        seen = set()
+        # 同じ類似度なら新しい修正を優先する。当てはめを試すのは上位 limit * 4 個まで
+        ranked = sorted(scored, key=lambda s: (s[0], s[1]), reverse=True)[:limit * 4]
+        for score, _, example in ranked:
+            new_line = transfer_edit(example["before_line"], example["after_line"], line)
+            if new_line is None or new_line.strip() == line.strip() or new_line in seen:
+                continue
+            seen.add(new_line)
+            suggestions.append(Suggestion(new_line, score, example))
+            if len(suggestions) >= limit:
+                break
+        return suggestions
+
+    def stats(self):
+        row = self.conn.execute("SELECT COUNT(*) AS n, COUNT(DISTINCT patch_id) AS patches FROM fix_examples").fetchone()
+        return {"examples": row["n"], "patches": row["patches"]}
+
+
+def get_fix_index(done_dir):
+    archive = get_archive(done_dir)
+    if archive.done_dir not in _indexes:
+        _indexes[archive.done_dir] = FixIndex(archive.done_dir)
+    return _indexes[archive.done_dir]
@@ -0,0 +1,209 @@
+import time
+import difflib
+import fnmatch
+
+
+class FixProposal:
+    """
+    自動モードで適用しようとしている修正。
+    new_texts は修正後のファイルの内容 {project_root からの相対パス: テキスト}。
+    patch_text は差分（unified diff）。関数の置き換えなど差分がない修正では None。
+    old_texts は修正前のファイルの内容 {相対パス: テキスト or None（新規ファイル）}。
+    """
+
+    def __init__(self, new_texts, patch_text=None, error_signature=None, old_texts=None):
+        self.new_texts = new_texts
+        self.patch_text = patch_text
+        self.error_signature = error_signature
+        self.old_texts = old_texts or {}
+
+    def changed_lines(self):
+        if self.patch_text is None:
+            return None
+        return sum(
+            1 for line in self.patch_text.splitlines()
+            if line[:1] in ("+", "-") and not line.startswith(("+++", "---"))
+        )
+
+
+class PolicyDecision:
+    def __init__(self, accepted, reason="", policy=None):
+        self.accepted = accepted
+        self.reason = reason
+        self.policy = policy
+
+    def __bool__(self):
+        return self.accepted
+
+    def __repr__(self):
+        if self.accepted:
+            return "PolicyDecision(accepted)"
+        return f"PolicyDecision(rejected by {self.policy}: {self.reason})"
+
+
+def _syntax_error(text, relpath):
+    try:
+        compile(text, relpath, "exec", dont_inherit=True)
+    except (SyntaxError, ValueError) as e:
+        return e
+    return None
+
+
+def _original_lineno(old_text, new_text, lineno):
+    """
+    修正後の lineno 行目が修正前の何行目にあたるかを返す。修正で変わった行なら None。
+    """
+    old_lines = old_text.splitlines()
+    new_lines = new_text.splitlines()
+    index = lineno - 1
+    if index >= len(new_lines):
+        # ファイルの末尾（閉じていない括弧など）
+        return len(old_lines) + index - len(new_lines) + 1
+    for tag, i1, _i2, j1, j2 in difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if j1 <= index < j2:
+            return i1 + index - j1 + 1 if tag == "equal" else None
+    return None
+
+
+class CompilesPolicy:
+    """
+    修正後の .py ファイルがすべてコンパイルできる場合だけ採用する。
+    修正前から文法エラーがあったファイルでは、修正で新しく入った文法エラーがなければ採用する
+    （最初の文法エラーが、修正していない・元のエラーより後ろの行に移った）。
+    1 つのファイルに文法エラーが複数あっても 1 つずつ直せるようにするため。
+    """
+    name = "compiles"
+
+    def check(self, proposal):
+        for relpath, text in proposal.new_texts.items():
+            if not relpath.endswith(".py"):
+                continue
+            error = _syntax_error(text, relpath)
+            if error is None:
+                continue
+            lineno = getattr(error, "lineno", None)
+            old_text = proposal.old_texts.get(relpath)
+            if lineno and old_text is not None:
+                old_error = _syntax_error(old_text, relpath)
+                old_lineno = getattr(old_error, "lineno", None)
+                original = _original_lineno(old_text, text, lineno)
+                if old_lineno and original and original > old_lineno:
+                    continue
+            return f"{relpath}{f' {lineno}行目' if lineno else ''} がコンパイルできません: {getattr(error, 'msg', error)}"
+        return None
+
+
+class MaxChangedLinesPolicy:
+    """
+    差分の追加・削除行の合計が max_lines を超える修正は採用しない。
+    """
+    name = "max_changed_lines"
+
+    def __init__(self, max_lines="40"):
+        self.max_lines = int(max_lines)
+
+    def check(self, proposal):
+        changed = proposal.changed_lines()
+        if changed is not None and changed > self.max_lines:
+            return f"変更行数 {changed} が上限 {self.max_lines} を超えています"
+        return None
+
+
+class ProtectedPathsPolicy:
+    """
+    パターン（fnmatch、";" 区切り）に一致するファイルを変更する修正は採用しない。
+    例: "protected_paths:Config/*;*.json"
+    """
+    name = "protected_paths"
+
+    def __init__(self, patterns=""):
+        self.patterns = [p.strip() for p in patterns.split(";") if p.strip()]
+
+    def check(self, proposal):
+        for relpath in proposal.new_texts:
+            normalized = relpath.replace("\\", "/")
+            for pattern in self.patterns:
+                if fnmatch.fnmatch(normalized, pattern):
+                    return f"{normalized} は変更できないファイルです（{pattern}）"
+        return None
+
+
+POLICIES = {
+    CompilesPolicy.name: CompilesPolicy,
+    MaxChangedLinesPolicy.name: MaxChangedLinesPolicy,
+    ProtectedPathsPolicy.name: ProtectedPathsPolicy,
+}
+
+
+class FixPolicy:
+    """
+    複数のポリシーをまとめたもの。すべてのポリシーが通った修正だけを採用する。
+    specs は "名前" または "名前:引数" のリスト（config.json の auto_policies）。
+    例: ["compiles", "max_changed_lines:40"]
+    """
+
+    def __init__(self, specs):
+        self.policies = []
+        for spec in specs:
+            name, _, arg = spec.partition(":")
+            cls = POLICIES.get(name.strip())
+            if cls is None:
+                raise ValueError(f"不明なポリシーです: {name}（使えるもの: {', '.join(POLICIES)}）")
+            self.policies.append(cls(arg) if arg else cls())
+
+    def evaluate(self, proposal):
+        for policy in self.policies:
+            reason = policy.check(proposal)
+            if reason:
+                return PolicyDecision(False, reason, policy.name)
+        return PolicyDecision(True)
+
+
+class RunBudget:
+    """
+    自動モードの上限（繰り返し回数・経過時間・API の費用）。
+    費用は 1000 トークンあたりの単価から概算する。None の上限は無制限。
+    """
+
+    def __init__(self, max_iterations=None, max_seconds=None, max_cost=None,
+                 price_prompt_per_1k=0.0, price_completion_per_1k=0.0):
+        self.max_iterations = max_iterations
+        self.max_seconds = max_seconds
+        self.max_cost = max_cost
+        self.price_prompt_per_1k = price_prompt_per_1k
+        self.price_completion_per_1k = price_completion_per_1k
+        self.started = time.monotonic()
+        self.iterations = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def cost(self):
+        return (self.prompt_tokens * self.price_prompt_per_1k
+                + self.completion_tokens * self.price_completion_per_1k) / 1000
+
+    def add_usage(self, prompt_tokens, completion_tokens):
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+
+    def exhausted(self):
+        """
+        上限に達していればその理由を、まだなら None を返す。
+        """
+        if self.max_iterations is not None and self.iterations >= self.max_iterations:
+            return f"繰り返し回数の上限（{self.max_iterations} 回）"
+        if self.max_seconds is not None and self.elapsed >= self.max_seconds:
+            return f"経過時間の上限（{self.max_seconds / 60:.0f} 分）"
+        if self.max_cost is not None and self.cost >= self.max_cost:
+            return f"費用の上限（${self.max_cost:.2f}）"
+        return None
+
+    def summary(self):
+        return (
+            f"{self.iterations} 回 / {self.elapsed / 60:.1f} 分 / "
+            f"トークン {self.prompt_tokens}+{self.completion_tokens}（約 ${self.cost:.3f}）"
+        )
@@ -1,36 +1,64 @@
 import re
 import os
 
-def detect_syntax_error_line(log_text, project_root):
+from traceback_parser import iter_tracebacks, parse_last_traceback, make_relpath
+from timing import timed
+
+FILE_LINE_PATTERN = re.compile(r'File "(.+?\.py)", line (\d+)')
+# 以下の関数の tb 引数の既定値。呼び出し側で parse_last_traceback(log_text, project_root) の結果を
+# 渡せば、同じログを関数ごとに解析し直さずに済む（Traceback がなかった場合の None も渡してよい）
+NOT_PARSED = object()
+
+@timed("fixer.detect_syntax_error_line")
+def detect_syntax_error_line(log_text, project_root, tb=NOT_PARSED):
     """
-    log_text 内の Traceback から、最後に出現する 'File "..."' の行を取得して、
-    EchoCodeForge 以下の相対パスと行番号を返す。
+    log_text 内の最後の Traceback から、project_root 配下で最後に出現する
+    'File "..."' の行を取得して、project_root からの相対パスと行番号を返す。
+    Traceback が見つからない場合は 'File "...", line N' の行を正規表現で探す。
     """
-    pattern = r'File "(.*?\\EchoCodeForge\\)(.+?\.py)", line (\d+)'
-    matches = re.findall(pattern, log_text)
-
-    if matches:
+    if tb is NOT_PARSED:
+        tb = parse_last_traceback(log_text, project_root)
+    if tb:
         # 最後の File が実際のエラー位置
-        _, relative_path, lineno = matches[-1]
-        return os.path.normpath(relative_path), int(lineno)
+        frame = tb.last_project_frame()
+        if frame:
+            return frame.relpath, frame.lineno
+        return None, None
 
+    for path, lineno in reversed(FILE_LINE_PATTERN.findall(log_text)):
+        relpath = make_relpath(path, project_root)
+        if relpath:
+            return relpath, int(lineno)
     return None, None
 
-def extract_error_message(log_text):
+@timed("fixer.extract_error_message")
+def extract_error_message(log_text, tb=NOT_PARSED):
     """
-    エラーメッセージの中から SyntaxError や Exception を含む行を最初に返す。
-    なければ "不明なエラー" を返す。
+    最後の Traceback の "エラー種別: メッセージ" を返す。
+    Traceback がなければ SyntaxError や Exception を含む行を最初に返す。
+    どちらもなければ "不明なエラー" を返す。
     """
+    if tb is NOT_PARSED:
+        tb = parse_last_traceback(log_text)
+    if tb:
+        return f"{tb.exc_type}: {tb.message}" if tb.message else tb.exc_type
     for line in log_text.splitlines():
         if any(keyword in line for keyword in ["SyntaxError", "IndentationError", "Exception", "Traceback"]):
             return line.strip()
     return "不明なエラー"
 
-def extract_error_type_and_message(log_text):
+@timed("fixer.extract_error_type_and_message")
+def extract_error_type_and_message(log_text, tb=NOT_PARSED):
     """
     Traceback の最後に出現するエラーの種類とメッセージを分離して取得する。
     例: "SyntaxError: '(' was never closed" → ("SyntaxError", "'(' was never closed")
+    Traceback が見つからない場合は、":" を含む最後の行を分割して返す。
     """
+    if tb is NOT_PARSED:
+        tb = parse_last_traceback(log_text)
+    if tb:
+        return tb.exc_type, tb.message
+
     lines = log_text.strip().splitlines()
 
     # 下から順に確認し、":" を含むエラー行を探す
@@ -46,11 +74,14 @@ def extract_error_type_and_message(log_text):
 
 def extract_first_traceback_file_and_line(log_text):
     """
-    Traceback の最初のファイルと行番号を正規表現で抽出する。
+    Traceback の最初のファイルと行番号を返す。
     万が一 detect_syntax_error_line に失敗したとき用。
     """
-    pattern = r'File "(.+?\.py)", line (\d+)'
-    match = re.search(pattern, log_text)
+    for tb in iter_tracebacks(log_text):
+        for inner in tb.chain + [tb]:
+            if inner.frames:
+                return inner.frames[0].path, inner.frames[0].lineno
+    match = FILE_LINE_PATTERN.search(log_text)
     if match:
         return match.group(1), int(match.group(2))
     return None, None
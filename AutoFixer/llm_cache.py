@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import hashlib
+
+
+class LLMCache:
+    """
+    ChatGPT の回答をディスクにキャッシュする。
+    キーは モデル名 + 質問文 のハッシュ（SHA-256）。
+    1 エントリ = 1 JSON ファイル（<cache_dir>/<key>.json）として保存し、
+    ファイルの更新時刻を最終アクセス時刻として LRU 方式で削除する。
+    """
+
+    def __init__(self, cache_dir, max_entries=500, max_bytes=50 * 1024 * 1024, max_age_days=30):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 60 * 60 if max_age_days else None
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(model, prompt):
+        h = hashlib.sha256()
+        h.update(model.encode("utf-8"))
+        h.update(b"\0")
+        h.update(prompt.encode("utf-8"))
+        return h.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _is_expired(self, created_at, now=None):
+        if self.max_age is None:
+            return False
+        return (now or time.time()) - created_at > self.max_age
+
+    def get(self, model, prompt):
+        """
+        キャッシュ済みの回答を返す。なければ（または期限切れなら）None。
+        ヒットしたエントリは更新時刻を現在時刻にして LRU の先頭に戻す。
+        """
+        path = self._path(self.make_key(model, prompt))
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+
+        if self._is_expired(entry.get("created_at", 0)):
+            self._remove(path)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return entry.get("answer")
+
+    def get_all(self, model, prompt):
+        """
+        キャッシュ済みの回答と、add_alternatives で保存した別の回答候補をすべて返す（なければ空のリスト）。
+        """
+        answer = self.get(model, prompt)
+        if answer is None:
+            return []
+        entry = self._read(self._path(self.make_key(model, prompt))) or {}
+        return [answer] + [a for a in entry.get("alternatives", []) if a != answer]
+
+    def add_alternatives(self, model, prompt, answers):
+        """
+        同じ質問に対する別の回答候補を保存する。エントリがなければ最初の候補を回答として作る。
+        """
+        if not answers:
+            return
+        path = self._path(self.make_key(model, prompt))
+        entry = self._read(path)
+        if entry is None:
+            self.put(model, prompt, answers[0])
+            entry = self._read(path) or {}
+        known = [entry.get("answer")] + entry.get("alternatives", [])
+        alternatives = entry.get("alternatives", []) + [a for a in dict.fromkeys(answers) if a not in known]
+        self._write(path, dict(entry, alternatives=alternatives))
+
+    def _read(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write(self, path, entry):
+        # 一時ファイルに書いてから置き換えるので、途中で落ちても壊れたエントリは残らない
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def put(self, model, prompt, answer):
+        """
+        回答を保存し、上限を超えていれば古いエントリから削除する。
+        """
+        key = self.make_key(model, prompt)
+        path = self._path(key)
+        entry = {
+            "model": model,
+            "prompt": prompt,
+            "answer": answer,
+            "created_at": time.time(),
+        }
+        self._write(path, entry)
+        self.evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.is_file() and e.name.endswith(".json"):
+                    st = e.stat()
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        return entries
+
+    def evict(self):
+        """
+        期限切れのエントリを削除し、件数・合計サイズの上限に収まるまで
+        最終アクセスの古い順に削除する。削除した件数を返す。
+        """
+        now = time.time()
+        removed = 0
+        alive = []
+        for mtime, size, path in self._entries():
+            # 作成時刻は JSON 内にあるが、読み込みを避けるため最終アクセスで近似する
+            if self._is_expired(mtime, now):
+                self._remove(path)
+                removed += 1
+            else:
+                alive.append((mtime, size, path))
+
+        alive.sort()
+        total = sum(size for _, size, _ in alive)
+        while alive and (len(alive) > self.max_entries or total > self.max_bytes):
+            _, size, path = alive.pop(0)
+            self._remove(path)
+            total -= size
+            removed += 1
+        return removed
+
+    def stats(self):
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
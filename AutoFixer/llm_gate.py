@@ -0,0 +1,210 @@
+import json
+import time
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_UPSTREAM = "https://api.openai.com/v1"
+# 転送しないヘッダー（接続ごとのもの）
+HOP_BY_HOP = {"connection", "keep-alive", "transfer-encoding", "content-length", "host",
+              "proxy-connection", "te", "trailer", "upgrade", "accept-encoding"}
+
+
+class RateLimiter:
+    """
+    スレッドから使うトークンバケット（llm_pool.TokenBucket のスレッド版）。
+    """
+
+    def __init__(self, rate_per_sec, burst):
+        self.rate = rate_per_sec
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class TargetUsage:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.waiting = 0
+        self.wait_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def to_dict(self):
+        return dict(self.__dict__, wait_seconds=round(self.wait_seconds, 2))
+
+
+class GateHandler(BaseHTTPRequestHandler):
+    """
+    /<対象名>/v1/... への要求を上流（OpenAI の API）の /v1/... に転送する。
+    すべての対象で同時に転送する要求は concurrency 個まで、レートも全体で制限する。
+    """
+
+    server_version = "LLMGate/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._forward(None)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self._forward(self.rfile.read(length))
+
+    def _forward(self, body):
+        gate = self.server
+        name, _, rest = self.path.lstrip("/").partition("/")
+        if not rest.startswith("v1"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+        usage = gate.usage_for(name)
+        url = gate.upstream + rest[len("v1"):]
+        headers = {k: v for k, v in self.headers.items() if k.lower() not in HOP_BY_HOP}
+        request = urllib.request.Request(url, data=body, headers=headers, method=self.command)
+
+        started = time.monotonic()
+        with gate.lock:
+            usage.waiting += 1
+        gate.slots.acquire()
+        try:
+            gate.limiter.acquire()
+            with gate.lock:
+                usage.waiting -= 1
+                usage.in_flight += 1
+                usage.requests += 1
+                usage.wait_seconds += time.monotonic() - started
+            self._relay(request, usage)
+        finally:
+            with gate.lock:
+                usage.in_flight -= 1
+            gate.slots.release()
+
+    def _relay(self, request, usage):
+        gate = self.server
+        try:
+            response = urllib.request.urlopen(request, timeout=gate.timeout)
+        except urllib.error.HTTPError as e:
+            # 429 / 500 などはそのまま返し、再試行はクライアント（openai）に任せる
+            with gate.lock:
+                usage.errors += 1
+            data = e.read()
+            self.send_response(e.code)
+            for key, value in e.headers.items():
+                if key.lower() not in HOP_BY_HOP:
+                    self.send_header(key, value)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            return
+        except (urllib.error.URLError, OSError) as e:
+            with gate.lock:
+                usage.errors += 1
+            self._send_json(502, {"error": {"message": f"upstream error: {e}", "type": "server_error"}})
+            return
+
+        with response:
+            self.send_response(response.status)
+            for key, value in response.headers.items():
+                if key.lower() not in HOP_BY_HOP:
+                    self.send_header(key, value)
+            if "text/event-stream" not in response.headers.get("Content-Type", ""):
+                data = response.read()
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+                self._count_usage(usage, data)
+                return
+
+            # ストリーミングは 1 行ずつ中継する。クライアントが途中で切断したら上流との接続も閉じる
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for line in response:
+                    self.wfile.write(line)
+                    if line.startswith(b"data: {") and b'"usage"' in line:
+                        self._count_usage(usage, line[len(b"data: "):])
+                    if line == b"\n":
+                        self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def _count_usage(self, usage, data):
+        try:
+            tokens = json.loads(data).get("usage") or {}
+        except (ValueError, AttributeError):
+            return
+        with self.server.lock:
+            usage.prompt_tokens += tokens.get("prompt_tokens", 0) or 0
+            usage.completion_tokens += tokens.get("completion_tokens", 0) or 0
+
+
+class LLMGate(ThreadingHTTPServer):
+    """
+    複数の self_runner（--targets の各対象）で ChatGPT への同時問い合わせ数を共有するための中継サーバー。
+    各対象の llm_base_url を url_for(対象名) にすると、問い合わせはこのサーバーを通り、
+    対象ごとのリクエスト数・トークン数・待ち時間が usage に集計される。
+    """
+
+    daemon_threads = True
+
+    def __init__(self, upstream=None, concurrency=4, rate_per_min=60, burst=5, timeout=120.0,
+                 host="127.0.0.1", port=0, verbose=False):
+        super().__init__((host, port), GateHandler)
+        self.upstream = (upstream or DEFAULT_UPSTREAM).rstrip("/")
+        self.concurrency = concurrency
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.limiter = RateLimiter(rate_per_min / 60 if rate_per_min else 0, burst)
+        self.timeout = timeout
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        self.usage = {}
+        self._thread = None
+
+    def usage_for(self, name):
+        with self.lock:
+            return self.usage.setdefault(name, TargetUsage())
+
+    def url_for(self, name):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/{name}/v1"
+
+    def snapshot(self):
+        with self.lock:
+            return {name: usage.to_dict() for name, usage in self.usage.items()}
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
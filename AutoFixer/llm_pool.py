@@ -0,0 +1,209 @@
+import time
+import random
+import asyncio
+import argparse
+import statistics
+
+# 再試行してよいエラー（openai の例外クラス名）
+RETRYABLE_ERRORS = {
+    "APITimeoutError",
+    "APIConnectionError",
+    "RateLimitError",
+    "InternalServerError",
+    "TimeoutError",
+}
+
+
+class TokenBucket:
+    """
+    トークンバケット方式のレート制限。
+    rate_per_sec の速さでトークンが溜まり（最大 burst 個）、1 リクエストごとに 1 個消費する。
+    """
+
+    def __init__(self, rate_per_sec, burst):
+        self.rate = rate_per_sec
+        self.capacity = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if not self.rate:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class PoolAnswer:
+    """
+    LLMPool.ask の結果。source は "api"（API に問い合わせた）か "cache"（キャッシュにあった）。
+    latency_ms（成功した問い合わせの応答時間）とトークン数は、キャッシュからの回答では None。
+    """
+
+    def __init__(self, text, source="api", latency_ms=None, prompt_tokens=None, completion_tokens=None):
+        self.text = text
+        self.source = source
+        self.latency_ms = latency_ms
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    def __repr__(self):
+        return f"PoolAnswer(source={self.source!r}, latency_ms={self.latency_ms}, text={self.text[:40]!r})"
+
+
+def _is_retryable(error):
+    return type(error).__name__ in RETRYABLE_ERRORS or isinstance(error, asyncio.TimeoutError)
+
+
+class LLMPool:
+    """
+    ChatGPT への問い合わせを asyncio で並行して行う。
+    - 同時に実行するリクエスト数は concurrency まで
+    - トークンバケットで 1 秒あたりのリクエスト数を制限
+    - 1 リクエストごとのタイムアウトと、指数バックオフでの再試行
+    client は chat.completions.create がコルーチンであるもの（openai.AsyncOpenAI など）。
+    cache（LLMCache）を渡すと、キャッシュにある質問は API を呼ばずに返す。
+    1 つのイベントループの中で使うこと。
+    """
+
+    def __init__(self, client, model="gpt-4", concurrency=4, rate_per_sec=1.0, burst=5,
+                 timeout=60.0, max_retries=3, backoff_base=1.0, cache=None):
+        self.client = client
+        self.model = model
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.cache = cache
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._bucket = TokenBucket(rate_per_sec, burst)
+        self.latencies = []
+        self.retries = 0
+        self.failures = 0
+
+    async def ask(self, prompt):
+        """
+        1 つの質問を送り、回答（PoolAnswer）を返す。再試行しても失敗した場合は例外を送出する。
+        """
+        if self.cache:
+            cached = self.cache.get(self.model, prompt)
+            if cached is not None:
+                return PoolAnswer(cached, "cache")
+
+        attempt = 0
+        while True:
+            try:
+                async with self._semaphore:
+                    await self._bucket.acquire()
+                    started = time.monotonic()
+                    response = await asyncio.wait_for(
+                        self.client.chat.completions.create(
+                            model=self.model,
+                            messages=[{"role": "user", "content": prompt}]
+                        ),
+                        timeout=self.timeout
+                    )
+                    latency = time.monotonic() - started
+                    self.latencies.append(latency)
+                break
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    self.failures += 1
+                    raise
+                attempt += 1
+                self.retries += 1
+                # 指数バックオフ + ゆらぎ（同時に再試行が集中しないように）
+                delay = self.backoff_base * (2 ** (attempt - 1))
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+        answer = response.choices[0].message.content
+        if self.cache:
+            self.cache.put(self.model, prompt, answer)
+        usage = getattr(response, "usage", None)
+        return PoolAnswer(
+            answer, "api", round(latency * 1000, 1),
+            usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None
+        )
+
+    async def ask_many(self, prompts):
+        """
+        複数の質問をまとめて送る。戻り値は prompts と同じ順の回答（PoolAnswer）のリスト。
+        失敗した質問の位置には例外オブジェクトが入る。
+        """
+        return await asyncio.gather(*(self.ask(p) for p in prompts), return_exceptions=True)
+
+    def stats(self):
+        lat = sorted(self.latencies)
+        if not lat:
+            return {"requests": 0, "retries": self.retries, "failures": self.failures}
+        return {
+            "requests": len(lat),
+            "retries": self.retries,
+            "failures": self.failures,
+            "p50": statistics.median(lat),
+            "p90": lat[min(len(lat) - 1, int(len(lat) * 0.9))],
+            "max": lat[-1],
+        }
+
+
+def make_async_client(api_key, base_url=None):
+    """
+    openai.AsyncOpenAI を作る。再試行は LLMPool 側で行うので openai 側では行わない。
+    """
+    import openai
+    return openai.AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=0)
+
+
+def run_prompts(prompts, **pool_options):
+    """
+    同期的なコードから複数の質問をまとめて送るためのヘルパー。
+    pool_options は LLMPool の引数（client を含む）。戻り値: (回答のリスト, 統計)
+    """
+    async def _run():
+        pool = LLMPool(**pool_options)
+        answers = await pool.ask_many(prompts)
+        return answers, pool.stats()
+    return asyncio.run(_run())
+
+
+def main():
+    """
+    スループット計測用。ローカルのスタブサーバー（llm_stub_server.py）に対して実行する。
+    例: python llm_pool.py --base-url http://127.0.0.1:8765/v1 -n 100 --concurrency 8
+    """
+    parser = argparse.ArgumentParser(description="LLMPool のスループット計測")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8765/v1")
+    parser.add_argument("-n", "--requests", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=0, help="1 秒あたりの上限（0 なら無制限）")
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    prompts = [f"benchmark prompt {i}" for i in range(args.requests)]
+    started = time.monotonic()
+    answers, stats = run_prompts(
+        prompts,
+        client=make_async_client("stub", args.base_url),
+        concurrency=args.concurrency,
+        rate_per_sec=args.rate,
+        burst=args.burst,
+        timeout=args.timeout,
+        backoff_base=0.1
+    )
+    elapsed = time.monotonic() - started
+    errors = sum(1 for a in answers if isinstance(a, Exception))
+    print(f"{args.requests} 件 / {elapsed:.2f} 秒 = {args.requests / elapsed:.1f} 件/秒（失敗 {errors} 件）")
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import os
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = "修正したコードです。\n```python\npass\n```\n"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    OpenAI の /v1/chat/completions と同じ形式で応答するスタブ。
+    オフラインで LLMPool のスループット・レイテンシを確認するために使う。
+    """
+
+    server_version = "LLMStub/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        srv = self.server
+
+        time.sleep(max(0.0, srv.delay + random.uniform(-srv.jitter, srv.jitter)))
+        if srv.fail_rate and random.random() < srv.fail_rate:
+            status = random.choice([429, 500])
+            self._send_json(status, {"error": {"message": "stub failure", "type": "server_error"}})
+            return
+
+        prompt = "".join(m.get("content", "") for m in request.get("messages", []))
+        # n 個の回答を求められたら、用意した回答を順に使う
+        n = max(1, int(request.get("n") or 1))
+        answers = [srv.answers[i % len(srv.answers)] for i in range(n)]
+        prompt_tokens = max(1, len(prompt) // 4)
+        completion_tokens = sum(max(1, len(answer) // 4) for answer in answers)
+        if request.get("stream"):
+            include_usage = (request.get("stream_options") or {}).get("include_usage", False)
+            self._send_stream(request, answers, prompt_tokens, completion_tokens, include_usage)
+            return
+        self._send_json(200, {
+            "id": f"chatcmpl-stub-{random.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stub"),
+            "choices": [{
+                "index": i,
+                "message": {"role": "assistant", "content": answer},
+                "finish_reason": "stop",
+            } for i, answer in enumerate(answers)],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        })
+
+    def _send_stream(self, request, answers, prompt_tokens, completion_tokens, include_usage):
+        """
+        stream=True の要求には、回答を chunk_chars 文字ずつ chunk_delay 秒おきに SSE で返す。
+        クライアントが途中で接続を切ったら（早期終了）、送るのをやめて streams_cancelled を数える。
+        """
+        srv = self.server
+        chunk_id = f"chatcmpl-stub-{random.getrandbits(32):08x}"
+        base = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model", "stub")}
+
+        def event(body):
+            data = json.dumps(dict(base, **body), ensure_ascii=False)
+            self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+        # HTTP/1.0 では接続を閉じることで応答の終わりを伝える
+        self.close_connection = True
+        try:
+            for i, answer in enumerate(answers):
+                event({"choices": [{"index": i, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+                for start in range(0, len(answer), srv.chunk_chars):
+                    time.sleep(srv.chunk_delay)
+                    piece = answer[start:start + srv.chunk_chars]
+                    event({"choices": [{"index": i, "delta": {"content": piece}, "finish_reason": None}]})
+                event({"choices": [{"index": i, "delta": {}, "finish_reason": "stop"}]})
+            if include_usage:
+                event({"choices": [], "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                }})
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            srv.streams_cancelled += 1
+
+
+def make_server(host="127.0.0.1", port=8765, delay=0.5, jitter=0.1, fail_rate=0.0, answer=DEFAULT_ANSWER, verbose=False,
+                chunk_chars=20, chunk_delay=0.02):
+    """
+    answer には回答の文字列か、回答のリスト（n 個の回答を求められたときに順に使う）を渡す。
+    chunk_chars / chunk_delay は stream=True のときの 1 回に送る文字数と間隔（秒）。
+    """
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.delay = delay
+    server.jitter = jitter
+    server.fail_rate = fail_rate
+    server.answers = [answer] if isinstance(answer, str) else list(answer)
+    server.verbose = verbose
+    server.chunk_chars = max(1, chunk_chars)
+    server.chunk_delay = chunk_delay
+    server.streams_cancelled = 0
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI 互換のローカルスタブサーバー")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=0.5, help="応答までの待ち時間（秒）")
+    parser.add_argument("--jitter", type=float, default=0.1, help="待ち時間のゆらぎ（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="429/500 を返す割合（0〜1）")
+    parser.add_argument("--answer-file", action="append",
+                        help="回答として返す内容のファイル（例: QAtemp.txt）。複数指定すると n 個の回答の候補として順に使う")
+    parser.add_argument("--chunk-chars", type=int, default=20, help="stream=True のときに 1 回に送る文字数")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="stream=True のときの送信間隔（秒）")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    answer = []
+    for path in args.answer_file or []:
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                answer.append(f.read())
+    answer = answer or DEFAULT_ANSWER
+
+    server = make_server(args.host, args.port, args.delay, args.jitter, args.fail_rate, answer, args.verbose,
+                         args.chunk_chars, args.chunk_delay)
+    print(f"🧪 スタブサーバーを起動しました: http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
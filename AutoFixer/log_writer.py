@@ -0,0 +1,185 @@
+import os
+import gzip
+import time
+import queue
+import atexit
+import shutil
+import threading
+
+# get_log_writer で新しく作る LogWriter の既定値（configure_logging で変更する）
+_defaults = {
+    "buffer_bytes": 64 * 1024,
+    "flush_interval": 1.0,
+    "max_bytes": 10 * 1024 * 1024,
+    "backup_count": 5,
+    "background": False,
+}
+
+# ファイルパス → LogWriter
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+class LogWriter:
+    """
+    1 つのログファイルに対して開いたままのハンドルを持ち、書き込みをバッファする。
+    - バッファが buffer_bytes を超えるか、前回から flush_interval 秒経つとディスクに書き出す
+    - ファイルが max_bytes を超えたら <名前>.1.gz に圧縮して退避し、新しいファイルに切り替える
+      （古いものは .2.gz, .3.gz ... と繰り下がり、backup_count を超えた分は削除）
+    - background=True なら書き出し・圧縮を別スレッドで行い、呼び出し側を待たせない
+    """
+
+    def __init__(self, path, buffer_bytes=64 * 1024, flush_interval=1.0,
+                 max_bytes=10 * 1024 * 1024, backup_count=5, background=False):
+        self.path = path
+        self.buffer_bytes = buffer_bytes
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.background = background
+
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
+        self._handle = open(path, "a", encoding="utf-8")
+        self._size = self._handle.tell()
+        self._closed = False
+
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name=f"LogWriter({os.path.basename(path)})", daemon=True)
+            self._thread.start()
+
+    def write(self, text):
+        if self._closed:
+            return
+        if self._queue is not None:
+            self._queue.put(text)
+            return
+        with self._lock:
+            self._append(text)
+            if self._buffered >= self.buffer_bytes or time.monotonic() - self._last_flush >= self.flush_interval:
+                self._flush_locked()
+
+    def _append(self, text):
+        self._buffer.append(text)
+        self._buffered += len(text)
+
+    def flush(self):
+        if self._queue is not None:
+            # バックグラウンドスレッドがキューを処理し終えるのを待つ
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+            return
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if self._buffer:
+            data = "".join(self._buffer)
+            self._buffer.clear()
+            self._buffered = 0
+            self._handle.write(data)
+            self._handle.flush()
+            self._size += len(data.encode("utf-8"))
+            if self.max_bytes and self._size >= self.max_bytes:
+                self._rotate()
+        self._last_flush = time.monotonic()
+
+    def _rotate(self):
+        self._handle.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            src = f"{self.path}.{i}.gz"
+            if os.path.exists(src):
+                os.replace(src, f"{self.path}.{i + 1}.gz")
+        if self.backup_count > 0:
+            with open(self.path, "rb") as src, gzip.open(f"{self.path}.1.gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+        self._handle = open(self.path, "w", encoding="utf-8")
+        self._size = 0
+
+    def _run(self):
+        """
+        background=True のときの書き込みスレッド。
+        """
+        while True:
+            timeout = max(0.0, self.flush_interval - (time.monotonic() - self._last_flush))
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            with self._lock:
+                if isinstance(item, str):
+                    self._append(item)
+                    # まとめて書くため、すでに溜まっている分も取り出す
+                    while True:
+                        try:
+                            more = self._queue.get_nowait()
+                        except queue.Empty:
+                            break
+                        if isinstance(more, str):
+                            self._append(more)
+                        else:
+                            item = more
+                            break
+                if (item is not None and not isinstance(item, str)) \
+                        or self._buffered >= self.buffer_bytes \
+                        or time.monotonic() - self._last_flush >= self.flush_interval:
+                    self._flush_locked()
+
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is _STOP:
+                return
+
+    def close(self):
+        if self._closed:
+            return
+        if self._queue is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+        with self._lock:
+            self._flush_locked()
+            self._handle.close()
+        self._closed = True
+
+
+_STOP = object()
+
+
+def configure_logging(**options):
+    """
+    これから作る LogWriter の既定値を設定する（buffer_bytes, flush_interval, max_bytes, backup_count, background）。
+    """
+    _defaults.update(options)
+
+
+def get_log_writer(path):
+    key = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = LogWriter(key, **_defaults)
+            _writers[key] = writer
+    return writer
+
+
+def flush_all():
+    for writer in list(_writers.values()):
+        writer.flush()
+
+
+def close_all():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+atexit.register(close_all)
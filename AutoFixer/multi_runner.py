@@ -0,0 +1,354 @@
+import os
+import re
+import sys
+import json
+import time
+import heapq
+import threading
+import subprocess
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from timing import entry_counters
+
+TARGET_NAME_PATTERN = re.compile(r"^[\w.\-]+$")
+STATES = ("waiting", "running", "ok", "failed")
+
+
+class Target:
+    """
+    --targets で扱う 1 つのプロジェクト。
+    state_dir にはこの対象の run_log.txt / QA.sqlite3 / metrics / 構文チェックのキャッシュを、
+    diff_dir には差分（Diff/done を含む）を置く。config は config.json の値の上書き（{キー: 値}）。
+    """
+
+    def __init__(self, name, project_root, agent_script="agent1.py", diff_dir=None, state_dir=None, config=None):
+        if not TARGET_NAME_PATTERN.match(name):
+            raise ValueError(f"対象の名前に使えない文字があります: {name!r}（英数字・_・-・. のみ）")
+        self.name = name
+        self.project_root = project_root
+        self.agent_script = agent_script
+        self.state_dir = state_dir
+        self.diff_dir = diff_dir or (os.path.join(state_dir, "Diff") if state_dir else None)
+        self.config = dict(config or {})
+
+    @classmethod
+    def from_dict(cls, entry, states_root):
+        """
+        {"name": ..., "project_root": ..., "agent_script": ..., "diff_dir": ..., "state_dir": ..., "config": {...}}
+        name を省略した場合は project_root のフォルダ名、state_dir を省略した場合は states_root/<name>。
+        """
+        if "project_root" not in entry:
+            raise ValueError(f"project_root がありません: {entry}")
+        name = entry.get("name") or os.path.basename(os.path.normpath(entry["project_root"]))
+        state_dir = entry.get("state_dir") or os.path.join(states_root, name)
+        return cls(name, entry["project_root"], entry.get("agent_script", "agent1.py"),
+                   entry.get("diff_dir"), state_dir, entry.get("config"))
+
+    def env(self, base_env=None, llm_base_url=None):
+        """
+        この対象用の self_runner を起動するときの環境変数（設定は SELFMADE_<キー> で上書きする）。
+        """
+        overrides = dict(self.config)
+        overrides.update({
+            "project_root": self.project_root,
+            "agent_script": self.agent_script,
+            "state_dir": self.state_dir,
+            "diff_dir": self.diff_dir,
+        })
+        if llm_base_url:
+            overrides["llm_base_url"] = llm_base_url
+        env = dict(os.environ if base_env is None else base_env)
+        for key, value in overrides.items():
+            env["SELFMADE_" + key.upper()] = json.dumps(value, ensure_ascii=False)
+        env["PYTHONUNBUFFERED"] = "1"
+        env["PYTHONIOENCODING"] = "utf-8"
+        return env
+
+
+def load_targets(source, states_root):
+    """
+    対象のリスト（JSON ファイルのパス、または dict のリスト）から Target のリストを作る。
+    """
+    if isinstance(source, str):
+        with open(source, "r", encoding="utf-8") as f:
+            source = json.load(f)
+        if isinstance(source, dict):
+            source = source.get("targets", [])
+    targets = [Target.from_dict(entry, states_root) for entry in source]
+    names = [t.name for t in targets]
+    duplicated = sorted({n for n in names if names.count(n) > 1})
+    if duplicated:
+        raise ValueError(f"対象の名前が重複しています: {', '.join(duplicated)}（name を指定してください）")
+    return targets
+
+
+class TargetStatus:
+    def __init__(self, target):
+        self.target = target
+        self.state = "waiting"
+        self.cycles = 0
+        self.failures = 0
+        self.last_exit = None
+        self.last_message = ""
+        self.fixes_applied = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.busy_seconds = 0.0
+        self.next_run = None
+
+    def to_dict(self):
+        return {
+            "name": self.target.name,
+            "state": self.state,
+            "cycles": self.cycles,
+            "failures": self.failures,
+            "last_exit": self.last_exit,
+            "last_message": self.last_message,
+            "fixes_applied": self.fixes_applied,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "busy_seconds": round(self.busy_seconds, 1),
+            "state_dir": self.target.state_dir,
+        }
+
+
+def _last_run_record(metrics_path, since):
+    """
+    metrics/runs.jsonl のうち、since（時刻文字列）以降に始まった最後の "run" 行を返す。
+    """
+    try:
+        with open(metrics_path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    for line in reversed(lines):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if record.get("span") == "run":
+            return record if record.get("started_at", "") >= since else None
+    return None
+
+
+def _last_message(log_path):
+    """
+    ログの最後の空でない行（自動修正の結果など）を返す。
+    """
+    try:
+        with open(log_path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - 4096))
+            tail = f.read().decode("utf-8", "replace")
+    except OSError:
+        return ""
+    lines = [line.strip() for line in tail.splitlines() if line.strip()]
+    return lines[-1] if lines else ""
+
+
+class MultiRunner:
+    """
+    複数の対象の 実行→修正→再実行（self_runner.py --auto の 1 回分 = 1 サイクル）を、
+    同時実行数 workers のワーカーに割り当てて進める。
+    各サイクルは別プロセスで動くので、対象ごとの設定・ログ・差分は混ざらない。
+    cycles 回（0 なら止めるまで）、各対象のサイクルの終了から interval 秒後に次のサイクルを始める。
+    gate（llm_gate.LLMGate）を渡すと、ChatGPT への問い合わせはすべての対象でその同時実行数を共有する。
+    """
+
+    def __init__(self, targets, self_runner_path, workers=2, cycles=1, interval=60.0, gate=None,
+                 status_interval=10.0, status_path=None, extra_args=(), python=None):
+        self.targets = targets
+        self.self_runner_path = self_runner_path
+        self.workers = max(1, workers)
+        self.cycles = cycles
+        self.interval = interval
+        self.gate = gate
+        self.status_interval = status_interval
+        self.status_path = status_path
+        self.extra_args = list(extra_args)
+        self.python = python or sys.executable
+        self.statuses = {t.name: TargetStatus(t) for t in targets}
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+        self._processes = {}
+        self._stopping = threading.Event()
+
+    def run_cycle(self, target):
+        """
+        対象の 1 サイクルを実行する（ワーカースレッドで呼ばれる）。戻り値: 終了コード
+        """
+        os.makedirs(target.state_dir, exist_ok=True)
+        log_path = os.path.join(target.state_dir, "runner.log")
+        since = datetime.now().isoformat(timespec="seconds")
+        llm_base_url = self.gate.url_for(target.name) if self.gate else None
+        cmd = [self.python, self.self_runner_path, "--auto"] + self.extra_args
+        with open(log_path, "a", encoding="utf-8") as log:
+            log.write(f"\n===== {since} サイクル開始 =====\n")
+            log.flush()
+            process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                                       env=target.env(llm_base_url=llm_base_url))
+            with self._lock:
+                self._processes[target.name] = process
+            try:
+                returncode = process.wait()
+            finally:
+                with self._lock:
+                    self._processes.pop(target.name, None)
+
+        status = self.statuses[target.name]
+        record = _last_run_record(os.path.join(target.state_dir, "metrics", "runs.jsonl"), since)
+        with self._lock:
+            status.last_exit = returncode
+            status.last_message = _last_message(log_path)
+            if record:
+                counters = entry_counters(record)
+                status.fixes_applied += counters.get("auto_fixes_applied", 0)
+                status.prompt_tokens += counters.get("prompt_tokens", 0)
+                status.completion_tokens += counters.get("completion_tokens", 0)
+        return returncode
+
+    def _finish(self, name, future, started):
+        status = self.statuses[name]
+        try:
+            returncode = future.result()
+        except Exception as e:
+            returncode = None
+            status.last_message = f"{type(e).__name__}: {e}"
+        with self._lock:
+            status.cycles += 1
+            status.busy_seconds += time.monotonic() - started
+            ok = returncode == 0
+            if not ok:
+                status.failures += 1
+            status.state = "ok" if ok else "failed"
+            if self._stopping.is_set() or (self.cycles and status.cycles >= self.cycles):
+                status.next_run = None
+            else:
+                status.next_run = time.monotonic() + self.interval
+        return status.next_run
+
+    def run(self):
+        """
+        すべての対象のサイクルが終わるまで（cycles=0 なら stop() されるまで）実行する。
+        戻り値: 最後のサイクルがすべて成功したら True
+        """
+        # (開始してよい時刻, 登録順, 対象名) の優先度つきキュー
+        ready = [(0.0, i, t.name) for i, t in enumerate(self.targets)]
+        heapq.heapify(ready)
+        order = len(ready)
+        running = {}
+        next_status = time.monotonic() + self.status_interval
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="target") as pool:
+            try:
+                while ready or running:
+                    if self._stopping.is_set() and not running:
+                        break
+                    now = time.monotonic()
+                    while ready and ready[0][0] <= now and len(running) < self.workers \
+                            and not self._stopping.is_set():
+                        _, _, name = heapq.heappop(ready)
+                        with self._lock:
+                            self.statuses[name].state = "running"
+                        future = pool.submit(self.run_cycle, self.statuses[name].target)
+                        running[future] = (name, time.monotonic())
+
+                    # 次に状態を表示する時刻か、次の対象を始められる時刻まで待つ
+                    timeout = max(0.05, min(next_status, ready[0][0] if ready else next_status) - now)
+                    if running:
+                        done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                    else:
+                        done = set()
+                        time.sleep(timeout)
+                    for future in done:
+                        name, started = running.pop(future)
+                        next_run = self._finish(name, future, started)
+                        self.print_event(name)
+                        if next_run is not None:
+                            heapq.heappush(ready, (next_run, order, name))
+                            order += 1
+                    if time.monotonic() >= next_status:
+                        self.print_status()
+                        next_status = time.monotonic() + self.status_interval
+            except KeyboardInterrupt:
+                print("\n⏹ 中断しました。実行中の対象を停止します。")
+                self.stop(kill=True)
+                for future in running:
+                    future.exception()
+            finally:
+                self.write_status()
+        return all(s.last_exit == 0 for s in self.statuses.values())
+
+    def stop(self, kill=False):
+        """
+        新しいサイクルを始めないようにする。kill=True なら実行中のサイクルも停止する。
+        """
+        self._stopping.set()
+        if kill:
+            with self._lock:
+                processes = list(self._processes.values())
+            for process in processes:
+                process.kill()
+
+    def status(self):
+        with self._lock:
+            targets = [s.to_dict() for s in self.statuses.values()]
+        counts = {state: sum(1 for t in targets if t["state"] == state) for state in STATES}
+        return {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "elapsed_seconds": round(time.monotonic() - self.started, 1),
+            "workers": self.workers,
+            "states": counts,
+            "fixes_applied": sum(t["fixes_applied"] for t in targets),
+            "prompt_tokens": sum(t["prompt_tokens"] for t in targets),
+            "completion_tokens": sum(t["completion_tokens"] for t in targets),
+            "llm": self.gate.snapshot() if self.gate else {},
+            "llm_concurrency": self.gate.concurrency if self.gate else None,
+            "targets": targets,
+        }
+
+    def write_status(self):
+        if not self.status_path:
+            return
+        os.makedirs(os.path.dirname(self.status_path) or ".", exist_ok=True)
+        tmp_path = f"{self.status_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.status(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    def print_event(self, name):
+        status = self.statuses[name]
+        mark = "✅" if status.state == "ok" else "❌"
+        print(f"{mark} [{name}] サイクル {status.cycles} 終了（終了コード {status.last_exit}）: {status.last_message}")
+
+    def print_status(self):
+        print(format_status(self.status()))
+        self.write_status()
+
+
+def format_status(status):
+    """
+    MultiRunner.status() を表にした文字列を返す。
+    """
+    states = status["states"]
+    lines = [
+        f"\n📋 {datetime.now():%H:%M:%S} 対象 {len(status['targets'])} 件"
+        f"（実行中 {states['running']} / 待ち {states['waiting']} / 成功 {states['ok']} / 失敗 {states['failed']}）"
+        f" 経過 {status['elapsed_seconds'] / 60:.1f} 分",
+        f"{'対象':<20} {'状態':<8} {'回数':>4} {'失敗':>4} {'修正':>4} {'トークン':>12} {'LLM 要求':>8} {'待ち(秒)':>8}",
+    ]
+    for t in status["targets"]:
+        llm = status["llm"].get(t["name"], {})
+        tokens = f"{t['prompt_tokens']}+{t['completion_tokens']}"
+        lines.append(
+            f"{t['name']:<20} {t['state']:<8} {t['cycles']:>4} {t['failures']:>4} {t['fixes_applied']:>4} "
+            f"{tokens:>12} {llm.get('requests', 0):>8} {llm.get('wait_seconds', 0.0):>8.1f}"
+        )
+    if status["llm_concurrency"]:
+        in_flight = sum(u["in_flight"] for u in status["llm"].values())
+        waiting = sum(u["waiting"] for u in status["llm"].values())
+        lines.append(f"LLM: 同時 {in_flight}/{status['llm_concurrency']}・待ち {waiting}・"
+                     f"修正 合計 {status['fixes_applied']} 件・トークン 合計 "
+                     f"{status['prompt_tokens']}+{status['completion_tokens']}")
+    return "\n".join(lines)
@@ -0,0 +1,320 @@
+import os
+import re
+
+import file_cache
+from timing import timed
+
+HUNK_HEADER_PATTERN = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@")
+
+
+class PatchError(Exception):
+    pass
+
+
+class Hunk:
+    def __init__(self, old_start, old_count, new_start, new_count, header_lineno):
+        self.old_start = old_start
+        self.old_count = old_count
+        self.new_start = new_start
+        self.new_count = new_count
+        # パッチファイル内でのヘッダー行の行番号（エラー表示用）
+        self.header_lineno = header_lineno
+        # [(" " / "-" / "+", 行テキスト（改行なし）), ...]
+        self.lines = []
+        # "\ No newline at end of file" が付いた行の self.lines 内の位置
+        self.no_eol = set()
+
+    def mark_no_eol(self):
+        if self.lines:
+            self.no_eol.add(len(self.lines) - 1)
+
+    @property
+    def old_lines(self):
+        return [text for tag, text in self.lines if tag in (" ", "-")]
+
+    @property
+    def new_lines(self):
+        return [text for tag, text in self.lines if tag in (" ", "+")]
+
+
+class FilePatch:
+    def __init__(self, old_path, new_path):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.hunks = []
+
+
+class HunkResult:
+    def __init__(self, index, ok, offset=0, reason=""):
+        self.index = index
+        self.ok = ok
+        # ヘッダーの行番号からのずれ（行数）
+        self.offset = offset
+        self.reason = reason
+
+
+class FileResult:
+    def __init__(self, path):
+        self.path = path
+        self.hunks = []
+        self.error = ""
+
+    @property
+    def ok(self):
+        return not self.error and all(h.ok for h in self.hunks)
+
+
+class PatchResult:
+    def __init__(self):
+        self.files = []
+        self.applied = False
+        # 適用後のファイルの内容 {project_root からの相対パス: テキスト}（check_only でも入る）
+        self.new_texts = {}
+
+    @property
+    def ok(self):
+        return all(f.ok for f in self.files)
+
+    def describe(self):
+        """
+        ファイル・ハンクごとの結果を人が読める形で返す。
+        """
+        out = []
+        for f in self.files:
+            out.append(f"{'✅' if f.ok else '❌'} {f.path}")
+            if f.error:
+                out.append(f"    {f.error}")
+            for h in f.hunks:
+                if not h.ok:
+                    out.append(f"    ハンク {h.index + 1}: {h.reason}")
+                elif h.offset:
+                    out.append(f"    ハンク {h.index + 1}: {h.offset:+d} 行ずれた位置に適用")
+        return "\n".join(out)
+
+
+def _strip_prefix(path):
+    path = path.split("\t")[0].strip()
+    if path.startswith(("a/", "b/")):
+        return path[2:]
+    return path
+
+
+def parse_patch(text):
+    """
+    unified diff（git diff 形式を含む）を解析して FilePatch のリストを返す。
+    複数ファイル・複数ハンクに対応する。
+    """
+    patches = []
+    current = None
+    hunk = None
+    remaining_old = remaining_new = 0
+
+    # splitlines() は \x0c や \u2028 などでも分割してしまうので "\n" だけで分ける
+    lines = text.split("\n")
+    if lines and lines[-1] == "":
+        lines.pop()
+    for i, raw in enumerate(lines, start=1):
+        line = raw.rstrip("\r")
+        if hunk is not None and (remaining_old > 0 or remaining_new > 0):
+            tag = line[:1] if line else " "
+            body = line[1:]
+            if tag == " ":
+                remaining_old -= 1
+                remaining_new -= 1
+            elif tag == "-":
+                remaining_old -= 1
+            elif tag == "+":
+                remaining_new -= 1
+            elif tag == "\\":
+                hunk.mark_no_eol()
+                continue
+            else:
+                raise PatchError(f"{i} 行目: ハンク本文に不正な行があります: {line!r}")
+            hunk.lines.append((tag, body))
+            continue
+
+        if line.startswith("\\"):
+            # "\ No newline at end of file"（直前の行に改行がない）
+            if hunk is not None:
+                hunk.mark_no_eol()
+            continue
+        if line.startswith("diff --git "):
+            current = None
+            hunk = None
+        elif line.startswith("--- "):
+            current = FilePatch(_strip_prefix(line[4:]), None)
+            patches.append(current)
+            hunk = None
+        elif line.startswith("+++ "):
+            if current is None:
+                raise PatchError(f"{i} 行目: '---' 行のない '+++' 行があります")
+            current.new_path = _strip_prefix(line[4:])
+        elif line.startswith("@@"):
+            m = HUNK_HEADER_PATTERN.match(line)
+            if not m or current is None:
+                raise PatchError(f"{i} 行目: ハンクヘッダーを解釈できません: {line!r}")
+            old_start, old_count, new_start, new_count = m.groups()
+            hunk = Hunk(
+                int(old_start), int(old_count) if old_count is not None else 1,
+                int(new_start), int(new_count) if new_count is not None else 1,
+                i
+            )
+            current.hunks.append(hunk)
+            remaining_old, remaining_new = hunk.old_count, hunk.new_count
+        elif hunk is not None and line.startswith((" ", "-", "+")):
+            raise PatchError(
+                f"{hunk.header_lineno} 行目のハンク: 本文の行数がヘッダー "
+                f"(-{hunk.old_count} +{hunk.new_count}) より多くなっています"
+            )
+
+    if hunk is not None and (remaining_old > 0 or remaining_new > 0):
+        raise PatchError(f"{hunk.header_lineno} 行目のハンク: 本文の行数がヘッダーより少なくなっています")
+    return patches
+
+
+def _matches(lines, pos, expected):
+    if pos < 0 or pos + len(expected) > len(lines):
+        return False
+    for k, text in enumerate(expected):
+        if lines[pos + k].rstrip("\r\n") != text:
+            return False
+    return True
+
+
+def _find_hunk(lines, expected, guess, min_pos):
+    """
+    expected の行が並ぶ位置を guess から近い順に探す（min_pos より前は探さない）。
+    """
+    if _matches(lines, guess, expected):
+        return guess
+    limit = max(guess - min_pos, len(lines) - guess)
+    for delta in range(1, limit + 1):
+        for pos in (guess - delta, guess + delta):
+            if pos >= min_pos and _matches(lines, pos, expected):
+                return pos
+    return None
+
+
+def _mismatch_reason(lines, pos, expected):
+    for k, text in enumerate(expected):
+        if pos + k >= len(lines):
+            return f"{pos + k + 1} 行目: ファイルの終わりに達しました（期待: {text!r}）"
+        actual = lines[pos + k].rstrip("\r\n")
+        if actual != text:
+            return f"{pos + k + 1} 行目が一致しません（期待: {text!r} / 実際: {actual!r}）"
+    return "一致する位置が見つかりません"
+
+
+def _resolve_target(project_root, rel_path):
+    """
+    パッチの対象パスを project_root 配下の絶対パスにする。
+    絶対パスや "../" などで project_root の外を指す場合は None を返す。
+    """
+    if not rel_path or os.path.isabs(rel_path) or os.path.splitdrive(rel_path)[0]:
+        return None
+    root = os.path.realpath(project_root)
+    target = os.path.realpath(os.path.join(root, rel_path))
+    if os.path.commonpath([root, target]) != root:
+        return None
+    return target
+
+
+def _apply_file_patch(lines, file_patch, result):
+    """
+    lines（改行コード付き）に file_patch のハンクを順に適用した新しい行リストを返す。
+    失敗したハンクは result に理由を記録し、None を返す。
+    """
+    newline = "\n"
+    for line in lines:
+        if line.endswith("\r\n"):
+            newline = "\r\n"
+            break
+        if line.endswith("\n"):
+            break
+
+    out = []
+    src_pos = 0
+    delta = 0
+    for index, hunk in enumerate(file_patch.hunks):
+        expected = hunk.old_lines
+        # 行数 0 のハンク（純粋な挿入）は "その行の後ろ" を表す
+        guess = (hunk.old_start if hunk.old_count == 0 else hunk.old_start - 1) + delta
+        pos = _find_hunk(lines, expected, guess, src_pos)
+        if pos is None:
+            result.hunks.append(HunkResult(index, False, reason=_mismatch_reason(lines, max(guess, src_pos), expected)))
+            continue
+        result.hunks.append(HunkResult(index, True, offset=pos - guess))
+        delta += pos - guess
+
+        out.extend(lines[src_pos:pos])
+        old_k = pos
+        for k, (tag, text) in enumerate(hunk.lines):
+            if tag == " ":
+                out.append(lines[old_k])
+                old_k += 1
+            elif tag == "-":
+                old_k += 1
+            elif k in hunk.no_eol:
+                out.append(text)
+            else:
+                # 置き換え対象の行と同じ改行コードを使う
+                eol = newline
+                if old_k < len(lines) and lines[old_k].endswith(("\n", "\r\n")):
+                    eol = "\r\n" if lines[old_k].endswith("\r\n") else "\n"
+                out.append(text + eol)
+        src_pos = old_k
+
+    if not all(h.ok for h in result.hunks):
+        return None
+    out.extend(lines[src_pos:])
+    return out
+
+
+@timed("patch_apply.apply_patch")
+def apply_patch(patch_text, project_root, check_only=False):
+    """
+    unified diff を project_root 配下のファイルに適用する（git apply の代わり）。
+    すべてのファイル・ハンクが適用できることを確認してから書き込むので、
+    一部だけが適用された状態にはならない。書き込みは一時ファイル + 置き換えで行う。
+    check_only=True なら確認だけ行い、書き込まない。
+    戻り値: PatchResult
+    """
+    result = PatchResult()
+    try:
+        file_patches = parse_patch(patch_text)
+    except PatchError as e:
+        fr = FileResult("(patch)")
+        fr.error = str(e)
+        result.files.append(fr)
+        return result
+
+    outputs = []
+    for file_patch in file_patches:
+        rel_path = file_patch.new_path or file_patch.old_path
+        target = _resolve_target(project_root, rel_path)
+        fr = FileResult(rel_path)
+        result.files.append(fr)
+        if target is None:
+            fr.error = "プロジェクトの外を指すパスには適用できません"
+            continue
+        if not os.path.exists(target):
+            fr.error = "ファイルが存在しません"
+            continue
+        new_lines = _apply_file_patch(file_cache.read_all_lines(target), file_patch, fr)
+        if new_lines is not None:
+            outputs.append((target, "".join(new_lines)))
+            result.new_texts[rel_path] = outputs[-1][1]
+
+    if not result.ok or check_only:
+        return result
+
+    for target, text in outputs:
+        file_cache.write_text(target, text)
+    result.applied = True
+    return result
+
+
+def apply_patch_file(patch_path, project_root, check_only=False):
+    # 改行コードを変換しない（行の途中の "\r" を改行として扱わないため）
+    with open(patch_path, "r", encoding="utf-8", newline="") as f:
+        return apply_patch(f.read(), project_root, check_only)
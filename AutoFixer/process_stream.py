@@ -0,0 +1,189 @@
+import os
+import re
+import time
+import queue
+import threading
+import subprocess
+from collections import deque
+
+# Traceback の最後に出る「例外名: メッセージ」の行（例: "ValueError: bad", "KeyboardInterrupt"）
+EXCEPTION_LINE_PATTERN = re.compile(r"^[A-Za-z_][\w.]*(Error|Exception|Exit|Interrupt|Warning)\b(:.*)?$")
+FILE_LINE_PATTERN = re.compile(r'^\s+File ".+", line \d+')
+CHAIN_MARKERS = (
+    "During handling of the above exception, another exception occurred:",
+    "The above exception was the direct cause of the following exception:",
+)
+
+
+class LineRingBuffer:
+    """
+    最新 max_lines 行だけを保持するリングバッファ。
+    出力がどれだけ多くてもメモリ使用量は一定。
+    """
+
+    def __init__(self, max_lines=2000):
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+
+    def append(self, line):
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+
+    def text(self):
+        return "".join(self.lines)
+
+
+class TracebackWatcher:
+    """
+    出力を 1 行ずつ受け取り、Traceback が出たか・完結したかを判定する。
+    error_type は self_runner.detect_error_type と同じ判定（"syntax" / "runtime" / None）。
+    """
+
+    def __init__(self):
+        self.has_syntax_error = False
+        self.has_traceback = False
+        self.in_traceback = False
+        self.complete = False
+
+    def feed(self, line):
+        text = line.rstrip("\r\n")
+        if "SyntaxError" in text or "IndentationError" in text:
+            self.has_syntax_error = True
+        if "Traceback" in text:
+            self.has_traceback = True
+
+        if text.startswith("Traceback (most recent call last):"):
+            self.in_traceback = True
+            self.complete = False
+        elif text in CHAIN_MARKERS:
+            # 連鎖した例外が続くので、まだ完結していない
+            self.in_traceback = True
+            self.complete = False
+        elif FILE_LINE_PATTERN.match(text) and not self.in_traceback:
+            # 実行前の SyntaxError は "Traceback" 行なしで File 行から始まる
+            self.in_traceback = True
+            self.complete = False
+        elif self.in_traceback and EXCEPTION_LINE_PATTERN.match(text):
+            self.in_traceback = False
+            self.complete = True
+        return self.complete
+
+    @property
+    def error_type(self):
+        if self.has_syntax_error:
+            return "syntax"
+        if self.has_traceback:
+            return "runtime"
+        return None
+
+
+class StreamResult:
+    def __init__(self, stdout, stderr, returncode, aborted, error_type, dropped_lines):
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.aborted = aborted
+        self.error_type = error_type
+        self.dropped_lines = dropped_lines
+
+
+def _pump(stream, name, q):
+    for line in iter(stream.readline, ""):
+        q.put((name, line))
+    stream.close()
+    q.put((name, None))
+
+
+def stream_process(cmd, cwd=None, on_line=None, abort_on_traceback=False,
+                   max_lines=2000, grace=0.2, env=None, cancel_event=None):
+    """
+    cmd を実行し、stdout / stderr を 1 行ずつ読みながら処理する。
+
+    - on_line(name, line): 1 行ごとに呼ばれる（name は "stdout" / "stderr"）
+    - abort_on_traceback: True なら Traceback が完結した時点で子プロセスを停止する。
+      連鎖した例外を取りこぼさないよう、完結後 grace 秒だけ続きを待つ。
+    - max_lines: 戻り値として保持する行数（各ストリームごと）
+    - cancel_event: threading.Event。セットされたら子プロセスを停止する
+
+    戻り値: StreamResult（stdout / stderr は末尾 max_lines 行のみ）
+    """
+    run_env = dict(os.environ if env is None else env)
+    run_env.setdefault("PYTHONUNBUFFERED", "1")
+
+    process = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        errors="replace",
+        bufsize=1,
+        cwd=cwd,
+        env=run_env
+    )
+    return consume_process(process, on_line, abort_on_traceback, max_lines, grace, cancel_event)
+
+
+def consume_process(process, on_line=None, abort_on_traceback=False, max_lines=2000, grace=0.2, cancel_event=None):
+    """
+    起動済みのプロセスの出力を stream_process と同じように読む。
+    process は subprocess.Popen と同じく stdout / stderr（テキスト）、kill()、wait() を持つもの
+    （warm_runner.WarmProcess など）。引数・戻り値は stream_process と同じ。
+    """
+    q = queue.Queue()
+    buffers = {"stdout": LineRingBuffer(max_lines), "stderr": LineRingBuffer(max_lines)}
+    watchers = {"stdout": TracebackWatcher(), "stderr": TracebackWatcher()}
+    threads = [
+        threading.Thread(target=_pump, args=(process.stdout, "stdout", q), daemon=True),
+        threading.Thread(target=_pump, args=(process.stderr, "stderr", q), daemon=True),
+    ]
+    for t in threads:
+        t.start()
+
+    open_streams = 2
+    aborted = False
+    abort_deadline = None
+    while open_streams:
+        if cancel_event is not None and cancel_event.is_set() and not aborted:
+            process.kill()
+            aborted = True
+        if abort_deadline is not None and time.monotonic() >= abort_deadline and not aborted:
+            process.kill()
+            aborted = True
+
+        try:
+            name, line = q.get(timeout=0.05)
+        except queue.Empty:
+            continue
+        if line is None:
+            open_streams -= 1
+            continue
+
+        buffers[name].append(line)
+        if on_line:
+            on_line(name, line)
+        complete = watchers[name].feed(line)
+        if abort_on_traceback and not aborted:
+            if complete:
+                if abort_deadline is None:
+                    abort_deadline = time.monotonic() + grace
+            elif watchers[name].in_traceback:
+                abort_deadline = None
+
+    returncode = process.wait()
+    for t in threads:
+        t.join()
+
+    if watchers["stdout"].error_type == "syntax" or watchers["stderr"].error_type == "syntax":
+        error_type = "syntax"
+    else:
+        error_type = watchers["stderr"].error_type or watchers["stdout"].error_type
+
+    return StreamResult(
+        buffers["stdout"].text(),
+        buffers["stderr"].text(),
+        returncode,
+        aborted,
+        error_type,
+        buffers["stdout"].dropped + buffers["stderr"].dropped
+    )
@@ -0,0 +1,184 @@
+import os
+
+from traceback_parser import parse_last_traceback
+from file_editor import read_context_lines
+
+
+def estimate_tokens(text):
+    """
+    トークン数の概算。英数字・記号は約 4 文字で 1 トークン、日本語などはおよそ 1 文字 1 トークンとして数える。
+    """
+    ascii_count = len(text.encode("ascii", "ignore"))
+    return ascii_count // 4 + (len(text) - ascii_count) + 1
+
+
+def dedupe_lines(lines):
+    """
+    同じ内容の行を 1 行にまとめ、2 回以上出た行には "（×回数）" を付ける。
+    順番は最初に出てきた位置のまま。
+    """
+    counts = {}
+    order = []
+    for line in lines:
+        key = line.rstrip()
+        if not key:
+            continue
+        if key not in counts:
+            counts[key] = 0
+            order.append(key)
+        counts[key] += 1
+    return [f"{key}（×{counts[key]}）" if counts[key] > 1 else key for key in order]
+
+
+class Prompt:
+    def __init__(self, text, tokens, budget, omitted=None):
+        self.text = text
+        self.tokens = tokens
+        self.budget = budget
+        # 上限に収めるために省いたもの（表示用）
+        self.omitted = omitted or []
+
+    def summary(self):
+        s = f"推定トークン数: {self.tokens} / 上限 {self.budget}"
+        if self.omitted:
+            s += f"（省略: {', '.join(self.omitted)}）"
+        return s
+
+
+class PromptBuilder:
+    """
+    ChatGPT への質問文を、トークン数の上限（token_budget）に収まるように組み立てる。
+    実行時エラーでは、ログ全体ではなく
+      1. 最後の Traceback（フレームと例外）
+      2. プロジェクト内のフレームのソースコード（エラー行の前後 context 行）
+      3. 直前の出力（重複行はまとめる）
+    を、この優先順位で上限まで入れる。
+    """
+
+    def __init__(self, project_root, token_budget=3000, context=5, log_tail_lines=50):
+        self.project_root = project_root
+        self.token_budget = token_budget
+        self.context = context
+        self.log_tail_lines = log_tail_lines
+
+    def _source_window(self, relpath, lineno):
+        abs_path = os.path.join(self.project_root, relpath)
+        if not os.path.exists(abs_path):
+            return None
+        lines = read_context_lines(abs_path, lineno, self.context)
+        body = "\n".join(
+            f"{'>>' if n == lineno else '  '} {n}: {text}" for n, text in lines
+        )
+        return f"# {relpath}（{lineno}行目）\n```python\n{body}\n```"
+
+    def _format_traceback(self, tb, max_frames=None):
+        out = []
+        for inner in tb.chain:
+            out.append(f"（この前に発生した例外）{inner.exc_type}: {inner.message}")
+        frames = tb.frames
+        skipped = 0
+        if max_frames is not None and len(frames) > max_frames:
+            # 最初と最後のフレームを残して途中を省く
+            head = max_frames // 2
+            tail = max_frames - head
+            skipped = len(frames) - max_frames
+            frames = frames[:head] + frames[-tail:] if tail else frames[:head]
+        for i, frame in enumerate(frames):
+            if skipped and i == max_frames // 2:
+                out.append(f"  ...（{skipped} フレーム省略）")
+            path = frame.relpath or frame.path
+            func = f", in {frame.function}" if frame.function else ""
+            out.append(f'  File "{path}", line {frame.lineno}{func}')
+        out.append(f"{tb.exc_type}: {tb.message}" if tb.message else tb.exc_type)
+        return "Traceback (most recent call last):\n" + "\n".join(out)
+
+    def build_runtime_prompt(self, log_text, tb=None):
+        """
+        tb に解析済みの Traceback（parse_last_traceback の結果）を渡すと、log_text を解析し直さない。
+        """
+        header = "以下のPython実行時エラーを修正してください:\n"
+        if tb is None:
+            tb = parse_last_traceback(log_text, self.project_root)
+        omitted = []
+
+        if tb is None:
+            # Traceback を解析できない場合は、ログの末尾だけを送る
+            tail = dedupe_lines(log_text.splitlines()[-self.log_tail_lines:])
+            return self._fit(header, tail, omitted)
+
+        tb_text = self._format_traceback(tb)
+        if estimate_tokens(header + tb_text) > self.token_budget:
+            tb_text = self._format_traceback(tb, max_frames=10)
+            omitted.append("Traceback の途中のフレーム")
+        sections = [f"\n## Traceback\n{tb_text}"]
+
+        # 内側（エラーに近い）フレームから順にソースを付ける
+        seen = set()
+        windows = []
+        for frame in reversed(tb.frames):
+            if frame.relpath is None or (frame.relpath, frame.lineno) in seen:
+                continue
+            seen.add((frame.relpath, frame.lineno))
+            window = self._source_window(frame.relpath, frame.lineno)
+            if window:
+                windows.append(window)
+
+        used = estimate_tokens(header + "".join(sections))
+        added = 0
+        for window in windows:
+            cost = estimate_tokens(window)
+            if used + cost > self.token_budget:
+                break
+            sections.append("\n" + window)
+            used += cost
+            added += 1
+        if added < len(windows):
+            omitted.append(f"ソースコード {len(windows) - added} 箇所")
+
+        # Traceback より前の出力（連鎖した例外があれば最初の Traceback より前）
+        end = len(log_text)
+        for _ in range(len(tb.chain) + 1):
+            pos = log_text.rfind("Traceback (most recent call last):", 0, end)
+            if pos == -1:
+                break
+            end = pos
+        tail = dedupe_lines(log_text[:end].splitlines()[-self.log_tail_lines:])
+        return self._fit(header + "".join(sections), tail, omitted)
+
+    def _fit(self, body, tail, omitted):
+        """
+        body に、上限に収まる範囲でログの末尾（tail の後ろの行から優先）を付け足す。
+        """
+        used = estimate_tokens(body)
+        kept = []
+        for line in reversed(tail):
+            cost = estimate_tokens(line) + 1
+            if used + cost > self.token_budget:
+                omitted.append(f"出力 {len(tail) - len(kept)} 行")
+                break
+            kept.append(line)
+            used += cost
+        text = body
+        if kept:
+            text += "\n## 直前の出力\n" + "\n".join(reversed(kept))
+        return Prompt(text, estimate_tokens(text), self.token_budget, omitted)
+
+    def build_syntax_prompt(self, abs_path, lineno):
+        """
+        文法エラー用の質問文。戻り値: (context_lines, Prompt)
+        """
+        context = self.context
+        while True:
+            context_lines = read_context_lines(abs_path, lineno, context)
+            context_code = "\n".join(f"{lineno_i}: {line_text}" for lineno_i, line_text in context_lines)
+            text = (
+                f"以下のPythonコードには文法エラーがあります。\n"
+                f"{lineno} 行目に問題があります。文法的に正しい形に修正してください：\n"
+                f"出力されるコードは、該当する{lineno} 行目に対してだけにして他の行については回答に含めないでください\n"
+                f"```python\n{context_code}\n```"
+            )
+            tokens = estimate_tokens(text)
+            if tokens <= self.token_budget or context == 0:
+                omitted = [f"前後 {self.context - context} 行"] if context < self.context else []
+                return context_lines, Prompt(text, tokens, self.token_budget, omitted)
+            context -= 1
@@ -0,0 +1,416 @@
+import os
+import re
+import csv
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+import threading
+from datetime import datetime, timedelta
+
+DEFAULT_DB_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "QA.sqlite3")
+# 検索・集計・書き出しで使える列
+FIELDS = ("id", "created_at", "model", "source", "prompt", "response", "latency_ms", "prompt_tokens",
+          "completion_tokens", "error_type", "error_message", "target_file", "lineno", "applied", "project_root")
+GROUP_BY = {
+    "error_type": "error_type",
+    "model": "model",
+    "source": "source",
+    "target_file": "target_file",
+    "applied": "applied",
+    "day": "substr(created_at, 1, 10)",
+}
+RELATIVE_TIME_PATTERN = re.compile(r"^(\d+(?:\.\d+)?)\s*([mhdw])$")
+QA_TXT_LABEL_PATTERN = re.compile(r"^【(質問|回答)(?:（(.*?)）)?】(.*)$")
+
+
+def parse_time(value):
+    """
+    "7d" / "24h" / "30m" / "2w"（今からさかのぼった時刻）か ISO 形式の日時を ISO 形式の文字列にする。
+    """
+    if value is None:
+        return None
+    match = RELATIVE_TIME_PATTERN.match(value.strip())
+    if match:
+        amount, unit = float(match.group(1)), match.group(2)
+        delta = {"m": timedelta(minutes=amount), "h": timedelta(hours=amount),
+                 "d": timedelta(days=amount), "w": timedelta(weeks=amount)}[unit]
+        return (datetime.now() - delta).isoformat(timespec="seconds")
+    return datetime.fromisoformat(value.strip()).isoformat(timespec="seconds")
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+class QAStore:
+    """
+    ChatGPT とのやりとり（質問・回答）を 1 件 1 レコードで保存する SQLite のデータベース。
+    エラー種別・モデル・対象ファイル・日時などの列にインデックスを張り、質問・回答の本文は
+    FTS5（trigram。使えなければ LIKE）で全文検索できるようにする。
+    """
+
+    def __init__(self, db_path=DEFAULT_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self._create_tables()
+        self.fts = self._create_fts()
+
+    def _create_tables(self):
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS exchanges (
+                    id INTEGER PRIMARY KEY,
+                    created_at TEXT NOT NULL,
+                    model TEXT,
+                    source TEXT NOT NULL,
+                    prompt TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    latency_ms REAL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    error_type TEXT,
+                    error_message TEXT,
+                    target_file TEXT,
+                    lineno INTEGER,
+                    applied INTEGER,
+                    project_root TEXT
+                );
+                CREATE INDEX IF NOT EXISTS idx_exchanges_created ON exchanges (created_at);
+                CREATE INDEX IF NOT EXISTS idx_exchanges_error_type ON exchanges (error_type, created_at);
+                CREATE INDEX IF NOT EXISTS idx_exchanges_model ON exchanges (model, created_at);
+                CREATE INDEX IF NOT EXISTS idx_exchanges_target ON exchanges (target_file, created_at);
+                CREATE INDEX IF NOT EXISTS idx_exchanges_applied ON exchanges (applied, created_at);
+            """)
+
+    def _create_fts(self):
+        """
+        全文検索用の FTS5 テーブルを作る。日本語も部分一致で引けるよう trigram を使い、
+        古い SQLite で trigram がなければ unicode61、FTS5 自体がなければ None（LIKE で検索）。
+        """
+        row = self.conn.execute("SELECT sql FROM sqlite_master WHERE name = 'exchanges_fts'").fetchone()
+        if row:
+            return "trigram" if "trigram" in row["sql"] else "unicode61"
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                with self.conn:
+                    self.conn.executescript(f"""
+                        CREATE VIRTUAL TABLE exchanges_fts USING fts5(
+                            prompt, response, content='exchanges', content_rowid='id', tokenize='{tokenizer}'
+                        );
+                        CREATE TRIGGER exchanges_fts_insert AFTER INSERT ON exchanges BEGIN
+                            INSERT INTO exchanges_fts (rowid, prompt, response) VALUES (new.id, new.prompt, new.response);
+                        END;
+                        CREATE TRIGGER exchanges_fts_delete AFTER DELETE ON exchanges BEGIN
+                            INSERT INTO exchanges_fts (exchanges_fts, rowid, prompt, response)
+                            VALUES ('delete', old.id, old.prompt, old.response);
+                        END;
+                        INSERT INTO exchanges_fts (exchanges_fts) VALUES ('rebuild');
+                    """)
+                return tokenizer
+            except sqlite3.OperationalError:
+                continue
+        return None
+
+    def record(self, prompt, response, model=None, source="api", latency_ms=None, prompt_tokens=None,
+               completion_tokens=None, error_type=None, error_message=None, target_file=None, lineno=None,
+               applied=None, project_root=None, created_at=None):
+        """
+        1 件のやりとりを保存し、レコードの id を返す。
+        """
+        with self._lock, self.conn:
+            cur = self.conn.execute("""
+                INSERT INTO exchanges (created_at, model, source, prompt, response, latency_ms, prompt_tokens,
+                    completion_tokens, error_type, error_message, target_file, lineno, applied, project_root)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (created_at or datetime.now().isoformat(timespec="seconds"), model, source, prompt, response,
+                  latency_ms, prompt_tokens, completion_tokens, error_type, error_message,
+                  target_file.replace("\\", "/") if target_file else None, lineno,
+                  None if applied is None else int(bool(applied)), project_root))
+            return cur.lastrowid
+
+    def mark_applied(self, record_id, applied=True):
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE exchanges SET applied = ? WHERE id = ?", (int(bool(applied)), record_id))
+
+    def _where(self, text=None, error_type=None, model=None, target=None, applied=None, source=None,
+               since=None, until=None):
+        clauses, params = [], []
+        if text:
+            if self.fts == "trigram" and len(text) >= 3 or self.fts == "unicode61":
+                clauses.append("e.id IN (SELECT rowid FROM exchanges_fts WHERE exchanges_fts MATCH ?)")
+                params.append('"' + text.replace('"', '""') + '"')
+            else:
+                # FTS5 がないか、trigram で引けない 2 文字以下の語
+                clauses.append("(e.prompt LIKE ? ESCAPE '\\' OR e.response LIKE ? ESCAPE '\\')")
+                escaped = "%" + re.sub(r"([\\%_])", r"\\\1", text) + "%"
+                params += [escaped, escaped]
+        for column, value in (("error_type", error_type), ("model", model), ("source", source)):
+            if value is not None:
+                clauses.append(f"e.{column} = ?")
+                params.append(value)
+        if target is not None:
+            clauses.append("e.target_file LIKE ? ESCAPE '\\'")
+            params.append("%" + re.sub(r"([\\%_])", r"\\\1", target.replace("\\", "/")))
+        if applied is not None:
+            clauses.append("e.applied = ?")
+            params.append(int(bool(applied)))
+        if since:
+            clauses.append("e.created_at >= ?")
+            params.append(since)
+        if until:
+            clauses.append("e.created_at < ?")
+            params.append(until)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, limit=50, offset=0, oldest_first=False, **filters):
+        """
+        条件（text: 全文検索の語、error_type / model / target / applied / source / since / until）に合う
+        レコードを新しい順に返す。
+        """
+        where, params = self._where(**filters)
+        order = "ASC" if oldest_first else "DESC"
+        sql = f"SELECT e.* FROM exchanges e{where} ORDER BY e.created_at {order}, e.id {order}"
+        if limit:
+            sql += f" LIMIT {int(limit)} OFFSET {int(offset)}"
+        return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def iter_records(self, **filters):
+        where, params = self._where(**filters)
+        for row in self.conn.execute(f"SELECT e.* FROM exchanges e{where} ORDER BY e.created_at, e.id", params):
+            yield dict(row)
+
+    def stats(self, group_by=None, **filters):
+        """
+        件数・応答時間（p50/p90/最大）・トークン数・適用率を集計する。group_by は GROUP_BY のキー
+        （"day" は日付順、それ以外は件数の多い順）。
+        応答時間は API に問い合わせたもの（latency_ms があるもの）だけで計算する。
+        """
+        where, params = self._where(**filters)
+        key = GROUP_BY[group_by] if group_by else "NULL"
+        totals = self.conn.execute(f"""
+            SELECT {key} AS grp, COUNT(*) AS n, SUM(prompt_tokens) AS prompt_tokens,
+                   SUM(completion_tokens) AS completion_tokens,
+                   SUM(applied = 1) AS applied, SUM(applied IS NOT NULL) AS decided
+            FROM exchanges e{where} GROUP BY grp ORDER BY {"grp" if group_by == "day" else "n DESC"}
+        """, params).fetchall()
+        latency_where = where + (" AND " if where else " WHERE ") + "e.latency_ms IS NOT NULL"
+        latencies = {}
+        for row in self.conn.execute(f"""
+            SELECT {key} AS grp, latency_ms FROM exchanges e{latency_where} ORDER BY grp, latency_ms
+        """, params):
+            latencies.setdefault(row["grp"], []).append(row["latency_ms"])
+
+        result = []
+        for row in totals:
+            values = latencies.get(row["grp"], [])
+            result.append({
+                "group": row["grp"],
+                "count": row["n"],
+                "latency_count": len(values),
+                "latency_p50_ms": _percentile(values, 50),
+                "latency_p90_ms": _percentile(values, 90),
+                "latency_max_ms": values[-1] if values else None,
+                "prompt_tokens": row["prompt_tokens"] or 0,
+                "completion_tokens": row["completion_tokens"] or 0,
+                "applied_rate": (row["applied"] / row["decided"]) if row["decided"] else None,
+            })
+        return result
+
+    def import_qa_txt(self, path, model=None):
+        """
+        これまでの QA.txt（【質問】/【回答】の追記形式）を取り込む。日時はファイルの更新日時にする。
+        戻り値: 取り込んだ件数
+        """
+        created_at = datetime.fromtimestamp(os.path.getmtime(path)).isoformat(timespec="seconds")
+        sources = {"キャッシュから": "cache", "ファイルから": "file"}
+        pending = []
+        current = None
+        records = []
+
+        def finish():
+            if current is None:
+                return
+            kind, label, lines = current
+            text = "\n".join(lines).strip("\n")
+            if kind == "質問":
+                pending.append(text)
+            elif pending:
+                source = sources.get(label, "api")
+                # 候補（n 個の回答）は同じ質問への回答なので、最後の候補まで質問を残す
+                candidate = re.match(r"候補 (\d+)/(\d+)", label or "")
+                prompt = pending[0]
+                if not candidate or candidate.group(1) == candidate.group(2):
+                    pending.pop(0)
+                records.append((prompt, text, source))
+
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                line = line.rstrip("\r\n")
+                match = QA_TXT_LABEL_PATTERN.match(line)
+                if match:
+                    finish()
+                    current = (match.group(1), match.group(2), [match.group(3)] if match.group(3) else [])
+                elif current is not None:
+                    current[2].append(line)
+        finish()
+
+        with self._lock, self.conn:
+            self.conn.executemany("""
+                INSERT INTO exchanges (created_at, model, source, prompt, response) VALUES (?, ?, ?, ?, ?)
+            """, [(created_at, model, source, prompt, response) for prompt, response, source in records])
+        return len(records)
+
+    def close(self):
+        self.conn.close()
+
+
+# === CLI ===
+
+def _add_filters(parser):
+    parser.add_argument("--error-type", help="エラー種別（例: SyntaxError）")
+    parser.add_argument("--model", help="モデル名")
+    parser.add_argument("--file", dest="target", help="対象ファイル（末尾が一致するもの）")
+    parser.add_argument("--applied", choices=["yes", "no"], help="修正を適用したもの / しなかったもの")
+    parser.add_argument("--source", choices=["api", "cache", "file"], help="回答の出どころ")
+    parser.add_argument("--since", help="この日時以降（例: 7d, 24h, 2024-06-01）")
+    parser.add_argument("--until", help="この日時より前（例: 1d, 2024-06-08）")
+
+
+def _filters(args):
+    return {
+        "text": getattr(args, "text", None),
+        "error_type": args.error_type,
+        "model": args.model,
+        "target": args.target,
+        "applied": None if args.applied is None else args.applied == "yes",
+        "source": args.source,
+        "since": parse_time(args.since),
+        "until": parse_time(args.until),
+    }
+
+
+def _short(text, width):
+    text = " ".join((text or "").split())
+    return text if len(text) <= width else text[:width - 1] + "…"
+
+
+def print_records(records, full=False, out=sys.stdout):
+    if not records:
+        print("該当する記録がありません。", file=out)
+        return
+    for r in records:
+        applied = {1: "適用", 0: "不採用"}.get(r["applied"], "-")
+        latency = f"{r['latency_ms']:.0f}ms" if r["latency_ms"] is not None else "-"
+        where = f"{r['target_file']}:{r['lineno']}" if r["target_file"] else "-"
+        print(f"#{r['id']} {r['created_at']} {r['source']} {r['model'] or '-'} {r['error_type'] or '-'} "
+              f"{where} {latency} {applied}", file=out)
+        if full:
+            print(f"【質問】\n{r['prompt']}\n【回答】\n{r['response']}\n", file=out)
+        else:
+            print(f"    Q: {_short(r['prompt'], 100)}\n    A: {_short(r['response'], 100)}", file=out)
+
+
+def print_stats(rows, group_by=None, out=sys.stdout):
+    if not rows:
+        print("該当する記録がありません。", file=out)
+        return
+
+    def ms(value):
+        return f"{value:.0f}" if value is not None else "-"
+
+    print(f"{(group_by or ''):<28}{'件数':>8}{'p50(ms)':>10}{'p90(ms)':>10}{'最大(ms)':>10}"
+          f"{'トークン':>16}{'適用率':>8}", file=out)
+    for r in rows:
+        rate = f"{r['applied_rate'] * 100:.0f}%" if r["applied_rate"] is not None else "-"
+        tokens = f"{r['prompt_tokens']}+{r['completion_tokens']}"
+        label = "（なし）" if r["group"] is None and group_by else (r["group"] if group_by else "全体")
+        print(f"{str(label):<28}{r['count']:>8}{ms(r['latency_p50_ms']):>10}{ms(r['latency_p90_ms']):>10}"
+              f"{ms(r['latency_max_ms']):>10}{tokens:>16}{rate:>8}", file=out)
+
+
+def export_records(records, out, fmt="jsonl"):
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=FIELDS)
+        writer.writeheader()
+        for r in records:
+            writer.writerow(r)
+            count += 1
+    else:
+        for r in records:
+            out.write(json.dumps(r, ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ChatGPT とのやりとりの記録（QA.sqlite3）を検索・集計・書き出す")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="データベースの場所")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("query", help="記録を検索する（新しい順）")
+    p.add_argument("text", nargs="?", help="質問・回答の本文に含まれる語（全文検索）")
+    _add_filters(p)
+    p.add_argument("--limit", type=int, default=20)
+    p.add_argument("--full", action="store_true", help="質問・回答を省略せずに表示する")
+    p.add_argument("--json", action="store_true", help="JSON Lines で出力する")
+
+    p = sub.add_parser("stats", help="件数・応答時間（p50/p90）・トークン数・適用率を集計する")
+    p.add_argument("text", nargs="?", help="質問・回答の本文に含まれる語（全文検索）")
+    _add_filters(p)
+    p.add_argument("--group-by", choices=sorted(GROUP_BY))
+    p.add_argument("--json", action="store_true", help="JSON で出力する")
+
+    p = sub.add_parser("export", help="記録を JSON Lines / CSV で書き出す（古い順）")
+    p.add_argument("text", nargs="?", help="質問・回答の本文に含まれる語（全文検索）")
+    _add_filters(p)
+    p.add_argument("--format", choices=["jsonl", "csv"], default="jsonl")
+    p.add_argument("--output", "-o", help="出力ファイル（省略時は標準出力）")
+
+    p = sub.add_parser("import-txt", help="これまでの QA.txt を取り込む")
+    p.add_argument("path")
+    p.add_argument("--model", help="記録するモデル名")
+    args = parser.parse_args()
+
+    store = QAStore(args.db)
+    started = time.perf_counter()
+    if args.command == "query":
+        records = store.query(limit=args.limit, **_filters(args))
+        if args.json:
+            export_records(records, sys.stdout)
+        else:
+            print_records(records, args.full)
+    elif args.command == "stats":
+        rows = store.stats(args.group_by, **_filters(args))
+        if args.json:
+            print(json.dumps(rows, ensure_ascii=False, indent=2))
+        else:
+            print_stats(rows, args.group_by)
+    elif args.command == "export":
+        records = store.iter_records(**_filters(args))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8", newline="") as f:
+                count = export_records(records, f, args.format)
+            print(f"{count} 件を {args.output} に書き出しました。")
+        else:
+            export_records(records, sys.stdout, args.format)
+    elif args.command == "import-txt":
+        count = store.import_qa_txt(args.path, args.model)
+        print(f"{count} 件を取り込みました。")
+    if args.command in ("query", "stats") and not getattr(args, "json", False):
+        print(f"（{(time.perf_counter() - started) * 1000:.1f} ms）")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
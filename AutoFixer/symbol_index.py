@@ -0,0 +1,124 @@
+import os
+import ast
+from collections import namedtuple
+
+# start / end は 1 始まりで end を含む。start はデコレータの行から数える。
+# def_line は def / class の行（デコレータがなければ start と同じ）。
+Symbol = namedtuple("Symbol", ["name", "qualname", "kind", "start", "end", "indent", "def_line"])
+
+# ファイルパス → (mtime_ns, size, index)
+_index_cache = {}
+
+
+class SymbolIndex:
+    """
+    1 ファイル分の関数・メソッド・クラスの位置情報。
+    qualname（例: "MyAgent.run"）と単純名（例: "run"）のどちらでも引ける。
+    """
+
+    def __init__(self, symbols):
+        self.symbols = sorted(symbols, key=lambda s: (s.start, -s.end))
+        self.by_qualname = {s.qualname: s for s in self.symbols}
+        self.by_name = {}
+        for s in self.symbols:
+            self.by_name.setdefault(s.name, []).append(s)
+
+    def find(self, name):
+        """
+        qualname に完全一致するものを優先し、なければ単純名で最初に出てくるものを返す。
+        """
+        if name in self.by_qualname:
+            return self.by_qualname[name]
+        candidates = self.by_name.get(name)
+        return candidates[0] if candidates else None
+
+    def enclosing(self, lineno, kinds=("function", "method")):
+        """
+        lineno を含む最も内側のシンボルを返す。
+        """
+        found = None
+        for s in self.symbols:
+            if s.start > lineno:
+                break
+            if s.end >= lineno and s.kind in kinds:
+                found = s
+        return found
+
+
+def build_symbol_index(source):
+    """
+    ソースコードを ast で解析してシンボル一覧を作る。
+    文法エラーがある場合は SyntaxError を送出する。
+    """
+    tree = ast.parse(source)
+    symbols = []
+
+    def visit(node, prefix, parent_kind):
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                if isinstance(child, ast.ClassDef):
+                    kind = "class"
+                elif parent_kind == "class":
+                    kind = "method"
+                else:
+                    kind = "function"
+                qualname = f"{prefix}.{child.name}" if prefix else child.name
+                start = min([d.lineno for d in child.decorator_list] + [child.lineno])
+                symbols.append(Symbol(child.name, qualname, kind, start, child.end_lineno, child.col_offset,
+                                      child.lineno))
+                visit(child, qualname, kind)
+            else:
+                visit(child, prefix, parent_kind)
+
+    visit(tree, "", None)
+    return SymbolIndex(symbols)
+
+
+def get_symbol_index(filepath):
+    """
+    filepath のシンボルインデックスを返す。
+    mtime とサイズが前回と同じならキャッシュを返し、再解析しない。
+    """
+    key = os.path.abspath(filepath)
+    st = os.stat(key)
+    cached = _index_cache.get(key)
+    if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        return cached[2]
+
+    with open(key, "rb") as f:
+        index = build_symbol_index(f.read())
+    _index_cache[key] = (st.st_mtime_ns, st.st_size, index)
+    return index
+
+
+def find_symbol(filepath, name):
+    return get_symbol_index(filepath).find(name)
+
+
+def suggest_function_name(filepath, lineno=None, code=None):
+    """
+    置換対象の関数名を推測する。
+    1. code（ChatGPT の回答）で定義されている関数がファイル内にあればその名前
+    2. lineno（エラー行）を含む関数・メソッドの名前
+    どちらもなければ None を返す。
+    """
+    try:
+        index = get_symbol_index(filepath)
+    except (OSError, SyntaxError):
+        return None
+
+    if code:
+        try:
+            code_tree = ast.parse(code)
+        except SyntaxError:
+            code_tree = None
+        if code_tree:
+            for node in code_tree.body:
+                if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and index.find(node.name):
+                    return index.find(node.name).qualname
+
+    if lineno:
+        s = index.enclosing(lineno)
+        if s:
+            return s.qualname
+    return None
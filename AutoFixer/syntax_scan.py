@@ -0,0 +1,114 @@
+import os
+import json
+import hashlib
+
+# スキャン対象外のディレクトリ
+SKIP_DIRS = {".git", "__pycache__", ".venv", "venv", "env", "node_modules", "site-packages", ".tox", ".mypy_cache"}
+
+# これより少ないファイル数ならプロセスプールを使わない（起動コストの方が高いため）
+POOL_THRESHOLD = 32
+
+
+def iter_python_files(project_root):
+    """
+    project_root 配下の .py ファイルを (相対パス, 絶対パス) で列挙する。
+    """
+    for dirpath, dirnames, filenames in os.walk(project_root):
+        dirnames[:] = [d for d in dirnames if d not in SKIP_DIRS]
+        for name in filenames:
+            if name.endswith(".py"):
+                abs_path = os.path.join(dirpath, name)
+                yield os.path.normpath(os.path.relpath(abs_path, project_root)), abs_path
+
+
+def check_file_syntax(abs_path, known_hash=None):
+    """
+    ファイルをコンパイルして文法エラーを調べる（プロセスプールのワーカーで実行される）。
+    内容のハッシュが known_hash と一致した場合はコンパイルを省略する。
+    戻り値: (sha1, error) error は [行番号, メッセージ]、エラーなし/省略時は None
+    """
+    with open(abs_path, "rb") as f:
+        source = f.read()
+    digest = hashlib.sha1(source).hexdigest()
+    if digest == known_hash:
+        return digest, None
+    try:
+        compile(source, abs_path, "exec", dont_inherit=True)
+    except SyntaxError as e:
+        return digest, [e.lineno or 1, f"{type(e).__name__}: {e.msg}"]
+    except ValueError as e:
+        # NULL バイトを含むファイルなど
+        return digest, [1, f"ValueError: {e}"]
+    return digest, None
+
+
+def _load_cache(cache_path):
+    if not cache_path or not os.path.exists(cache_path):
+        return {}
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+
+def _save_cache(cache_path, cache):
+    if not cache_path:
+        return
+    tmp_path = f"{cache_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_path, cache_path)
+
+
+def scan_project_syntax(project_root, cache_path=None, max_workers=None):
+    """
+    project_root 配下のすべての .py をコンパイルし、文法エラーをまとめて返す。
+    前回のスキャンから mtime・サイズ（変わっていれば内容のハッシュ）が変わっていない
+    ファイルはコンパイルせず、前回の結果を使う。
+
+    戻り値: [(相対パス, 行番号), ...]  fixer.detect_syntax_error_line と同じ形式
+    """
+    old_cache = _load_cache(cache_path)
+    new_cache = {}
+    to_check = []
+
+    for rel_path, abs_path in iter_python_files(project_root):
+        try:
+            st = os.stat(abs_path)
+        except OSError:
+            continue
+        entry = old_cache.get(rel_path)
+        if entry and entry["mtime_ns"] == st.st_mtime_ns and entry["size"] == st.st_size:
+            new_cache[rel_path] = entry
+        else:
+            to_check.append((rel_path, abs_path, st, entry))
+
+    paths = [abs_path for _, abs_path, _, _ in to_check]
+    hashes = [entry["sha1"] if entry else None for _, _, _, entry in to_check]
+    if len(to_check) >= POOL_THRESHOLD:
+        # multiprocessing の import は重いので、プールを使うときだけ行う
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            results = list(pool.map(check_file_syntax, paths, hashes, chunksize=16))
+    else:
+        results = [check_file_syntax(p, h) for p, h in zip(paths, hashes)]
+
+    for (rel_path, _, st, entry), (digest, error) in zip(to_check, results):
+        if entry and entry["sha1"] == digest:
+            # 内容は同じ（touch されただけ）なので前回の結果を引き継ぐ
+            error = entry["error"]
+        new_cache[rel_path] = {
+            "mtime_ns": st.st_mtime_ns,
+            "size": st.st_size,
+            "sha1": digest,
+            "error": error,
+        }
+
+    _save_cache(cache_path, new_cache)
+
+    return sorted(
+        (rel_path, entry["error"][0])
+        for rel_path, entry in new_cache.items()
+        if entry["error"]
+    )
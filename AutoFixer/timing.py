@@ -0,0 +1,254 @@
+import os
+import sys
+import json
+import math
+import glob
+import gzip
+import time
+import uuid
+import argparse
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+# 実行中の計測（start_run で開始するまでは None で、span は何も記録しない）
+_recorder = None
+_local = threading.local()
+
+
+class RunRecorder:
+    """
+    1 回の実行（self_runner の main）の計測結果を JSONL に書き出す。
+    1 行 = 1 区間（span）で、run_id ごとにまとめて集計できる。
+    count() で加算した値は "counters"、span() に渡した属性（件数・設定など）は "attrs" に分けて記録する。
+    --auto や --watch の長い実行でもメモリにためすぎないよう、
+    FLUSH_LINES 行たまるか FLUSH_SECONDS 秒たつごとにファイルに追記する。
+    """
+    FLUSH_LINES = 200
+    FLUSH_SECONDS = 5.0
+
+    def __init__(self, path, run_id=None):
+        self.path = path
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self._lock = threading.Lock()
+        self._lines = []
+        self._flushed = self.started
+        # 実行全体での count() の合計
+        self.counters = {}
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def record(self, name, wall_ms, counters, attrs):
+        entry = {"run_id": self.run_id, "span": name, "wall_ms": round(wall_ms, 3)}
+        if counters:
+            entry["counters"] = counters
+        if attrs:
+            entry["attrs"] = attrs
+        with self._lock:
+            self._lines.append(json.dumps(entry, ensure_ascii=False))
+            if len(self._lines) >= self.FLUSH_LINES or time.perf_counter() - self._flushed >= self.FLUSH_SECONDS:
+                self._flush()
+
+    def _flush(self):
+        # self._lock を取った状態で呼ぶ（行の順番が入れ替わらないようにするため）
+        if self._lines:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write("\n".join(self._lines) + "\n")
+            self._lines = []
+        self._flushed = time.perf_counter()
+
+    def close(self, **attrs):
+        """
+        実行全体の区間（span="run"）を記録し、残りの行とともにファイルに追記する。
+        """
+        with self._lock:
+            entry = {
+                "run_id": self.run_id,
+                "span": "run",
+                "started_at": self.started_at,
+                "wall_ms": round((time.perf_counter() - self.started) * 1000, 3),
+                "counters": dict(self.counters),
+            }
+            if attrs:
+                entry["attrs"] = attrs
+            self._lines.append(json.dumps(entry, ensure_ascii=False))
+            self._flush()
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+def start_run(path, run_id=None):
+    global _recorder
+    _recorder = RunRecorder(path, run_id)
+    return _recorder
+
+
+def end_run(**attrs):
+    global _recorder
+    if _recorder is not None:
+        _recorder.close(**attrs)
+        _recorder = None
+
+
+@contextmanager
+def span(name, **attrs):
+    """
+    with span("agent_run"): ... の区間の経過時間を記録する。
+    区間の中で count() された値（読み書きしたバイト数・トークン数など）も一緒に記録する。
+    """
+    if _recorder is None:
+        yield
+        return
+    counters = {}
+    stack = _stack()
+    stack.append(counters)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        wall_ms = (time.perf_counter() - started) * 1000
+        stack.pop()
+        recorder = _recorder
+        if recorder is not None:
+            recorder.record(name, wall_ms, counters, attrs)
+
+
+def count(key, value):
+    """
+    実行中のすべての区間（入れ子の外側も含む）に値を加算する。
+    """
+    recorder = _recorder
+    if recorder is None:
+        return
+    with recorder._lock:
+        recorder.counters[key] = recorder.counters.get(key, 0) + value
+    for counters in _stack():
+        counters[key] = counters.get(key, 0) + value
+
+
+def timed(name):
+    """
+    関数の呼び出しを 1 つの区間として記録するデコレータ。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return func(*args, **kwargs)
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# === 集計 ===
+
+def _read_entries(path):
+    """
+    path と、ローテーションで退避された path.N.gz を古い順に読む。
+    """
+    paths = sorted(glob.glob(f"{glob.escape(path)}.*.gz"), reverse=True)
+    if os.path.exists(path):
+        paths.append(path)
+    for p in paths:
+        opener = gzip.open if p.endswith(".gz") else open
+        with opener(p, "rt", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    try:
+                        yield json.loads(line)
+                    except json.JSONDecodeError:
+                        continue
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    # nearest-rank 法
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+
+def entry_counters(entry):
+    """
+    1 行分のカウンタを返す。カウンタと属性を分ける前の形式の行は、数値の項目をカウンタとみなす。
+    """
+    if "counters" in entry or "attrs" in entry:
+        return entry.get("counters", {})
+    return {k: v for k, v in entry.items() if k not in ("run_id", "span", "wall_ms", "started_at")}
+
+
+def summarize(path, last_runs=None):
+    """
+    区間名ごとに件数・p50/p90/p99・最大・合計（ミリ秒）と、カウンタ（count() の値）の合計を集計する。
+    span() の属性（"attrs"）は合計しない。
+    last_runs を指定すると、最後の N 回の実行だけを対象にする。
+    """
+    entries = list(_read_entries(path))
+    if last_runs:
+        run_ids = []
+        for e in entries:
+            if e.get("span") == "run":
+                run_ids.append(e["run_id"])
+        keep = set(run_ids[-last_runs:])
+        entries = [e for e in entries if e.get("run_id") in keep]
+
+    groups = {}
+    for e in entries:
+        g = groups.setdefault(e["span"], {"wall": [], "counters": {}})
+        g["wall"].append(e.get("wall_ms", 0.0))
+        for key, value in entry_counters(e).items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                g["counters"][key] = g["counters"].get(key, 0) + value
+
+    result = {}
+    for name, g in groups.items():
+        wall = sorted(g["wall"])
+        result[name] = {
+            "count": len(wall),
+            "p50": _percentile(wall, 50),
+            "p90": _percentile(wall, 90),
+            "p99": _percentile(wall, 99),
+            "max": wall[-1],
+            "total": sum(wall),
+            "counters": g["counters"],
+        }
+    return result
+
+
+def print_summary(summary, out=sys.stdout):
+    if not summary:
+        print("計測結果がありません。", file=out)
+        return
+    print(f"{'区間':<32}{'件数':>7}{'p50(ms)':>12}{'p90(ms)':>12}{'p99(ms)':>12}{'最大(ms)':>12}{'合計(ms)':>14}", file=out)
+    for name, s in sorted(summary.items(), key=lambda kv: -kv[1]["total"]):
+        print(f"{name:<32}{s['count']:>7}{s['p50']:>12.1f}{s['p90']:>12.1f}{s['p99']:>12.1f}{s['max']:>12.1f}{s['total']:>14.1f}", file=out)
+        if s["counters"]:
+            print("    " + ", ".join(f"{k}={v}" for k, v in sorted(s["counters"].items())), file=out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="self_runner の計測結果（metrics/runs.jsonl）を集計する")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("summary", help="区間ごとのパーセンタイルを表示")
+    p.add_argument("--path", default=os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "metrics", "runs.jsonl"))
+    p.add_argument("--last", type=int, help="最後の N 回の実行だけを集計する")
+    p.add_argument("--json", action="store_true", help="JSON で出力する")
+    args = parser.parse_args()
+
+    summary = summarize(args.path, args.last)
+    if args.json:
+        print(json.dumps(summary, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
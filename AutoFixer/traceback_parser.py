@@ -0,0 +1,275 @@
+import os
+import re
+import mmap
+import ntpath
+import posixpath
+import contextlib
+
+FRAME_PATTERN = re.compile(r'^\s+File "(?P<path>.+?)", line (?P<lineno>\d+)(?:, in (?P<function>.+))?\s*$')
+EXCEPTION_PATTERN = re.compile(r"^(?P<type>[A-Za-z_][\w.]*)(?::\s?(?P<message>.*))?$")
+TRACEBACK_HEADER = "Traceback (most recent call last):"
+CHAIN_MARKERS = {
+    "During handling of the above exception, another exception occurred:": "context",
+    "The above exception was the direct cause of the following exception:": "cause",
+}
+# 解析を始める行（Traceback の見出しか、見出しのない SyntaxError の File 行）。
+# ログのほとんどは Traceback と無関係なので、1 行ずつ読まずにこの正規表現で次の候補まで飛ぶ。
+# "^" と re.MULTILINE の組み合わせは遅いので、直前の改行を含めて探す
+_ANCHOR = r'(?:Traceback \(most recent call last\):|[ \t]+File ")'
+ANCHOR_AT = re.compile(_ANCHOR)
+ANCHOR_PATTERN = re.compile("\n" + _ANCHOR)
+ANCHOR_AT_BYTES = re.compile(_ANCHOR.encode())
+ANCHOR_PATTERN_BYTES = re.compile(("\n" + _ANCHOR).encode())
+FRAME_PREFIX = '  File "'
+
+
+class Frame:
+    def __init__(self, path, lineno, function, relpath=None):
+        self.path = path
+        self.lineno = lineno
+        self.function = function
+        # project_root 配下なら project_root からの相対パス、そうでなければ None
+        self.relpath = relpath
+
+    def __repr__(self):
+        return f"Frame({self.relpath or self.path!r}, {self.lineno}, {self.function!r})"
+
+
+class ParsedTraceback:
+    """
+    1 つの例外の Traceback。
+    chain には、この例外の前に発生した（連鎖元の）Traceback が古い順に入る。
+    chain_kind は直前の連鎖元との関係（"cause" = raise ... from / "context" = 処理中の例外）。
+    """
+
+    def __init__(self):
+        self.frames = []
+        self.exc_type = None
+        self.message = ""
+        self.chain = []
+        self.chain_kind = None
+
+    @property
+    def last_frame(self):
+        return self.frames[-1] if self.frames else None
+
+    def last_project_frame(self):
+        for frame in reversed(self.frames):
+            if frame.relpath is not None:
+                return frame
+        return None
+
+    def __repr__(self):
+        return f"ParsedTraceback({self.exc_type}: {self.message!r}, frames={len(self.frames)}, chain={len(self.chain)})"
+
+
+def make_relpath(path, project_root):
+    """
+    path が project_root 配下なら project_root からの相対パス（OS の区切り文字）を返す。
+    ログが Windows で出力されたものでも Linux で出力されたものでも扱えるよう、
+    区切り文字と大文字小文字の違いを吸収して比較する。
+    """
+    if not project_root:
+        return None
+    windows_style = "\\" in path or bool(ntpath.splitdrive(path)[0])
+    norm_path = posixpath.normpath(path.replace("\\", "/"))
+    norm_root = posixpath.normpath(project_root.replace("\\", "/")).rstrip("/")
+    if windows_style:
+        matches = norm_path.lower().startswith(norm_root.lower() + "/")
+    else:
+        matches = norm_path.startswith(norm_root + "/")
+    if not matches:
+        return None
+    return os.path.normpath(norm_path[len(norm_root) + 1:])
+
+
+@contextlib.contextmanager
+def _open_buffer(source, path=None):
+    """
+    ログを検索できるバッファ（str / bytes / mmap）にする。
+    path のファイルは mmap で開くので、大きなログでも全体をメモリに読み込まない。
+    """
+    if path is not None:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                yield b""
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield mm
+    elif isinstance(source, (str, bytes, mmap.mmap)):
+        yield source
+    else:
+        # ファイルオブジェクト
+        yield source.read()
+
+
+def _next_anchor(buf, pos):
+    """
+    pos（行頭）以降で、解析を始める行の先頭位置を返す。なければ -1。
+    """
+    is_bytes = not isinstance(buf, str)
+    if (ANCHOR_AT_BYTES if is_bytes else ANCHOR_AT).match(buf, pos):
+        return pos
+    m = (ANCHOR_PATTERN_BYTES if is_bytes else ANCHOR_PATTERN).search(buf, pos)
+    return m.start() + 1 if m else -1
+
+
+def _rfind_line(buf, needle, end):
+    """
+    end より前で needle から始まる最後の行の先頭位置を返す。なければ -1。
+    """
+    if not isinstance(buf, str):
+        needle = needle.encode()
+    newline = "\n" if isinstance(buf, str) else b"\n"
+    while end > 0:
+        pos = buf.rfind(needle, 0, end)
+        if pos <= 0 or buf[pos - 1:pos] == newline:
+            return pos
+        end = pos
+    return -1
+
+
+def _scan(buf, project_root, start=0):
+    """
+    buf の start（行頭）から Traceback を探し、見つけるたびに ParsedTraceback を返す。
+    Traceback の外では次の候補の行まで正規表現で飛び、Traceback の中だけを 1 行ずつ読む。
+    """
+    is_bytes = not isinstance(buf, str)
+    newline = b"\n" if is_bytes else "\n"
+    size = len(buf)
+    pos = start
+    current = None
+    chain = []
+    pending_kind = None
+    # "idle" / "frames" / "after_exception"
+    state = "idle"
+
+    while pos < size:
+        if state == "idle":
+            pos = _next_anchor(buf, pos)
+            if pos < 0:
+                break
+        end = buf.find(newline, pos)
+        if end < 0:
+            end = size
+        raw = buf[pos:end]
+        pos = end + 1
+        text = (raw.decode("utf-8", errors="replace") if is_bytes else raw).rstrip("\r")
+
+        if text == TRACEBACK_HEADER:
+            if state == "after_exception" and pending_kind is None:
+                # 直前の例外とは無関係な新しい Traceback
+                yield _finish(current, chain)
+                chain = []
+            current = ParsedTraceback()
+            current.chain_kind = pending_kind
+            pending_kind = None
+            state = "frames"
+            continue
+
+        if state == "after_exception":
+            if text in CHAIN_MARKERS:
+                chain.append(current)
+                pending_kind = CHAIN_MARKERS[text]
+                continue
+            if not text:
+                continue
+            if pending_kind is None:
+                yield _finish(current, chain)
+                current, chain = None, []
+                state = "idle"
+                if not text.startswith(FRAME_PREFIX):
+                    continue
+            else:
+                continue
+
+        m = FRAME_PATTERN.match(text)
+        if m:
+            if state == "idle":
+                # Traceback 行のない SyntaxError
+                current = ParsedTraceback()
+                state = "frames"
+            frame_path = m.group("path")
+            current.frames.append(Frame(
+                frame_path,
+                int(m.group("lineno")),
+                m.group("function"),
+                make_relpath(frame_path, project_root)
+            ))
+            continue
+
+        if state == "frames":
+            if not text or text[0].isspace():
+                # ソース行・^^^ 行
+                continue
+            m = EXCEPTION_PATTERN.match(text)
+            if m:
+                current.exc_type = m.group("type")
+                current.message = (m.group("message") or "").strip()
+                state = "after_exception"
+            else:
+                # Traceback の途中に他の出力が割り込んだ場合は破棄する
+                current, chain, pending_kind = None, [], None
+                state = "idle"
+
+    if state == "after_exception":
+        yield _finish(current, chain)
+
+
+def iter_tracebacks(source=None, project_root=None, path=None):
+    """
+    ログを先頭から読み、Traceback を見つけるたびに ParsedTraceback を返す。
+    source はログの内容（文字列・bytes・ファイルオブジェクト・mmap）。ログファイルは path で渡す。
+    連鎖した例外（During handling of ... / The above exception was ...）は
+    最後の例外の chain にまとめて 1 つとして返す。
+    Traceback 行のない SyntaxError（実行前の文法エラー）も扱う。
+    """
+    with _open_buffer(source, path) as buf:
+        yield from _scan(buf, project_root)
+
+
+def _finish(tb, chain):
+    tb.chain = list(chain)
+    return tb
+
+
+def _last_start(buf):
+    """
+    最後の Traceback が始まる行の先頭位置を、ログの末尾から逆向きに探す。
+    連鎖した例外は最初の Traceback までさかのぼる。見つからなければ -1。
+    """
+    start = _rfind_line(buf, TRACEBACK_HEADER, len(buf))
+    if start < 0:
+        # Traceback 行のない SyntaxError
+        return _rfind_line(buf, FRAME_PREFIX, len(buf))
+    while start > 0:
+        before = buf[max(0, start - 512):start]
+        if not isinstance(before, str):
+            before = before.decode("utf-8", errors="replace")
+        previous = next((l.strip() for l in reversed(before.splitlines()) if l.strip()), "")
+        if previous not in CHAIN_MARKERS:
+            break
+        earlier = _rfind_line(buf, TRACEBACK_HEADER, start)
+        if earlier < 0:
+            break
+        start = earlier
+    return start
+
+
+def parse_last_traceback(source=None, project_root=None, path=None):
+    """
+    ログの最後の Traceback を返す。なければ None。
+    ログの末尾から最後の Traceback の位置を探し、そこから後ろだけを解析する。
+    """
+    with _open_buffer(source, path) as buf:
+        start = _last_start(buf)
+        if start < 0:
+            return None
+        last = None
+        for tb in _scan(buf, project_root, start):
+            last = tb
+        if last is None and start > 0:
+            # 最後の Traceback が途中で途切れていた場合は、ログ全体から探し直す
+            for tb in _scan(buf, project_root):
+                last = tb
+        return last
@@ -1,13 +1,40 @@
 import re
+import posixpath
 
-def extract_python_code_from_response(response_text):
+def extract_python_code_from_response(response_text, target=None):
     """
-    ChatGPT の回答から ```python ... ``` で囲まれたコード部分を抽出して返す。
+    ChatGPT の回答から ```python ... ```（py, python3 を含む）で囲まれたコード部分を抽出して返す。
+    ブロックが複数あるときは、target（project_root からの相対パス）を変更対象とするブロックを優先し、
+    なければ最初のブロックを返す。ストリーミングで回答を打ち切るときと同じ判定を使う。
     """
-    match = re.search(r"```python\s*\n(.*?)```", response_text, re.DOTALL)
-    if match:
-        return match.group(1).strip()
-    return None
+    blocks = extract_code_blocks(response_text)
+    if not blocks:
+        return None
+    block = next((b for b in blocks if _same_path(b.hint, target)), blocks[0])
+    return block.code.strip() or None
+
+def _same_path(hint, target):
+    """
+    ブロックの hint が target と同じファイルを指していれば True（"foo.py" と "agents/foo.py" も同じとみなす）。
+    """
+    if not hint or not target:
+        return False
+    hint = posixpath.normpath(hint.replace("\\", "/"))
+    target = posixpath.normpath(target.replace("\\", "/"))
+    return hint == target or target.endswith("/" + hint) or hint.endswith("/" + target)
+
+def extract_code_blocks(response_text, python_only=True):
+    """
+    ChatGPT の回答からコードフェンスをすべて取り出し、fence_stream.CodeBlock のリストで返す（出現順）。
+    各ブロックの hint には、フェンスの情報文字列・コードの 1 行目のコメント・直前の文に書かれた
+    変更対象のファイル名が入る（例: "```python agents/foo.py" → "agents/foo.py"）。
+    python_only=True なら ```python（py, python3 を含む）のブロックだけを返す。
+    """
+    from fence_stream import parse_blocks
+    blocks = parse_blocks(response_text)
+    if python_only:
+        blocks = [block for block in blocks if block.is_python]
+    return blocks
 
 def extract_class_name_from_code(code):
     """
@@ -0,0 +1,377 @@
+import io
+import os
+import ast
+import sys
+import json
+import time
+import runpy
+import signal
+import socket
+import shutil
+import argparse
+import tempfile
+import importlib
+import selectors
+import traceback
+import subprocess
+
+# fork と Unix ドメインソケットでのファイルディスクリプタの受け渡しが使える環境でだけ動く（Windows では使えない）
+SUPPORTED = hasattr(os, "fork") and hasattr(socket, "AF_UNIX") and hasattr(socket, "send_fds")
+
+READY_LINE = "warm-runner ready"
+
+
+def is_project_file(path, project_root):
+    if not path:
+        return False
+    path = os.path.abspath(path)
+    root = os.path.join(os.path.abspath(project_root), "")
+    return path.startswith(root) and f"{os.sep}site-packages{os.sep}" not in path
+
+
+def script_imports(script_path, project_root):
+    """
+    スクリプトの先頭レベルの import のうち、プロジェクト外のモジュール名を返す。
+    プロジェクト内のモジュールは import 時の出力が agent の出力に出なくなるので事前読み込みしない。
+    """
+    try:
+        with open(script_path, "r", encoding="utf-8") as f:
+            tree = ast.parse(f.read(), script_path)
+    except (OSError, SyntaxError, ValueError):
+        return []
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+    result = []
+    for name in names:
+        top = name.split(".")[0]
+        if os.path.exists(os.path.join(project_root, top)) or os.path.exists(os.path.join(project_root, f"{top}.py")):
+            continue
+        if name not in result:
+            result.append(name)
+    return result
+
+
+# === サーバー（事前に import を済ませておき、実行ごとに fork する親プロセス） ===
+
+class WarmServer:
+    """
+    preload のモジュールを import した状態で待機し、実行の依頼ごとに fork した子プロセスで
+    スクリプトを実行する。子の stdout / stderr は依頼元から受け取ったパイプにつなぐ。
+    読み込み済みのプロジェクト内のモジュールのファイルが変更されていたら、fork する前に
+    プロジェクト内のモジュールをすべて捨てて読み込み直す（子は常に最新の内容で動く）。
+    """
+
+    def __init__(self, socket_path, project_root, preload=()):
+        self.socket_path = socket_path
+        self.project_root = os.path.abspath(project_root)
+        self.preload = list(preload)
+        # プロジェクト内のモジュール名 → (ファイル, 読み込んだときの mtime_ns)
+        self.project_modules = {}
+
+    def _log(self, message):
+        print(f"[warm_runner] {message}", file=sys.stderr, flush=True)
+
+    def _load(self):
+        if self.project_root not in sys.path:
+            sys.path.insert(0, self.project_root)
+        for name in self.preload:
+            try:
+                importlib.import_module(name)
+            except BaseException as e:
+                self._log(f"{name} を事前に読み込めませんでした: {type(e).__name__}: {e}")
+        self.project_modules = {}
+        for name, module in list(sys.modules.items()):
+            path = getattr(module, "__file__", None)
+            if is_project_file(path, self.project_root):
+                try:
+                    self.project_modules[name] = (path, os.stat(path).st_mtime_ns)
+                except OSError:
+                    self.project_modules[name] = (path, None)
+
+    def _changed(self):
+        for name, (path, mtime) in self.project_modules.items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def refresh(self):
+        """
+        プロジェクト内のモジュールが変更されていれば、すべて捨てて preload を読み込み直す。
+        """
+        importlib.invalidate_caches()
+        if not self._changed():
+            return False
+        for name in self.project_modules:
+            sys.modules.pop(name, None)
+        self._load()
+        return True
+
+    def serve(self):
+        self._load()
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self.socket_path)
+        listener.listen()
+        print(READY_LINE, flush=True)
+
+        # 依頼元（self_runner）が終了して stdin が閉じられたら、サーバーも終了する
+        selector = selectors.DefaultSelector()
+        selector.register(listener, selectors.EVENT_READ, "accept")
+        selector.register(sys.stdin, selectors.EVENT_READ, "stdin")
+        try:
+            while True:
+                for key, _ in selector.select():
+                    if key.data == "stdin":
+                        if not sys.stdin.buffer.read1(4096):
+                            return
+                        continue
+                    conn, _ = listener.accept()
+                    try:
+                        self._handle(conn, listener)
+                    except Exception as e:
+                        self._log(f"実行の依頼を処理できませんでした: {type(e).__name__}: {e}")
+                    finally:
+                        conn.close()
+        finally:
+            listener.close()
+
+    def _handle(self, conn, listener):
+        data, fds, _, _ = socket.recv_fds(conn, 1 << 16, 2)
+        while not data.endswith(b"\n"):
+            more = conn.recv(1 << 16)
+            if not more:
+                break
+            data += more
+        request = json.loads(data)
+        if len(fds) != 2:
+            conn.sendall(b'{"error": "stdout/stderr not passed"}\n')
+            return
+
+        if self.refresh():
+            self._log("プロジェクトのファイルが変更されたため、モジュールを読み込み直しました。")
+        pid = os.fork()
+        if pid == 0:
+            listener.close()
+            conn.close()
+            _run_child(request, fds[0], fds[1])
+        for fd in fds:
+            os.close(fd)
+        conn.sendall((json.dumps({"pid": pid}) + "\n").encode())
+        _, status = os.waitpid(pid, 0)
+        conn.sendall((json.dumps({"exit": os.waitstatus_to_exitcode(status)}) + "\n").encode())
+
+
+def _strip_runner_frames(tb, script_path):
+    """
+    Traceback から runpy・warm_runner のフレームを除く（通常の python 実行と同じ表示にする）。
+    """
+    while tb is not None and os.path.abspath(tb.tb_frame.f_code.co_filename) != script_path:
+        tb = tb.tb_next
+    return tb
+
+
+def _run_child(request, out_fd, err_fd):
+    """
+    fork した子プロセス側。stdout / stderr をつなぎ替えてスクリプトを実行し、終了コードで終わる。
+    """
+    code = 1
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.dup2(out_fd, 1)
+        os.dup2(err_fd, 2)
+        for fd in (devnull, out_fd, err_fd):
+            os.close(fd)
+        # PYTHONUNBUFFERED=1 で起動した python と同じく、書き込みのたびに出力する
+        sys.stdin = open(0, "r", closefd=False)
+        sys.stdout = io.TextIOWrapper(io.FileIO(1, "w", closefd=False), encoding="utf-8",
+                                      errors="backslashreplace", line_buffering=True, write_through=True)
+        sys.stderr = io.TextIOWrapper(io.FileIO(2, "w", closefd=False), encoding="utf-8",
+                                      errors="backslashreplace", line_buffering=True, write_through=True)
+
+        script = os.path.abspath(request["script"])
+        os.environ.clear()
+        os.environ.update(request.get("env") or {})
+        os.chdir(request.get("cwd") or os.path.dirname(script))
+        sys.argv = [script] + list(request.get("args") or [])
+        sys.path[0] = os.path.dirname(script)
+
+        try:
+            runpy.run_path(script, run_name="__main__")
+            code = 0
+        except SystemExit as e:
+            if e.code is None:
+                code = 0
+            elif isinstance(e.code, int):
+                code = e.code
+            else:
+                print(e.code, file=sys.stderr)
+                code = 1
+        except BaseException as e:
+            traceback.print_exception(type(e), e, _strip_runner_frames(e.__traceback__, script))
+            code = 1
+        try:
+            import atexit
+            atexit._run_exitfuncs()
+        except BaseException:
+            pass
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except BaseException:
+            pass
+        os._exit(code)
+
+
+# === クライアント（self_runner 側） ===
+
+class WarmProcess:
+    """
+    WarmRunner.run の戻り値。subprocess.Popen と同じように stdout / stderr / pid / kill() / wait() を持つ。
+    """
+
+    def __init__(self, sock, pid, stdout, stderr):
+        self._sock = sock
+        self._reader = sock.makefile("rb")
+        self.pid = pid
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def wait(self):
+        if self.returncode is None:
+            line = self._reader.readline()
+            try:
+                self.returncode = json.loads(line)["exit"]
+            except (ValueError, KeyError):
+                # サーバーが落ちた場合
+                self.returncode = -1
+            self._reader.close()
+            self._sock.close()
+        return self.returncode
+
+
+class WarmRunner:
+    """
+    事前に import を済ませたサーバー（WarmServer）を起動しておき、スクリプトの実行を依頼する。
+    サーバーはこのプロセスが終了すると（stdin が閉じられると）自動的に終了する。
+    """
+
+    def __init__(self, project_root, preload=(), python=None, startup_timeout=60.0):
+        if not SUPPORTED:
+            raise RuntimeError("この環境では warm runner を使えません（fork / Unix ドメインソケットが必要）")
+        self.project_root = project_root
+        self.preload = list(preload)
+        self.python = python or sys.executable
+        self.startup_timeout = startup_timeout
+        self.server = None
+        self.socket_dir = None
+        self.socket_path = None
+
+    def start(self):
+        if self.alive():
+            return
+        self.close()
+        self.socket_dir = tempfile.mkdtemp(prefix="selfmade-warm-")
+        self.socket_path = os.path.join(self.socket_dir, "runner.sock")
+        cmd = [self.python, os.path.abspath(__file__), "serve",
+               "--socket", self.socket_path, "--project-root", self.project_root]
+        for name in self.preload:
+            cmd += ["--preload", name]
+        started = time.monotonic()
+        self.server = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+        line = self.server.stdout.readline()
+        if line.strip() != READY_LINE:
+            self.close()
+            raise RuntimeError("warm runner のサーバーを起動できませんでした")
+        self.startup_seconds = time.monotonic() - started
+
+    def alive(self):
+        return self.server is not None and self.server.poll() is None
+
+    def run(self, script, cwd=None, args=(), env=None):
+        """
+        script の実行を依頼し、WarmProcess を返す。
+        """
+        self.start()
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            request = {
+                "script": script,
+                "cwd": cwd,
+                "args": list(args),
+                "env": dict(os.environ if env is None else env),
+            }
+            socket.send_fds(sock, [(json.dumps(request) + "\n").encode()], [out_w, err_w])
+        except BaseException:
+            sock.close()
+            for fd in (out_r, err_r):
+                os.close(fd)
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+
+        reader = sock.makefile("rb")
+        reply = json.loads(reader.readline() or b"{}")
+        reader.close()
+        if "pid" not in reply:
+            sock.close()
+            os.close(out_r)
+            os.close(err_r)
+            raise RuntimeError(f"warm runner で実行できませんでした: {reply.get('error', 'サーバーの応答なし')}")
+        stdout = open(out_r, "r", encoding="utf-8", errors="replace")
+        stderr = open(err_r, "r", encoding="utf-8", errors="replace")
+        return WarmProcess(sock, reply["pid"], stdout, stderr)
+
+    def close(self):
+        if self.server is not None:
+            try:
+                self.server.stdin.close()
+                self.server.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.server.kill()
+                self.server.wait()
+            self.server = None
+        if self.socket_dir:
+            shutil.rmtree(self.socket_dir, ignore_errors=True)
+            self.socket_dir = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="事前に import を済ませておき、実行ごとに fork する agent 実行サーバー")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("serve", help="サーバーとして起動する（通常は self_runner が起動する）")
+    p.add_argument("--socket", required=True)
+    p.add_argument("--project-root", required=True)
+    p.add_argument("--preload", action="append", default=[])
+    args = parser.parse_args()
+
+    # サーバーのディレクトリ（AutoFixer）のモジュールが agent の import を横取りしないようにする
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or ".") != os.path.dirname(os.path.abspath(__file__))]
+    WarmServer(args.socket, args.project_root, args.preload).serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import os
+import time
+import hashlib
+import threading
+
+from syntax_scan import iter_python_files
+
+
+def _file_hash(abs_path):
+    try:
+        with open(abs_path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+class SourceWatcher:
+    """
+    project_root 配下の .py ファイルの変更を監視する（ポーリング）。
+    mtime・サイズが変わったファイルだけ内容のハッシュを計算し、
+    内容が実際に変わったもの（追加・削除を含む）だけを「変更」とみなす。
+    保存しただけ（touch）やエディタの一時的な書き換えでは再実行しない。
+    """
+
+    def __init__(self, project_root, interval=0.5, debounce=1.0):
+        self.project_root = project_root
+        self.interval = interval
+        self.debounce = debounce
+        # 相対パス → (mtime_ns, size, sha1)
+        self.files = {}
+        self.rebaseline()
+
+    def _scan(self, old):
+        """
+        戻り値: (新しい状態, 内容が変わったファイルの相対パスの集合)
+        """
+        new = {}
+        changed = set()
+        for rel_path, abs_path in iter_python_files(self.project_root):
+            try:
+                st = os.stat(abs_path)
+            except OSError:
+                continue
+            entry = old.get(rel_path)
+            if entry and entry[0] == st.st_mtime_ns and entry[1] == st.st_size:
+                new[rel_path] = entry
+                continue
+            digest = _file_hash(abs_path)
+            if digest is None:
+                continue
+            new[rel_path] = (st.st_mtime_ns, st.st_size, digest)
+            if entry is None or entry[2] != digest:
+                changed.add(rel_path)
+        changed.update(set(old) - set(new))
+        return new, changed
+
+    def rebaseline(self):
+        """
+        現在の状態を基準にする（それまでの変更は無視する）。
+        """
+        self.files, _ = self._scan(self.files)
+
+    def poll(self):
+        """
+        前回の poll から内容が変わったファイルの集合を返す。
+        """
+        self.files, changed = self._scan(self.files)
+        return changed
+
+    def wait_for_change(self, stop_event=None, pending=None):
+        """
+        ファイルが変更されるまで待ち、さらに debounce 秒間変更がなくなるまで待ってから
+        変更されたファイルの集合を返す（連続した保存を 1 回にまとめる）。
+        pending には、すでに検出済みの変更を渡せる。
+        待っている間に元の内容に戻されたファイルは変更に含めない。
+        stop_event がセットされたら、その時点の変更を返す。
+        """
+        baseline = {p: e[2] for p, e in self.files.items()}
+        changed = set(pending or ())
+        last_change = time.monotonic() if changed else None
+        while stop_event is None or not stop_event.is_set():
+            new = self.poll()
+            now = time.monotonic()
+            if new:
+                changed |= new
+                last_change = now
+            elif changed and now - last_change >= self.debounce:
+                if pending:
+                    return changed
+                changed = {p for p in changed if baseline.get(p) != (self.files[p][2] if p in self.files else None)}
+                if changed:
+                    return changed
+                last_change = None
+            time.sleep(self.interval)
+        return changed
+
+
+def run_until_changed(watcher, run):
+    """
+    run(cancel_event) を別スレッドで実行し、その間にファイルが変更されたら
+    cancel_event をセットして run が終わるのを待つ。
+    戻り値: (run の戻り値, 実行中に変更されたファイルの集合)
+    変更で中止した場合は (None, 変更の集合)
+    """
+    cancel_event = threading.Event()
+    outcome = {}
+
+    def target():
+        try:
+            outcome["value"] = run(cancel_event)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    while thread.is_alive():
+        thread.join(watcher.interval)
+        if thread.is_alive():
+            changed = watcher.poll()
+            if changed:
+                cancel_event.set()
+                thread.join()
+                return None, changed
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome.get("value"), set()
+
+
+def watch(watcher, run, on_result=None, stop_event=None, cancellable=True):
+    """
+    最初に 1 回 run を実行し、その後はファイルが変更されるたびに run を実行する。
+    cancellable=True なら、実行中に変更があれば実行を中止して、変更が落ち着いてから実行し直す。
+    cancellable=False（run 自身がファイルを書き換える場合など）では実行中の変更は無視し、
+    実行後の状態を基準にする。
+    on_result(run の戻り値) は実行が最後まで終わったときだけ呼ばれる。
+    """
+    while stop_event is None or not stop_event.is_set():
+        if cancellable:
+            value, pending = run_until_changed(watcher, run)
+            if pending:
+                print(f"🔄 実行中に {len(pending)} 件の変更を検出したため中止しました。変更が落ち着いたら実行し直します。")
+                changed = watcher.wait_for_change(stop_event, pending)
+                print(f"🔁 変更: {', '.join(sorted(changed))}")
+                continue
+        else:
+            value = run(threading.Event())
+            watcher.rebaseline()
+
+        if on_result:
+            on_result(value)
+        print("\n👀 ファイルの変更を待っています...")
+        changed = watcher.wait_for_change(stop_event)
+        if changed:
+            print(f"🔁 変更: {', '.join(sorted(changed))}")
@@ -2,12 +2,58 @@ import json
 import os
 
 class ConfigLoader:
-    CONFIG_PATH = r"D:\SelfMade\Config\config.json"
+    """
+    config.json（パラメータ）と secrets.json（API キーなど）を読み込む。
+
+    - ConfigLoader.instance() でプロセス全体で 1 つのインスタンスを共有する
+    - config.json の場所は 環境変数 SELFMADE_CONFIG > configure() > このファイルと同じフォルダ の順で決まる
+    - secrets.json は get_secret() が初めて呼ばれたときに読み込む
+      （場所は 環境変数 SELFMADE_SECRETS > configure() > config.json の secrets_path > SECRETS_PATH）
+    - 各設定値は 環境変数 SELFMADE_<キー名を大文字> で上書きできる（値は JSON として解釈し、だめなら文字列）
+      例: SELFMADE_AI_ENABLED=false
+    - config.json が更新されたら（mtime が変わったら）reload_if_changed() で読み直す
+      （保存の途中などで読めなければ、前の設定のまま次の呼び出しで読み直す）
+    """
+    CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
     SECRETS_PATH = r"D:\EchoCodeForge\Config\secrets.json"
+    ENV_PREFIX = "SELFMADE_"
+
+    _instance = None
+    _config_path = None
+    _secrets_path = None
+
+    def __init__(self, config_path=None, secrets_path=None):
+        self.config_path = (
+            config_path or os.environ.get("SELFMADE_CONFIG") or ConfigLoader._config_path or self.CONFIG_PATH
+        )
+        self._secrets_path = secrets_path or ConfigLoader._secrets_path
+        self.config = {}
+        self.config_mtime = None
+        # 読み直しに失敗した config.json の mtime（同じ内容で警告を繰り返さないため）
+        self._failed_mtime = None
+        self.secrets = None
+        self._load_config()
+
+    @classmethod
+    def instance(cls):
+        """
+        プロセス全体で共有するインスタンスを返す（初回だけ config.json を読む）。
+        """
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
 
-    def __init__(self):
-        self.config = self._load_json(self.CONFIG_PATH, "設定ファイル(パラメータ)")
-        self.secrets = self._load_json(self.SECRETS_PATH, "設定ファイル(セキュリティ)")
+    @classmethod
+    def configure(cls, config_path=None, secrets_path=None):
+        """
+        コマンドライン引数などで設定ファイルの場所を変える。共有インスタンスは作り直される。
+        """
+        if config_path:
+            cls._config_path = config_path
+        if secrets_path:
+            cls._secrets_path = secrets_path
+        cls._instance = None
+        return cls.instance()
 
     def _load_json(self, path, description):
         if not os.path.exists(path):
@@ -15,8 +61,49 @@ class ConfigLoader:
         with open(path, "r", encoding="utf-8") as f:
             return json.load(f)
 
+    def _load_config(self):
+        self.config = self._load_json(self.config_path, "設定ファイル(パラメータ)")
+        self.config_mtime = os.stat(self.config_path).st_mtime_ns
+
+    def reload_if_changed(self):
+        """
+        config.json が前回読み込んだ後に更新されていれば読み直して True を返す。
+        """
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self.config_mtime:
+            return False
+        try:
+            self._load_config()
+        except (OSError, json.JSONDecodeError) as e:
+            # config_mtime は変えないので、次の呼び出しでもう一度読み直す
+            if mtime != self._failed_mtime:
+                print(f"⚠ config.json を読み直せませんでした（前の設定のまま続けます）: {e}")
+                self._failed_mtime = mtime
+            return False
+        self._failed_mtime = None
+        return True
+
+    def secrets_path(self):
+        return (
+            os.environ.get("SELFMADE_SECRETS")
+            or self._secrets_path
+            or self.config.get("secrets_path")
+            or self.SECRETS_PATH
+        )
+
     def get(self, key, default=None):
+        env_value = os.environ.get(self.ENV_PREFIX + key.upper())
+        if env_value is not None:
+            try:
+                return json.loads(env_value)
+            except json.JSONDecodeError:
+                return env_value
         return self.config.get(key, default)
 
     def get_secret(self, key, default=None):
+        if self.secrets is None:
+            self.secrets = self._load_json(self.secrets_path(), "設定ファイル(セキュリティ)")
         return self.secrets.get(key, default)
@@ -1,9 +1,10 @@
 from ConfigLoader import ConfigLoader
 
 class DeBug:
-    def __init__(self):
-        loader = ConfigLoader()
-        self.is_debug = loader.get("is_debug", False)
+    @property
+    def is_debug(self):
+        # config.json の再読み込みや --config の指定を反映するため、毎回共有の設定から読む
+        return ConfigLoader.instance().get("is_debug", False)
 
     def print(self, message):
         if self.is_debug:
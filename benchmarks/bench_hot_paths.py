@@ -0,0 +1,293 @@
+"""
+AutoFixer の主な処理のベンチマーク。
+
+合成データ（benchmarks/generators.py）を一時ディレクトリに作り、各処理の
+所要時間（repeat 回の中央値と最小値）・スループット・ピークメモリ（tracemalloc）を表示する。
+
+例:
+    python benchmarks/bench_hot_paths.py                      # 既定の大きさ（ログ 10 MB など）
+    python benchmarks/bench_hot_paths.py --quick              # 動作確認用の小さいデータ
+    python benchmarks/bench_hot_paths.py --log-mb 1024        # 1 GB のログ（ファイル渡しのみ計測）
+    python benchmarks/bench_hot_paths.py --save baseline.json
+    python benchmarks/bench_hot_paths.py --compare baseline.json --tolerance 0.2
+
+--compare では、基準より tolerance 以上遅い・メモリが増えた処理があれば終了コード 1 を返す。
+"""
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import statistics
+import contextlib
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(BASE_DIR, "AutoFixer"))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+import file_cache
+import diff_archive
+from fixer import detect_syntax_error_line, extract_error_type_and_message
+from traceback_parser import parse_last_traceback
+from file_editor import read_context_lines, replace_function_in_file, generate_diff_file, get_max_sequence_in_done
+from utils import extract_python_code_from_response
+import generators
+
+# これより大きいログは文字列としてメモリに載せず、ファイル渡しだけを計測する
+MAX_TEXT_LOG_MB = 256
+# ピークメモリの比較では、これ未満の増加は誤差として扱う
+MEMORY_SLACK_MB = 1.0
+
+
+class Case:
+    """
+    1 つの計測対象。setup() が返した引数で func を呼ぶ（setup の時間は含めない）。
+    size は 1 回の呼び出しで処理するバイト数（0 なら回数/秒で表示する）。
+    """
+
+    def __init__(self, name, func, setup, size=0):
+        self.name = name
+        self.func = func
+        self.setup = setup
+        self.size = size
+
+
+def _call(case, args):
+    # 対象の処理が出す print は計測結果の表示に混ぜない
+    with contextlib.redirect_stdout(io.StringIO()):
+        return case.func(*args)
+
+
+def measure(case, repeat, memory=True):
+    times = []
+    for _ in range(repeat):
+        args = case.setup()
+        started = time.perf_counter()
+        _call(case, args)
+        times.append(time.perf_counter() - started)
+
+    peak_mb = None
+    if memory:
+        args = case.setup()
+        tracemalloc.start()
+        try:
+            _call(case, args)
+            peak_mb = tracemalloc.get_traced_memory()[1] / (1 << 20)
+        finally:
+            tracemalloc.stop()
+
+    median = statistics.median(times)
+    result = {
+        "median_ms": median * 1000,
+        "best_ms": min(times) * 1000,
+        "peak_mb": peak_mb,
+        "size_bytes": case.size,
+    }
+    if case.size:
+        result["mb_per_sec"] = case.size / (1 << 20) / median if median else 0.0
+    else:
+        result["ops_per_sec"] = 1 / median if median else 0.0
+    return result
+
+
+def build_cases(work_dir, args):
+    project_root = os.path.join(work_dir, "project")
+    os.makedirs(os.path.join(project_root, "agents"), exist_ok=True)
+    cases = []
+
+    # --- ログ（fixer） ---
+    log_bytes = int(args.log_mb * (1 << 20))
+    log_path = os.path.join(work_dir, "run_log.txt")
+    log_size = generators.write_log_file(log_path, log_bytes, project_root, seed=args.seed)
+    log_text = None
+    if args.log_mb <= MAX_TEXT_LOG_MB:
+        with open(log_path, "r", encoding="utf-8") as f:
+            log_text = f.read()
+
+    if log_text is not None:
+        for func in (detect_syntax_error_line, extract_error_type_and_message):
+            extra = (project_root,) if func is detect_syntax_error_line else ()
+            cases.append(Case(f"fixer.{func.__name__}[text]", func,
+                              lambda extra=extra: (log_text,) + extra, log_size))
+    cases.append(Case("traceback_parser.parse_last_traceback[file]",
+                      lambda path, root: parse_last_traceback(project_root=root, path=path),
+                      lambda: (log_path, project_root), log_size))
+
+    # --- 大きなソースファイル（file_editor） ---
+    source_path = os.path.join(project_root, "agents", "big_module.py")
+    names = generators.write_source_file(source_path, args.source_lines, seed=args.seed)
+    with open(source_path, "rb") as f:
+        source_bytes = f.read()
+    middle_line = args.source_lines // 2
+
+    def cold_source():
+        file_cache.invalidate(source_path)
+        return (source_path, middle_line, 5)
+
+    def warm_source():
+        read_context_lines(source_path, middle_line, 5)
+        return (source_path, middle_line, 5)
+
+    cases.append(Case("file_editor.read_context_lines[cold]", read_context_lines, cold_source))
+    cases.append(Case("file_editor.read_context_lines[warm]", read_context_lines, warm_source))
+
+    target = names[len(names) // 2]
+    new_code = f"def {target.split('.')[1]}(self, value):\n    return value * 2\n"
+
+    def restore_source():
+        with open(source_path, "wb") as f:
+            f.write(source_bytes)
+        file_cache.invalidate(source_path)
+        return (source_path, target, new_code)
+
+    cases.append(Case("file_editor.replace_function_in_file", replace_function_in_file,
+                      restore_source, len(source_bytes)))
+
+    diff_dir = os.path.join(work_dir, "Diff")
+    os.makedirs(diff_dir, exist_ok=True)
+
+    def diff_args():
+        restore_source()
+        context_lines = read_context_lines(source_path, middle_line, 5)
+        original = [text for _, text in context_lines]
+        new = list(original)
+        new[5] = new[5] + "  # fixed"
+        return (original, new, context_lines, source_path, diff_dir, middle_line, 3)
+
+    cases.append(Case("file_editor.generate_diff_file", generate_diff_file, diff_args, len(source_bytes)))
+
+    # --- Diff/done（file_editor → diff_archive） ---
+    done_dir = os.path.join(work_dir, "Diff", "done")
+    base_names = generators.make_done_dir(done_dir, args.done_files)
+    probe = base_names[len(base_names) // 2]
+
+    def cold_done():
+        # 索引を消して、ディレクトリの取り込みから計測する
+        archive = diff_archive._archives.pop(os.path.abspath(done_dir), None)
+        if archive:
+            archive.conn.close()
+        index_path = os.path.join(done_dir, diff_archive.INDEX_FILENAME)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        return (probe, done_dir)
+
+    def warm_done():
+        get_max_sequence_in_done(probe, done_dir)
+        return (probe, done_dir)
+
+    cases.append(Case("file_editor.get_max_sequence_in_done[cold]", get_max_sequence_in_done, cold_done))
+    cases.append(Case("file_editor.get_max_sequence_in_done[warm]", get_max_sequence_in_done, warm_done))
+
+    # --- LLM の回答（utils） ---
+    response = generators.make_llm_response(args.fences, seed=args.seed)
+    cases.append(Case("utils.extract_python_code_from_response", extract_python_code_from_response,
+                      lambda: (response,), len(response.encode("utf-8"))))
+    return cases
+
+
+def print_results(results, out=sys.stdout):
+    print(f"{'処理':<48}{'中央値(ms)':>12}{'最小(ms)':>12}{'スループット':>16}{'ピーク(MB)':>12}", file=out)
+    for name, r in results.items():
+        if "mb_per_sec" in r:
+            throughput = f"{r['mb_per_sec']:.1f} MB/s"
+        else:
+            throughput = f"{r['ops_per_sec']:.0f} 回/s"
+        peak = "-" if r["peak_mb"] is None else f"{r['peak_mb']:.2f}"
+        print(f"{name:<48}{r['median_ms']:>12.3f}{r['best_ms']:>12.3f}{throughput:>16}{peak:>12}", file=out)
+
+
+def compare(results, baseline, tolerance):
+    """
+    基準（--save で保存した JSON）と比べて悪化した処理のメッセージのリストを返す。
+    """
+    regressions = []
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        if r["median_ms"] > base["median_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: {base['median_ms']:.3f} ms → {r['median_ms']:.3f} ms")
+        if r["peak_mb"] is not None and base.get("peak_mb") is not None \
+                and r["peak_mb"] > base["peak_mb"] * (1 + tolerance) + MEMORY_SLACK_MB:
+            regressions.append(f"{name}: ピークメモリ {base['peak_mb']:.2f} MB → {r['peak_mb']:.2f} MB")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="AutoFixer の主な処理のベンチマーク")
+    parser.add_argument("--log-mb", type=float, default=10, help="合成ログの大きさ（MB、10〜1024 程度）")
+    parser.add_argument("--source-lines", type=int, default=30000, help="合成ソースファイルの行数")
+    parser.add_argument("--fences", type=int, default=500, help="合成した LLM の回答に含めるコードフェンスの数")
+    parser.add_argument("--done-files", type=int, default=5000, help="Diff/done に置く差分ファイルの数")
+    parser.add_argument("--repeat", type=int, default=5, help="各処理の計測回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--quick", action="store_true", help="動作確認用に小さいデータで 1 回だけ計測する")
+    parser.add_argument("--no-memory", action="store_true", help="ピークメモリを計測しない")
+    parser.add_argument("--filter", help="名前にこの文字列を含む処理だけを計測する")
+    parser.add_argument("--save", help="結果を JSON で保存する（基準として使う）")
+    parser.add_argument("--compare", help="基準の JSON と比べる")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="悪化とみなす割合（0.2 = 20%%）")
+    parser.add_argument("--work-dir", help="合成データを置くディレクトリ（省略時は一時ディレクトリを作って最後に消す）")
+    args = parser.parse_args(argv)
+    if args.quick:
+        args.log_mb = min(args.log_mb, 1)
+        args.source_lines = min(args.source_lines, 2000)
+        args.fences = min(args.fences, 50)
+        args.done_files = min(args.done_files, 200)
+        args.repeat = 1
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="selfmade-bench-")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        print(f"合成データを作成しています: {work_dir}")
+        cases = build_cases(work_dir, args)
+        results = {}
+        for case in cases:
+            if args.filter and args.filter not in case.name:
+                continue
+            results[case.name] = measure(case, args.repeat, memory=not args.no_memory)
+            print(f"  {case.name}: {results[case.name]['median_ms']:.3f} ms")
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    print()
+    print_results(results)
+
+    params = {k: getattr(args, k) for k in ("log_mb", "source_lines", "fences", "done_files", "repeat", "seed")}
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "params": params,
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("params") != params:
+            print(f"\n⚠️ 基準とデータの大きさが違います: {baseline.get('params')}")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\n❌ 基準より悪化した処理があります:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print(f"\n✅ 基準（{args.compare}）からの悪化はありません。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
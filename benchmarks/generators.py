@@ -0,0 +1,150 @@
+import os
+import random
+
+# ベンチマーク用の合成データ。seed が同じなら毎回同じ内容を作る。
+
+LOG_NOISE = [
+    "[Agent] step {i}: planning next action",
+    "[Agent] step {i}: tool call finished in {ms} ms",
+    "[Memory] stored {n} items (total {total})",
+    "WARNING: retrying request {i} after {ms} ms",
+    "INFO: loaded module agents.worker_{n}",
+]
+
+EXCEPTIONS = [
+    ("KeyError", "'missing_key_{i}'"),
+    ("AttributeError", "'NoneType' object has no attribute 'blocks'"),
+    ("ValueError", "invalid literal for int() with base 10: 'abc{i}'"),
+    ("TypeError", "unsupported operand type(s) for +: 'int' and 'str'"),
+]
+
+
+def make_traceback(project_root, rng, frames=40, chained=1, index=0):
+    """
+    プロジェクト内と site-packages のフレームが混ざった Traceback を作る。
+    chained 個の例外が "During handling of the above exception..." で連鎖する。
+    """
+    blocks = []
+    for c in range(chained + 1):
+        lines = ["Traceback (most recent call last):"]
+        for f in range(frames):
+            if f % 3 == 2:
+                path = os.path.join("/usr/lib/python3/site-packages", f"lib{f % 7}", "core.py")
+            else:
+                path = os.path.join(project_root, "agents", f"module_{(index + f) % 50}.py")
+            lines.append(f'  File "{path}", line {rng.randint(1, 5000)}, in func_{f}')
+            lines.append(f"    value = compute_{f}(state, options)")
+        exc_type, message = EXCEPTIONS[(index + c) % len(EXCEPTIONS)]
+        lines.append(f"{exc_type}: {message.format(i=index)}")
+        blocks.append("\n".join(lines))
+    sep = "\n\nDuring handling of the above exception, another exception occurred:\n\n"
+    return sep.join(blocks) + "\n"
+
+
+def _noise_line(rng, i):
+    template = LOG_NOISE[i % len(LOG_NOISE)]
+    return template.format(i=i, ms=rng.randint(1, 999), n=rng.randint(1, 99), total=i * 3)
+
+
+def iter_log_chunks(size_bytes, project_root, seed=0, traceback_every=2000, frames=40, chained=1):
+    """
+    エージェントの出力ログ（約 size_bytes バイト）を文字列の塊で順に返す。
+    traceback_every 行ごとに Traceback を挟み、最後は必ず Traceback で終わる。
+    """
+    rng = random.Random(seed)
+    written = 0
+    i = 0
+    buf = []
+    buf_size = 0
+    while written + buf_size < size_bytes:
+        if i and i % traceback_every == 0:
+            line = make_traceback(project_root, rng, frames, chained, i)
+        else:
+            line = _noise_line(rng, i) + "\n"
+        buf.append(line)
+        buf_size += len(line)
+        i += 1
+        if buf_size >= 1 << 20:
+            yield "".join(buf)
+            written += buf_size
+            buf, buf_size = [], 0
+    buf.append(make_traceback(project_root, rng, frames, chained, i))
+    yield "".join(buf)
+
+
+def make_log_text(size_bytes, project_root, seed=0, **options):
+    return "".join(iter_log_chunks(size_bytes, project_root, seed, **options))
+
+
+def write_log_file(path, size_bytes, project_root, seed=0, **options):
+    """
+    ログをファイルに書き出す（1 GB でもメモリに全部は載せない）。戻り値: 書いたバイト数
+    """
+    total = 0
+    with open(path, "w", encoding="utf-8", newline="\n") as f:
+        for chunk in iter_log_chunks(size_bytes, project_root, seed, **options):
+            f.write(chunk)
+            total += len(chunk)
+    return total
+
+
+def write_source_file(path, total_lines, seed=0, methods_per_class=8, newline="\n"):
+    """
+    クラスとメソッドだけでできた約 total_lines 行の .py ファイルを書き出す。
+    戻り値: 定義したメソッドの "クラス名.メソッド名" のリスト（出現順）
+    """
+    rng = random.Random(seed)
+    lines = ["import os", "import sys", ""]
+    names = []
+    c = 0
+    while len(lines) < total_lines:
+        class_name = f"Worker{c}"
+        lines.append(f"class {class_name}:")
+        for m in range(methods_per_class):
+            method = f"handle_{m}"
+            names.append(f"{class_name}.{method}")
+            if m % 4 == 0:
+                lines.append("    @staticmethod")
+                lines.append(f"    def {method}(value):")
+            else:
+                lines.append(f"    def {method}(self, value):")
+            lines.append(f'        """handle {m} of {class_name}"""')
+            for k in range(rng.randint(3, 12)):
+                lines.append(f"        value = value + {k}  # step {k}")
+            lines.append("        return value")
+            lines.append("")
+        lines.append("")
+        c += 1
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.write(newline.join(lines) + newline)
+    return names
+
+
+def make_llm_response(fences, lines_per_block=20, seed=0):
+    """
+    説明文とコードフェンスがたくさん入った回答を作る。
+    python 以外のフェンス（bash, text, 言語なし）が先にあり、```python は後半にだけ現れる。
+    """
+    rng = random.Random(seed)
+    parts = []
+    langs = ["bash", "text", "", "json"]
+    for i in range(fences):
+        parts.append(f"手順 {i}: 以下のように変更します。理由は処理 {rng.randint(1, 100)} の結果が変わるためです。\n")
+        lang = "python" if i >= fences // 2 else langs[i % len(langs)]
+        body = "\n".join(f"    x_{i}_{k} = compute({k})" for k in range(lines_per_block))
+        parts.append(f"```{lang}\n{body}\n```\n")
+    return "".join(parts)
+
+
+def make_done_dir(done_dir, files, base_names=100):
+    """
+    Diff/done に、連番付きの差分ファイルを files 個作る。
+    """
+    os.makedirs(done_dir, exist_ok=True)
+    for i in range(files):
+        base = f"Script{i % base_names}.py"
+        seq = i // base_names + 1
+        with open(os.path.join(done_dir, f"{base}-{seq:02d}-dff.txt"), "w", encoding="utf-8") as f:
+            f.write(f"diff --git a/agents/{base} b/agents/{base}\n--- a/agents/{base}\n+++ b/agents/{base}\n"
+                    f"@@ -1,1 +1,1 @@\n-old_{i}\n+new_{i}\n")
+    return [f"Script{i}.py" for i in range(min(files, base_names))]
@@ -1,20 +1,23 @@
-import subprocess
-import os
 import time
-import openai
+_STARTED_AT = time.perf_counter()
+
+import os
+import re
+import argparse
 from datetime import datetime
 import sys
-import subprocess
 
 # --- パス設定 ---
 BASE_DIR = os.path.dirname(__file__)
-PROJECT_ROOT = r"D:\\EchoCodeForge"
+DEFAULT_PROJECT_ROOT = r"D:\\EchoCodeForge"
 DIFF_ROOT = r"D:\EchoCodeForge"
-AGENT_SCRIPT_PATH = os.path.join(PROJECT_ROOT, "agent1.py")
 LOG_PATH = os.path.join(BASE_DIR, "run_log.txt")
 QA_LOG_PATH = os.path.join(BASE_DIR, "QA.txt")
 QATEMP_LOG_PATH = os.path.join(BASE_DIR, "QAtemp.txt")
 DIFF_DIR = os.path.join(BASE_DIR, "Diff")
+SYNTAX_SCAN_CACHE_PATH = os.path.join(BASE_DIR, "syntax_scan_cache.json")
+METRICS_PATH = os.path.join(BASE_DIR, "metrics", "runs.jsonl")
+QA_DB_PATH = os.path.join(BASE_DIR, "QA.sqlite3")
 os.makedirs(DIFF_DIR, exist_ok=True)
 
 # --- 定数 ---
@@ -32,6 +35,7 @@ from fixer import (
     extract_error_message,
     extract_error_type_and_message
 )
+from traceback_parser import parse_last_traceback
 from file_editor import (
     read_context_lines,
     read_target_line_only,
@@ -39,49 +43,269 @@ from file_editor import (
     replace_function_in_file,
     write_new_class_file,
     generate_diff_file,
-    move_diff_to_done
+    move_diff_to_done,
+    preview_function_replacement,
+    DiffBatch
 )
 from utils import (
     extract_python_code_from_response,
     extract_class_name_from_code
 )
+from llm_cache import LLMCache
+from process_stream import stream_process, consume_process
+from syntax_scan import scan_project_syntax, check_file_syntax
+from symbol_index import suggest_function_name
+from patch_apply import apply_patch, apply_patch_file
+from file_cache import write_text
+from fix_policy import FixPolicy, FixProposal, RunBudget
+from log_writer import configure_logging, get_log_writer
+from prompt_builder import PromptBuilder, estimate_tokens
+from timing import span, count, timed, start_run, end_run
 
 # --- 設定読み込み ---
-loader = ConfigLoader()
-ai_enabled = loader.get("ai_enabled", True)
-api_key = loader.get_secret("openai_api_key")
-client = openai.OpenAI(api_key=api_key)
 debug = DeBug()
+client = None
+# この実行で ChatGPT に送ったトークン数（キャッシュからの回答は含まない）
+llm_usage = {"prompt_tokens": 0, "completion_tokens": 0}
+# 直前の問い合わせの応答時間とトークン数（Q&A の記録に使う）
+last_llm_call = {}
+
+def load_settings():
+    """
+    config.json の値をモジュール変数に読み込む。
+    起動時、--config 指定時、config.json が更新されたときに呼ばれる。
+    """
+    global loader, PROJECT_ROOT, AGENT_SCRIPT_PATH, ai_enabled, model, llm_base_url, llm_timeout, llm_max_retries
+    global abort_on_traceback, run_buffer_lines, syntax_prescan, prompt_builder, llm_cache, client
+    global agent_runner_mode, warm_preload, llm_stream, llm_stream_stop_after_blocks
+    global LOG_PATH, QA_LOG_PATH, DIFF_DIR, SYNTAX_SCAN_CACHE_PATH, METRICS_PATH
+    global QA_DB_PATH, qa_store, qa_store_enabled, qa_text_log
+
+    loader = ConfigLoader.instance()
+    PROJECT_ROOT = loader.get("project_root", DEFAULT_PROJECT_ROOT)
+    AGENT_SCRIPT_PATH = os.path.join(PROJECT_ROOT, loader.get("agent_script", "agent1.py"))
+    # ログ・差分などの置き場所（--targets ではプロジェクトごとに別のフォルダを指定する）
+    state_dir = loader.get("state_dir") or BASE_DIR
+    LOG_PATH = os.path.join(state_dir, "run_log.txt")
+    QA_LOG_PATH = os.path.join(state_dir, "QA.txt")
+    SYNTAX_SCAN_CACHE_PATH = os.path.join(state_dir, "syntax_scan_cache.json")
+    METRICS_PATH = os.path.join(state_dir, "metrics", "runs.jsonl")
+    QA_DB_PATH = os.path.join(state_dir, "QA.sqlite3")
+    DIFF_DIR = loader.get("diff_dir") or os.path.join(state_dir, "Diff")
+    os.makedirs(DIFF_DIR, exist_ok=True)
+    ai_enabled = loader.get("ai_enabled", True)
+    model = loader.get("default_model", "gpt-4")
+    llm_base_url = loader.get("llm_base_url")
+    llm_timeout = loader.get("llm_timeout_sec", 60)
+    llm_max_retries = loader.get("llm_max_retries", 3)
+    llm_stream = loader.get("llm_stream", False)
+    llm_stream_stop_after_blocks = loader.get("llm_stream_stop_after_blocks", 1)
+    # クライアントは get_client() で必要になったときに作り直す
+    client = None
+    qa_store_enabled = loader.get("qa_store_enabled", True)
+    qa_text_log = loader.get("qa_text_log", False)
+    # Q&A の記録は record_qa() で必要になったときに開き直す
+    if qa_store is not None:
+        qa_store.close()
+    qa_store = None
+
+    configure_logging(
+        buffer_bytes=loader.get("log_buffer_kb", 64) * 1024,
+        flush_interval=loader.get("log_flush_interval_sec", 1.0),
+        max_bytes=loader.get("log_max_mb", 10) * 1024 * 1024,
+        backup_count=loader.get("log_backup_count", 5),
+        background=loader.get("log_background", True)
+    )
+    abort_on_traceback = loader.get("run_abort_on_traceback", False)
+    run_buffer_lines = loader.get("run_buffer_lines", 2000)
+    syntax_prescan = loader.get("syntax_prescan", True)
+    agent_runner_mode = loader.get("agent_runner", "subprocess")
+    warm_preload = list(loader.get("warm_preload", []))
+    # 設定が変わったら warm runner は次の実行時に起動し直す
+    close_warm_runner()
+
+    prompt_builder = PromptBuilder(
+        PROJECT_ROOT,
+        token_budget=loader.get("prompt_token_budget", 3000),
+        context=CONTEXT_NUM
+    )
+
+    # --- 回答キャッシュ ---
+    llm_cache = None
+    if loader.get("llm_cache_enabled", True):
+        llm_cache = LLMCache(
+            os.path.join(BASE_DIR, loader.get("llm_cache_dir", "LLMCache")),
+            max_entries=loader.get("llm_cache_max_entries", 500),
+            max_bytes=loader.get("llm_cache_max_mb", 50) * 1024 * 1024,
+            max_age_days=loader.get("llm_cache_max_age_days", 30)
+        )
+
+warm_runner = None
+qa_store = None
+# (質問文, 回答) → Q&A の記録の id（修正を適用したかどうかを後から記録するため）
+# 別のエラーに同じ回答が返ってきても（キャッシュなど）取り違えないよう、質問文も含めて引く
+qa_record_ids = {}
+
+def close_warm_runner():
+    global warm_runner
+    if warm_runner is not None:
+        warm_runner.close()
+        warm_runner = None
+
+def get_warm_runner():
+    """
+    agent_runner が "warm" のとき、事前に import を済ませた warm runner を初めて必要になったときに起動する。
+    fork が使えない環境（Windows など）では None を返し、通常のサブプロセスで実行する。
+    """
+    global warm_runner, agent_runner_mode
+    if agent_runner_mode != "warm":
+        return None
+    if warm_runner is None:
+        import warm_runner as warm
+        if not warm.SUPPORTED:
+            print("⚠ この環境では warm runner を使えないため、通常のサブプロセスで agent を実行します。")
+            agent_runner_mode = "subprocess"
+            return None
+        import atexit
+        preload = list(warm_preload)
+        if loader.get("warm_preload_script_imports", True):
+            preload += [m for m in warm.script_imports(AGENT_SCRIPT_PATH, PROJECT_ROOT) if m not in preload]
+        warm_runner = warm.WarmRunner(PROJECT_ROOT, preload, python="python")
+        with span("warm_start", preload=len(preload)):
+            warm_runner.start()
+        atexit.register(close_warm_runner)
+        debug.print(f"warm runner を起動しました（事前読み込み: {', '.join(preload) or 'なし'}）")
+    return warm_runner
+
+load_settings()
+
+def get_client():
+    """
+    OpenAI クライアントを初めて必要になったときに作る。
+    オフラインモードやキャッシュヒットだけで終わる実行では openai を import しない。
+    """
+    global client
+    if client is None:
+        import openai
+        client = openai.OpenAI(
+            api_key=loader.get_secret("openai_api_key"),
+            base_url=llm_base_url,
+            timeout=llm_timeout,
+            max_retries=llm_max_retries
+        )
+    return client
 
 # === ユーティリティ関数 ===
 
+def prompt_input(message):
+    """
+    input() と同じ。人の入力待ちの時間を計測するために使う。
+    """
+    with span("human_input"):
+        return input(message)
+
 def wait_for_run_command():
     while True:
-        cmd = input("実行コマンドを入力してください（run）: ").strip().lower()
+        cmd = prompt_input("実行コマンドを入力してください（run）: ").strip().lower()
         if cmd == "run":
             break
 
 def append_log(filepath, content):
-    with open(filepath, "a", encoding="utf-8") as f:
-        f.write(content + "\n")
+    """
+    ログファイルに追記する。実際の書き込みはバッファされ、まとめて行われる。
+    """
+    get_log_writer(filepath).write(content + "\n")
+
+def append_qa_text(content):
+    """
+    QA.txt に追記する（config.json の qa_text_log が true のときだけ）。
+    """
+    if qa_text_log:
+        append_log(QA_LOG_PATH, content)
+
+def record_qa(question, answer, source, error=None, call=None):
+    """
+    1 件のやりとりを Q&A の記録（QA.sqlite3）に保存する。
+    source は "api" / "cache" / "file"、error は修正しようとしているエラー（AutoError）、
+    call は API に問い合わせたときの応答時間・トークン数（last_llm_call）。
+    """
+    global qa_store
+    if not qa_store_enabled:
+        return
+    if qa_store is None:
+        # 記録するときだけ import する
+        from qa_store import QAStore
+        qa_store = QAStore(QA_DB_PATH)
+    call = call or {}
+    with span("qa_record"):
+        qa_record_ids[(question, answer)] = qa_store.record(
+            question, answer,
+            model=model,
+            source=source,
+            latency_ms=call.get("latency_ms"),
+            prompt_tokens=call.get("prompt_tokens"),
+            completion_tokens=call.get("completion_tokens"),
+            error_type=error.exc_type if error else None,
+            error_message=error.signature if error else None,
+            target_file=error.filepath if error else None,
+            lineno=error.lineno if error else None,
+            project_root=PROJECT_ROOT
+        )
+
+def record_fix_outcome(question, answer, applied):
+    """
+    質問文 question への回答 answer の修正を適用した（applied=True）か、
+    採用しなかった・元に戻した（False）かを記録する。
+    """
+    record_id = qa_record_ids.get((question, answer)) if answer else None
+    if record_id is not None and qa_store is not None:
+        qa_store.mark_applied(record_id, applied)
 
-def run_agent_script():
+def run_agent_script(abort_on_traceback=False, cancel_event=None):
+    """
+    agent を実行し、stdout / stderr を 1 行ずつ run_log.txt に書き出す。
+    戻り値の stdout / stderr は末尾 run_buffer_lines 行のみ（メモリ使用量を一定に保つため）。
+    abort_on_traceback=True なら Traceback が出た時点で agent を停止する。
+    cancel_event（threading.Event）がセットされたら agent を停止する（--watch で使う）。
+    """
     timestamp = datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
     append_log(LOG_PATH, f"{timestamp} === 実行開始 ===")
 
-    process = subprocess.Popen(
-        ["python", AGENT_SCRIPT_PATH],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        cwd=PROJECT_ROOT
-    )
-    stdout, stderr = process.communicate()
+    log_writer = get_log_writer(LOG_PATH)
+
+    def on_line(_name, line):
+        log_writer.write(line)
+        count("agent_output_chars", len(line))
+
+    runner = get_warm_runner()
+    with span("agent_run", runner="warm" if runner else "subprocess"):
+        if runner:
+            result = consume_process(
+                runner.run(AGENT_SCRIPT_PATH, cwd=PROJECT_ROOT),
+                on_line=on_line,
+                abort_on_traceback=abort_on_traceback,
+                max_lines=run_buffer_lines,
+                cancel_event=cancel_event
+            )
+        else:
+            result = stream_process(
+                ["python", AGENT_SCRIPT_PATH],
+                cwd=PROJECT_ROOT,
+                on_line=on_line,
+                abort_on_traceback=abort_on_traceback,
+                max_lines=run_buffer_lines,
+                cancel_event=cancel_event
+            )
 
-    append_log(LOG_PATH, stdout)
-    append_log(LOG_PATH, stderr)
+    if cancel_event is not None and cancel_event.is_set():
+        print("⏹ agent の実行を中止しました。")
+        append_log(LOG_PATH, "=== 実行中止 ===")
+    elif result.aborted:
+        print("⚠ Traceback を検出したため agent を停止しました。")
+    if result.dropped_lines:
+        debug.print(f"出力が多いため先頭 {result.dropped_lines} 行は run_log.txt のみに記録しました。")
 
-    return stdout, stderr
+    return result.stdout, result.stderr
 
 def detect_error_type(log_text):
     if "SyntaxError" in log_text or "IndentationError" in log_text:
@@ -90,170 +314,1103 @@ def detect_error_type(log_text):
         return "runtime"
     return None
 
-def send_to_chatgpt(question, client, ai_enabled=True):
-    append_log(QA_LOG_PATH, "【質問】\n" + question)
-
-    if ai_enabled:
+def request_completions(question, client=None, n=1):
+    """
+    ChatGPT に 1 回問い合わせ、n 個の回答のリストを返す（キャッシュ・ログは扱わない）。
+    使ったトークン数は llm_usage と計測結果に加算する。
+    """
+    client = client or get_client()
+    if llm_stream and n == 1:
+        return [stream_completion(question, client, llm_stream_stop_after_blocks)]
+    options = {"n": n} if n > 1 else {}
+    started = time.perf_counter()
+    with span("llm", model=model, n=n):
         response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "user", "content": question}]
+            model=model,
+            messages=[{"role": "user", "content": question}],
+            **options
+        )
+        usage = getattr(response, "usage", None)
+        if usage:
+            add_llm_usage(usage.prompt_tokens, usage.completion_tokens)
+    set_last_llm_call(started, usage.prompt_tokens if usage else None, usage.completion_tokens if usage else None)
+    return [choice.message.content for choice in response.choices]
+
+def set_last_llm_call(started, prompt_tokens, completion_tokens):
+    last_llm_call.clear()
+    last_llm_call.update(
+        latency_ms=round((time.perf_counter() - started) * 1000, 1),
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens
+    )
+
+def add_llm_usage(prompt_tokens, completion_tokens):
+    count("prompt_tokens", prompt_tokens)
+    count("completion_tokens", completion_tokens)
+    llm_usage["prompt_tokens"] += prompt_tokens
+    llm_usage["completion_tokens"] += completion_tokens
+
+def stream_completion(question, client=None, stop_after_blocks=1):
+    """
+    ChatGPT の回答をストリーミングで受け取り、回答の文字列を返す。
+    ```python のブロックが stop_after_blocks 個閉じた時点で受信をやめ（生成も止まる）、
+    回答はそのブロックの閉じフェンスまでで打ち切る。stop_after_blocks が 0 なら最後まで受け取る。
+    途中でやめた場合は API からトークン数が返らないので、文字数から概算して加算する。
+    """
+    from fence_stream import FenceParser
+
+    client = client or get_client()
+    parser = FenceParser()
+    parts = []
+    usage = None
+    stopped_at = None
+    started = time.perf_counter()
+    with span("llm", model=model, n=1, stream=True):
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": question}],
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        answer = response.choices[0].message.content
+        try:
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                text = chunk.choices[0].delta.content or ""
+                if not text:
+                    continue
+                parts.append(text)
+                for block in parser.feed(text):
+                    if not block.is_python:
+                        continue
+                    python_blocks = sum(1 for b in parser.blocks if b.is_python)
+                    if python_blocks == 1:
+                        count("first_block_ms", round((time.perf_counter() - started) * 1000, 1))
+                    if stop_after_blocks and python_blocks >= stop_after_blocks:
+                        stopped_at = block.end
+                        break
+                if stopped_at is not None:
+                    break
+        finally:
+            stream.close()
+
+        answer = "".join(parts)
+        if stopped_at is not None:
+            answer = answer[:stopped_at]
+            count("stream_stopped_early", 1)
+            debug.print(f"コードを受け取ったので、回答の残りは受け取りませんでした（{len(answer)} 文字で終了）。")
+        if usage:
+            prompt_tokens, completion_tokens = usage.prompt_tokens, usage.completion_tokens
+        else:
+            prompt_tokens, completion_tokens = estimate_tokens(question), estimate_tokens(answer)
+        add_llm_usage(prompt_tokens, completion_tokens)
+    set_last_llm_call(started, prompt_tokens, completion_tokens)
+    return answer
+
+def send_to_chatgpt(question, client=None, ai_enabled=True, use_cache=True, error=None):
+    """
+    ChatGPT に質問して回答を返す。
+    キャッシュにあればそれを返し、API は呼ばない。
+    client を省略した場合は get_client() のクライアントを使う。
+    use_cache=False のときはキャッシュを参照しない（回答の保存は行う）。
+    オフラインモードでキャッシュにない場合は QAtemp.txt の回答を返す。
+    やりとりは error（修正しようとしているエラー）とともに Q&A の記録に保存する。
+    """
+    append_qa_text("【質問】\n" + question)
+
+    if llm_cache and use_cache:
+        answer = llm_cache.get(model, question)
+        if answer is not None:
+            print("💡 キャッシュから回答を読み込みました。")
+            debug.print(f"キャッシュ統計: {llm_cache.stats()}")
+            append_qa_text("【回答（キャッシュから）】\n" + answer)
+            record_qa(question, answer, "cache", error)
+            return answer
+
+    if ai_enabled:
+        answer = request_completions(question, client)[0]
         # nswer = answer.replace("```python\n", "").replace("```\n", "")
-        append_log(QA_LOG_PATH, "【回答】\n" + answer)
+        append_qa_text("【回答】\n" + answer)
+        record_qa(question, answer, "api", error, last_llm_call)
         with open(QATEMP_LOG_PATH, "w", encoding="utf-8") as f:
             f.write(answer)
+        if llm_cache:
+            llm_cache.put(model, question, answer)
         return answer
     else:
         try:
             with open(QATEMP_LOG_PATH, "r", encoding="utf-8") as f:
                 answer = f.read().strip()
                 print("💡 QAtemp.txt から回答を読み込みました。")
-                append_log(QA_LOG_PATH, "【回答（ファイルから）】" + answer)
+                append_qa_text("【回答（ファイルから）】" + answer)
+                record_qa(question, answer, "file", error)
                 return answer
         except FileNotFoundError:
             print("❌ QAtemp.txt が存在しません。")
             return ""
 
+def send_candidates_to_chatgpt(question, n, use_cache=True, error=None):
+    """
+    同じ質問に対する回答の候補を最大 n 個返す。
+    キャッシュに以前の回答・別の候補があればそれを使い、足りない分だけ 1 回の問い合わせ（n=）で取得する。
+    オフラインモードでは send_to_chatgpt と同じ 1 個だけを返す。
+    """
+    cached = llm_cache.get_all(model, question) if llm_cache and use_cache else []
+    if len(cached) >= n:
+        print(f"💡 キャッシュから回答の候補を {n} 個読み込みました。")
+        return cached[:n]
+    if not ai_enabled:
+        return cached or [send_to_chatgpt(question, ai_enabled=False, use_cache=use_cache, error=error)]
+
+    append_qa_text("【質問】\n" + question)
+    answers = request_completions(question, n=n - len(cached))
+    for i, answer in enumerate(answers, 1):
+        append_qa_text(f"【回答（候補 {i}/{len(answers)}）】\n" + answer)
+        # トークン数は 1 回の問い合わせ分なので、最初の候補にだけ記録する
+        call = last_llm_call if i == 1 else dict(last_llm_call, prompt_tokens=0, completion_tokens=0)
+        record_qa(question, answer, "api", error, call)
+    if answers:
+        with open(QATEMP_LOG_PATH, "w", encoding="utf-8") as f:
+            f.write(answers[0])
+    if llm_cache:
+        llm_cache.add_alternatives(model, question, answers)
+    return cached + answers
+
+def send_many_to_chatgpt(questions, use_cache=True, errors=None):
+    """
+    複数の質問を LLMPool で並行して ChatGPT に送る。
+    戻り値: {質問文: 回答}（失敗した質問は含まない）
+    オフラインモードでは何もせず空の辞書を返す（各質問は send_to_chatgpt で個別に扱う）。
+    errors（{質問文: AutoError}）は Q&A の記録に使う。
+    """
+    if not ai_enabled or not questions:
+        return {}
+    errors = errors or {}
+    for question in questions:
+        append_qa_text("【質問】\n" + question)
+
+    # asyncio などの import は並行問い合わせを行うときだけにする
+    from llm_pool import make_async_client, run_prompts
+    with span("llm_batch", model=model, questions=len(questions)):
+        answers, stats = run_prompts(
+            questions,
+            client=make_async_client(loader.get_secret("openai_api_key"), llm_base_url),
+            model=model,
+            concurrency=loader.get("llm_concurrency", 4),
+            rate_per_sec=loader.get("llm_rate_per_min", 60) / 60,
+            burst=loader.get("llm_burst", 5),
+            timeout=llm_timeout,
+            max_retries=llm_max_retries,
+            cache=llm_cache if use_cache else None
+        )
+        for answer in answers:
+            if not isinstance(answer, Exception) and answer.source == "api":
+                add_llm_usage(answer.prompt_tokens or 0, answer.completion_tokens or 0)
+    debug.print(f"並行問い合わせ: {stats}")
+
+    result = {}
+    for question, answer in zip(questions, answers):
+        if isinstance(answer, Exception):
+            print(f"❌ 問い合わせに失敗しました: {answer}")
+            continue
+        text = answer.text
+        append_qa_text(("【回答（キャッシュから）】\n" if answer.source == "cache" else "【回答】\n") + text)
+        record_qa(question, text, answer.source, errors.get(question), {
+            "latency_ms": answer.latency_ms,
+            "prompt_tokens": answer.prompt_tokens,
+            "completion_tokens": answer.completion_tokens,
+        })
+        if llm_cache and not use_cache:
+            llm_cache.put(model, question, text)
+        result[question] = text
+    return result
+
 # === メイン処理 ===
 
-def main():
-    wait_for_run_command()
-    stdout, stderr = run_agent_script()
+def review_and_apply_diff(diff_path, error_signature=None, answer=None, parts=None, question=None):
+    """
+    差分ファイルを表示・確認してから PROJECT_ROOT に適用し、Diff/done に移動する。
+    error_signature（"エラー種別: メッセージ"）は Diff/done の索引に記録される。
+    parts（DiffBatch.parts()）を渡した場合は、まとめた差分の代わりに修正 1 件ずつの差分を
+    それぞれの error_signature とともに Diff/done に記録する。
+    answer（差分の元になった、質問文 question への回答）には、適用したかどうかを Q&A の記録に残す。
+    適用に失敗した場合は False を返す。
+    """
+    show_diff = prompt_input("修正後の diff を表示しますか？（y[yes]/n[no]）: ").strip().lower()
+    if show_diff in ("y", "yes"):
+        if os.path.exists(diff_path):
+            with open(diff_path, "r", encoding="utf-8") as f:
+                print("\n--- 差分内容 ---")
+                print(f.read())
+        else:
+            print("❌ 差分ファイルが見つかりませんでした。")
+
+    apply_diff = prompt_input("この差分をファイルに反映しますか？（y[yes]/n[no]）: ").strip().lower()
+    if apply_diff in ("y", "yes") and os.path.exists(diff_path):
+        print(f"🛠 差分を適用します: {diff_path} (cwd={PROJECT_ROOT})")
+        result = apply_patch_file(diff_path, PROJECT_ROOT)
+        if not result.ok:
+            print("❌ パッチ適用チェック失敗:")
+            print(result.describe())
+            record_fix_outcome(question, answer, False)
+            return False
+        debug.print(result.describe())
+        done_dir = os.path.join(DIFF_DIR, "done")
+        if parts:
+            os.remove(diff_path)
+            for target_filepath, patch_text, signature in parts:
+                part_path = os.path.join(DIFF_DIR, f"{os.path.basename(target_filepath)}-dff.txt")
+                with open(part_path, "w", encoding="utf-8", newline="\n") as f:
+                    f.write(patch_text)
+                move_diff_to_done(part_path, done_dir, signature)
+        else:
+            move_diff_to_done(diff_path, done_dir, error_signature)
+        print("✅ 差分を適用しました。")
+        record_fix_outcome(question, answer, True)
+
+    elif apply_diff != "yes":
+        print("⚠ 差分の適用をキャンセルしました。")
+        record_fix_outcome(question, answer, False)
+    return True
+
+@timed("prompt_build")
+def build_syntax_question(abs_path, lineno):
+    """
+    文法エラーの行とその前後を読み、ChatGPT への質問文を作る。
+    戻り値: (context_lines, 質問文)
+    """
+    context_lines, prompt = prompt_builder.build_syntax_prompt(abs_path, lineno)
+    debug.print(prompt.summary())
+    return context_lines, prompt.text
+
+def merge_fixed_line(context_lines, lineno, new_code_lines):
+    """
+    前後の行（context_lines）のうち lineno 行目だけを回答のコードの 1 行目に置き換える。
+    戻り値: (修正前の行リスト, 修正後の行リスト)
+    """
+    original_lines = [line.rstrip() for _, line in context_lines]
+    new_code_lines = [line.rstrip() for line in new_code_lines]
+
+    # インデントを変更前に揃える
+    # original_indent = len(original_lines[0]) - len(original_lines[0].lstrip())
+    target_line = next(line for line_no, line in context_lines if line_no == lineno)
+    original_indent = len(target_line) - len(target_line.lstrip())
+    # new_code_lines = [" " * original_indent + line.lstrip() for line in new_code_lines]
+    # new_code_lines = [
+    #    (" " * original_indent + line.lstrip()) if line.strip() else ""
+    #    for line in new_code_lines
+    # ]
+    combined_new_lines = []
+    for i, (_, orig_line) in enumerate(context_lines):
+        if context_lines[i][0] == lineno:
+            combined_new_lines.append(" " * original_indent + new_code_lines[0].lstrip())
+        else:
+            combined_new_lines.append(orig_line)
+    return original_lines, combined_new_lines
+
+def fix_syntax_error(filepath, lineno, use_cache=True, batch=None, error_signature=None, answers=None):
+    """
+    PROJECT_ROOT からの相対パス filepath の lineno 行目の文法エラーを
+    ChatGPT に問い合わせて修正する。途中で中止した場合は False を返す。
+    batch（DiffBatch）を渡した場合は差分を適用せず、batch に修正を追加する。
+    error_signature は適用した差分とともに Diff/done の索引に記録される。
+    answers（{質問文: 回答}）に回答があれば、問い合わせずにそれを使う。
+    """
+    abs_path = os.path.join(PROJECT_ROOT, filepath)
+    print(f"\n対象ファイル: {filepath}（{lineno}行目）")
+
+    print("\n--- 該当行とその前後 ---")
+    context_lines, chatgpt_question = build_syntax_question(abs_path, lineno)
+    for lineno_i, line_text in context_lines:
+        print(f"{lineno_i}: {line_text}")
+
+    if error_signature is None:
+        _, syntax_error = check_file_syntax(abs_path)
+        error_signature = syntax_error[1] if syntax_error else None
+    error = AutoError("syntax", filepath, lineno, error_signature or "SyntaxError")
+    answer = answers.get(chatgpt_question) if answers else None
+    if answer is None:
+        # 過去に同じようなエラーを直した修正があれば、ChatGPT に問い合わせる前に提案する
+        local_fix = offer_local_fix(error)
+        if local_fix is not None:
+            answer = local_fix.answer
+    if answer is None:
+        print("\n=== ChatGPT に送信する質問内容 ===\n")
+        print(chatgpt_question)
+        print("\nこの内容で問い合わせますか？（y[yes] で実行）")
+        confirm = prompt_input("> ").strip().lower()
+        if confirm not in ("yes", "y"):
+            print("ChatGPTに問い合わせず、終了しました。")
+            return False
+        answer = pick_answer(error, chatgpt_question, use_cache, context_lines)
+    print("ChatGPTの回答:\n", answer)
+
+    code = extract_python_code_from_response(answer, filepath)
+    if code:
+        new_code_lines = code.splitlines()
+        print("\n--- 修正後のコード ---")
+        for line in new_code_lines:
+            print(line)
+
+        confirm = prompt_input("このコードで置き換えますか？（y[yes]/n[no]）: ").strip().lower()
+        if confirm in ("y", "yes"):
+            # original_lines = [read_target_line_only(abs_path, lineno).rstrip()]
+            original_lines, new_code_lines = merge_fixed_line(context_lines, lineno, new_code_lines)
+
+            generate_diff_file(
+                original_lines=original_lines,
+                new_lines=new_code_lines,
+                context_line_info=context_lines,
+                target_filepath=os.path.abspath(abs_path),
+                output_dir=DIFF_DIR,
+                lineno = lineno,
+                context=CONTEXT_NUM,
+                batch=batch,
+                project_root=PROJECT_ROOT,
+                error_signature=error.signature
+            )
+            if batch is not None:
+                print(f"📝 修正を保留しました（{len(batch)} 件目）。最後にまとめて適用します。")
+                return True
+
+            diff_filename = f"{abs_path.split(os.sep)[-1]}-dff.txt"
+            diff_path = os.path.join(DIFF_DIR, diff_filename)
+            if not review_and_apply_diff(diff_path, error.signature, answer, question=chatgpt_question):
+                return False
+        else:
+            print("⚠ 修正をキャンセルしました。")
+            record_fix_outcome(chatgpt_question, answer, False)
+    else:
+        print("❌ ChatGPTの回答に修正コードが見つかりませんでした。")
+    return True
+
+# === 自動モード（--auto） ===
+
+class AutoError:
+    """
+    自動モードで見つかった 1 つのエラー。kind は "syntax" / "runtime"。
+    key が同じなら「同じエラー」とみなす（修正後も同じなら修正を元に戻す）。
+    tb は log_text を解析した Traceback（質問文を作るときに解析し直さないため）。
+    """
+
+    def __init__(self, kind, filepath, lineno, signature, log_text=None, tb=None):
+        self.kind = kind
+        self.filepath = filepath
+        self.lineno = lineno
+        self.signature = signature
+        self.log_text = log_text
+        self.tb = tb
+
+    @property
+    def key(self):
+        return (self.signature, self.filepath, self.lineno)
+
+    @property
+    def exc_type(self):
+        """
+        signature の "エラー種別" の部分（SyntaxError など）。取り出せなければ None。
+        """
+        name = self.signature.partition(":")[0].strip()
+        return name if name.isidentifier() else None
+
+    def __str__(self):
+        where = f"{self.filepath}（{self.lineno}行目）" if self.filepath else "場所不明"
+        return f"{self.signature} @ {where}"
+
+
+class AutoFix:
+    """
+    適用前の修正。proposal をポリシーで判定してから apply() する。
+    """
+
+    def __init__(self, proposal, apply, discard=None, description="", answer=None):
+        self.proposal = proposal
+        self._apply = apply
+        self._discard = discard
+        self.description = description
+        # 修正の元になった ChatGPT の回答と、その質問文（Q&A の記録を引くため。propose_*_fix で入る）
+        self.answer = answer
+        self.question = None
+        # apply() で Diff/done に移動した差分のパス（元に戻したときに記録するため）
+        self.archived_diff = None
+
+    def apply(self):
+        """
+        修正を適用し、元に戻すためのスナップショット {絶対パス: 元のテキスト or None} を返す。
+        """
+        snapshot = {}
+        for relpath in self.proposal.new_texts:
+            abs_path = os.path.join(PROJECT_ROOT, relpath)
+            if os.path.exists(abs_path):
+                with open(abs_path, "r", encoding="utf-8", newline="") as f:
+                    snapshot[abs_path] = f.read()
+            else:
+                snapshot[abs_path] = None
+        self._apply()
+        return snapshot
+
+    def discard(self):
+        if self._discard:
+            self._discard()
+
+
+def read_project_texts(relpaths):
+    """
+    PROJECT_ROOT からの相対パスのファイルの今の内容を返す {相対パス: テキスト or None（ファイルがない）}。
+    """
+    texts = {}
+    for relpath in relpaths:
+        abs_path = os.path.join(PROJECT_ROOT, relpath)
+        if os.path.exists(abs_path):
+            with open(abs_path, "r", encoding="utf-8", newline="") as f:
+                texts[relpath] = f.read()
+        else:
+            texts[relpath] = None
+    return texts
+
+def restore_snapshot(snapshot):
+    for abs_path, text in snapshot.items():
+        if text is None:
+            if os.path.exists(abs_path):
+                os.remove(abs_path)
+        else:
+            write_text(abs_path, text)
+
+def detect_next_error(args):
+    """
+    次に直すエラーを探す。事前スキャンで文法エラーが見つかれば agent は実行しない。
+    エラーがなければ None。
+    """
+    if args.prescan:
+        with span("prescan"):
+            errors = scan_project_syntax(PROJECT_ROOT, SYNTAX_SCAN_CACHE_PATH)
+        if errors:
+            filepath, lineno = errors[0]
+            _, error = check_file_syntax(os.path.join(PROJECT_ROOT, filepath))
+            signature = error[1] if error else "SyntaxError"
+            return AutoError("syntax", filepath, lineno, signature)
+
+    stdout, stderr = run_agent_script(args.abort_on_traceback)
     log_text = stdout + "\n" + stderr
+    error_type = detect_error_type(log_text)
+    if error_type is None:
+        return None
+    tb = parse_last_traceback(log_text, PROJECT_ROOT)
+    filepath, lineno = detect_syntax_error_line(log_text, PROJECT_ROOT, tb)
+    return AutoError(error_type, filepath, lineno, extract_error_message(log_text, tb), log_text, tb)
+
+def build_syntax_fix(error, context_lines, answer):
+    """
+    文法エラーへの回答から、適用前の修正（AutoFix）を作る。ファイルにはまだ何も書かない。
+    戻り値: (AutoFix, None) または (None, 作れなかった理由)
+    """
+    code = extract_python_code_from_response(answer, error.filepath)
+    if not code:
+        return None, "回答に修正コードがありません"
+
+    abs_path = os.path.abspath(os.path.join(PROJECT_ROOT, error.filepath))
+    original_lines, new_lines = merge_fixed_line(context_lines, error.lineno, code.splitlines())
+    batch = DiffBatch(PROJECT_ROOT, CONTEXT_NUM)
+    batch.add_fix(abs_path, context_lines[0][0], original_lines, new_lines)
+    try:
+        patch_text = batch.render()
+    except ValueError as e:
+        return None, f"差分を作れません: {e}"
+    if not patch_text.strip():
+        return None, "回答のコードが元の行と同じです"
+
+    check = apply_patch(patch_text, PROJECT_ROOT, check_only=True)
+    if not check.ok:
+        return None, "差分を適用できません\n" + check.describe()
+    diff_filename = f"{os.path.basename(abs_path)}-dff.txt"
+
+    def apply():
+        diff_path = batch.write(os.path.join(DIFF_DIR, diff_filename))
+        result = apply_patch_file(diff_path, PROJECT_ROOT)
+        if not result.ok:
+            raise RuntimeError(result.describe())
+        fix.archived_diff = move_diff_to_done(diff_path, os.path.join(DIFF_DIR, "done"), error.signature)
+
+    def discard():
+        # 採用しなかった差分は後で確認できるように Diff/rejected に残す
+        rejected_dir = os.path.join(DIFF_DIR, "rejected")
+        os.makedirs(rejected_dir, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        batch.write(os.path.join(rejected_dir, f"{stamp}-{diff_filename}"))
+
+    proposal = FixProposal(check.new_texts, patch_text, error.signature, read_project_texts(check.new_texts))
+    fix = AutoFix(proposal, apply, discard, f"{error.filepath} の {error.lineno} 行目を修正", answer)
+    return fix, None
+
+def build_runtime_fix(error, answer):
+    """
+    実行時エラーへの回答から、適用前の修正（AutoFix）を作る。
+    戻り値: (AutoFix, None) または (None, 作れなかった理由)
+    """
+    code = extract_python_code_from_response(answer, error.filepath)
+    if not code:
+        return None, "回答に修正コードがありません"
+
+    class_name = extract_class_name_from_code(code)
+    if class_name:
+        relpath = f"{class_name}.py"
+        if os.path.exists(os.path.join(PROJECT_ROOT, relpath)):
+            return None, f"{relpath} は既に存在します"
+        proposal = FixProposal({relpath: code.strip() + "\n"}, None, error.signature, {relpath: None})
+        return AutoFix(proposal, lambda: write_new_class_file(PROJECT_ROOT, class_name, code),
+                       description=f"クラス {class_name} を新規作成", answer=answer), None
+
+    if not error.filepath:
+        return None, "エラーの発生したファイルがプロジェクト内にありません"
+    abs_path = os.path.join(PROJECT_ROOT, error.filepath)
+    function_name = suggest_function_name(abs_path, error.lineno, code)
+    if not function_name:
+        return None, "置き換える関数を特定できません"
+    short_name = function_name.split(".")[-1]
+    if not re.search(rf"^\s*(async\s+)?def\s+{re.escape(short_name)}\s*\(", code, re.MULTILINE):
+        return None, f"回答のコードに関数 {short_name} の定義がありません"
+    new_text = preview_function_replacement(abs_path, function_name, code)
+    if new_text is None:
+        return None, f"関数 {function_name} が見つかりません"
+
+    def apply():
+        if not replace_function_in_file(abs_path, function_name, code):
+            raise RuntimeError(f"{function_name} を置き換えられませんでした")
+
+    proposal = FixProposal({error.filepath: new_text}, None, error.signature, read_project_texts([error.filepath]))
+    return AutoFix(proposal, apply, description=f"{error.filepath} の {function_name} を置き換え", answer=answer), None
+
+def build_local_fixes(error):
+    """
+    Diff/done の過去の修正のうち、似たエラー（エラー種別・メッセージ・該当行の形）の修正を
+    error の行に当てはめた修正（AutoFix）を、似ている順に返す。ChatGPT には問い合わせない。
+    文法エラーでは、修正後にその行で文法エラーが出なくなるものだけを返す。
+    """
+    if not loader.get("fix_index_enabled", True) or not error.filepath or not error.lineno:
+        return []
+    # 索引を使うときだけ import する
+    from fix_index import get_fix_index
+
+    abs_path = os.path.join(PROJECT_ROOT, error.filepath)
+    fixes = []
+    with span("local_fix"):
+        line = read_target_line_only(abs_path, error.lineno).rstrip("\r\n")
+        suggestions = get_fix_index(os.path.join(DIFF_DIR, "done")).suggest(
+            error.signature, line, min_similarity=loader.get("fix_index_min_similarity", 0.3))
+        if not suggestions:
+            return []
+        context_lines = read_context_lines(abs_path, error.lineno, CONTEXT_NUM)
+        for suggestion in suggestions:
+            answer = f"過去の修正（{suggestion.source}）から作った修正です。\n```python\n{suggestion.new_line.strip()}\n```\n"
+            fix, _ = build_syntax_fix(error, context_lines, answer)
+            if fix is None:
+                continue
+            if error.kind == "syntax":
+                try:
+                    compile(fix.proposal.new_texts[error.filepath.replace(os.sep, "/")], error.filepath, "exec",
+                            dont_inherit=True)
+                except SyntaxError as e:
+                    if e.lineno == error.lineno:
+                        continue
+                except (KeyError, ValueError):
+                    continue
+            fix.description = (f"{error.filepath} の {error.lineno} 行目を過去の修正にならって修正"
+                               f"（{suggestion.source}、類似度 {suggestion.score:.2f}）")
+            fixes.append(fix)
+    count("local_fix_candidates", len(fixes))
+    return fixes
+
+def offer_local_fix(error):
+    """
+    対話モードで、過去の修正から作った修正案があれば表示して使うかどうかを聞く。
+    使う場合はその AutoFix を、使わない・見つからない場合は None を返す。
+    """
+    fixes = build_local_fixes(error)
+    if not fixes:
+        return None
+    fix = fixes[0]
+    print(f"\n💡 過去の修正から修正案が見つかりました: {fix.description}")
+    print(fix.proposal.patch_text)
+    confirm = prompt_input("この修正案を使いますか？（y[yes]/n[no] なら ChatGPT に問い合わせ）: ").strip().lower()
+    if confirm in ("y", "yes"):
+        return fix
+    return None
+
+def ask_fix_answers(question, use_cache, error=None):
+    """
+    config.json の fix_candidates が 2 以上なら回答の候補を複数、そうでなければ 1 個をリストで返す。
+    """
+    n = loader.get("fix_candidates", 1)
+    if n > 1:
+        return send_candidates_to_chatgpt(question, n, use_cache, error)
+    return [send_to_chatgpt(question, ai_enabled=ai_enabled, use_cache=use_cache, error=error)]
+
+def choose_fix(built):
+    """
+    build_*_fix の結果のリストから使う修正を選ぶ。
+    候補が 1 個なら検証せずにそれを返す。複数あれば並行して検証し（コンパイル・agent の再実行）、
+    最初に合格したものを返す。戻り値: (AutoFix, None) または (None, 理由)
+    """
+    fixes = []
+    seen = set()
+    for fix, _ in built:
+        if fix is None:
+            continue
+        key = tuple(sorted(fix.proposal.new_texts.items()))
+        if key not in seen:
+            seen.add(key)
+            fixes.append(fix)
+    if not fixes:
+        return None, built[0][1] if built else "回答がありません"
+    if len(built) == 1:
+        return fixes[0], None
+
+    # 候補の検証を行うときだけ import する
+    from candidates import evaluate_candidates
+
+    agent_script = None
+    if loader.get("candidate_run_agent", False):
+        agent_script = os.path.relpath(AGENT_SCRIPT_PATH, PROJECT_ROOT)
+    print(f"🧪 修正の候補 {len(fixes)} 個を並行して検証します（回答 {len(built)} 個）。")
+    with span("candidates", candidates=len(fixes)):
+        winner, results = evaluate_candidates(
+            PROJECT_ROOT,
+            [fix.proposal for fix in fixes],
+            agent_script=agent_script,
+            timeout=loader.get("candidate_run_timeout_sec", 60),
+            max_workers=loader.get("candidate_workers")
+        )
+    for result in results:
+        mark = "✅" if result.ok else "❌"
+        debug.print(f"{mark} 候補 {result.index + 1}: {result.reason}（{result.elapsed:.2f} 秒）")
+    if winner is None:
+        return None, "すべての候補が検証に失敗しました"
+    print(f"✅ 候補 {winner + 1} が検証に合格しました: {fixes[winner].description}")
+    return fixes[winner], None
+
+def propose_syntax_fix(error, use_cache):
+    abs_path = os.path.join(PROJECT_ROOT, error.filepath)
+    context_lines, question = build_syntax_question(abs_path, error.lineno)
+    answers = ask_fix_answers(question, use_cache, error)
+    fix, why = choose_fix([build_syntax_fix(error, context_lines, answer) for answer in answers])
+    if fix is not None:
+        fix.question = question
+    return fix, why
+
+def propose_runtime_fix(error, use_cache):
+    with span("prompt_build"):
+        prompt = prompt_builder.build_runtime_prompt(error.log_text, error.tb)
+    count("prompt_estimated_tokens", prompt.tokens)
+    debug.print(prompt.summary())
+    answers = ask_fix_answers(prompt.text, use_cache, error)
+    fix, why = choose_fix([build_runtime_fix(error, answer) for answer in answers])
+    if fix is not None:
+        fix.question = prompt.text
+    return fix, why
+
+def pick_answer(error, question, use_cache, context_lines=None):
+    """
+    対話モードで使う回答を 1 つ返す。
+    fix_candidates が 2 以上なら候補を並行して検証し、合格した回答を返す（合格がなければ最初の回答）。
+    """
+    if loader.get("fix_candidates", 1) <= 1:
+        return send_to_chatgpt(question, ai_enabled=ai_enabled, use_cache=use_cache, error=error)
+    answers = ask_fix_answers(question, use_cache, error)
+    if error.kind == "syntax":
+        built = [build_syntax_fix(error, context_lines, answer) for answer in answers]
+    else:
+        built = [build_runtime_fix(error, answer) for answer in answers]
+    fix, why = choose_fix(built)
+    if fix is None:
+        print(f"⚠ {why}。最初の回答を使います。")
+        return answers[0]
+    return fix.answer
+
+def run_auto(args):
+    """
+    人の確認なしで 実行 → エラー検出 → 修正 → 適用 → 再実行 を繰り返す。
+    agent がエラーなく終わるか、繰り返し回数・時間・費用の上限に達したら終了する。
+    修正は config.json の auto_policies をすべて満たすものだけを適用し、
+    適用後に同じエラーが同じ場所で再発した場合は修正を元に戻す。
+    戻り値: エラーなく終わったら True
+    """
+    use_cache = not args.no_cache
+    policy = FixPolicy(loader.get("auto_policies", ["compiles"]))
+    attempts_per_error = loader.get("auto_attempts_per_error", 2)
+    budget = RunBudget(
+        max_iterations=args.max_iterations,
+        max_seconds=args.max_minutes * 60 if args.max_minutes else None,
+        max_cost=args.max_cost if args.max_cost else None,
+        price_prompt_per_1k=loader.get("llm_price_per_1k_prompt", 0.0),
+        price_completion_per_1k=loader.get("llm_price_per_1k_completion", 0.0)
+    )
+    attempts = {}
+    last_applied = None
+    stats = {"applied": 0, "rejected": 0, "reverted": 0, "no_fix": 0, "local": 0}
+    succeeded = False
+
+    while True:
+        # 実行中に config.json が編集されたら、ポリシーや上限も新しい設定にする
+        if reload_settings_if_changed(args):
+            policy = FixPolicy(loader.get("auto_policies", ["compiles"]))
+            attempts_per_error = loader.get("auto_attempts_per_error", 2)
+            budget.max_iterations = args.max_iterations
+            budget.max_seconds = args.max_minutes * 60 if args.max_minutes else None
+            budget.max_cost = args.max_cost if args.max_cost else None
+            budget.price_prompt_per_1k = loader.get("llm_price_per_1k_prompt", 0.0)
+            budget.price_completion_per_1k = loader.get("llm_price_per_1k_completion", 0.0)
+        reason = budget.exhausted()
+        if reason:
+            print(f"⏹ {reason}に達したため終了します。")
+            break
+        budget.iterations += 1
+        print(f"\n🔁 自動修正 {budget.iterations} 回目（{budget.summary()}）")
+
+        error = detect_next_error(args)
+        if error is None:
+            print("✅ 実行成功。エラーなし。")
+            succeeded = True
+            break
+        print(f"⚠ {error}")
+
+        if last_applied and last_applied[0] == error.key:
+            print("↩ 修正後も同じエラーが発生したため、修正を元に戻します。")
+            reverted_fix = last_applied[2]
+            restore_snapshot(last_applied[1])
+            record_fix_outcome(reverted_fix.question, reverted_fix.answer, False)
+            if reverted_fix.archived_diff:
+                # 元に戻した修正は、過去の修正の例として提案しない
+                from diff_archive import get_archive
+                get_archive(os.path.join(DIFF_DIR, "done")).mark_reverted(reverted_fix.archived_diff)
+            stats["reverted"] += 1
+        last_applied = None
+
+        tried = attempts.get(error.key, 0)
+        if tried >= attempts_per_error:
+            print(f"⏹ このエラーは {tried} 回修正を試みても直らなかったため終了します。")
+            break
+        attempts[error.key] = tried + 1
+
+        usage_before = dict(llm_usage)
+        # 2 回目以降はキャッシュの回答（前回うまくいかなかったもの）を使わない
+        propose = propose_syntax_fix if error.kind == "syntax" else propose_runtime_fix
+        # 最初は過去の修正を当てはめてみる（同じエラーが再発したら次は ChatGPT に問い合わせる）
+        local_fixes = build_local_fixes(error) if tried == 0 else []
+        if local_fixes:
+            fix, why = local_fixes[0], None
+            stats["local"] += 1
+        elif error.kind == "syntax" and not error.filepath:
+            fix, why = None, "エラーの発生したファイルがプロジェクト内にありません"
+        else:
+            fix, why = propose(error, use_cache and tried == 0)
+        budget.add_usage(
+            llm_usage["prompt_tokens"] - usage_before["prompt_tokens"],
+            llm_usage["completion_tokens"] - usage_before["completion_tokens"]
+        )
+        if fix is None:
+            print(f"❌ 修正案を作れませんでした: {why}")
+            stats["no_fix"] += 1
+            continue
+
+        decision = policy.evaluate(fix.proposal)
+        if not decision:
+            print(f"🚫 修正を採用しませんでした（{decision.policy}）: {decision.reason}")
+            fix.discard()
+            record_fix_outcome(fix.question, fix.answer, False)
+            stats["rejected"] += 1
+            continue
 
+        try:
+            snapshot = fix.apply()
+        except Exception as e:
+            print(f"❌ 修正の適用に失敗しました: {e}")
+            stats["no_fix"] += 1
+            continue
+        print(f"✅ {fix.description}")
+        stats["applied"] += 1
+        count("auto_fixes_applied", 1)
+        record_fix_outcome(fix.question, fix.answer, True)
+        last_applied = (error.key, snapshot, fix)
+
+    # 取り消した修正は数えない
+    kept = stats["applied"] - stats["reverted"]
+    hours = budget.elapsed / 3600
+    rate = kept / hours if hours else 0.0
+    print(f"\n📊 自動修正の結果: {budget.summary()}")
+    print(f"   適用 {stats['applied']} / 不採用 {stats['rejected']} / 取り消し {stats['reverted']} / "
+          f"修正案なし {stats['no_fix']}（定着 {kept} 件、{rate:.1f} 件/時）")
+    if stats["local"]:
+        print(f"   うち過去の修正を当てはめたもの {stats['local']} 件（ChatGPT への問い合わせなし）")
+    return succeeded
+
+# === 監視モード（--watch） ===
+
+def report_run_result(log_text):
+    """
+    --watch で agent を実行した結果を 1〜2 行で表示する。
+    """
     error_type = detect_error_type(log_text)
+    if error_type is None:
+        print("✅ 実行成功。エラーなし。")
+        return
+    tb = parse_last_traceback(log_text, PROJECT_ROOT)
+    filepath, lineno = detect_syntax_error_line(log_text, PROJECT_ROOT, tb)
+    where = f"{filepath}（{lineno}行目）" if filepath else "場所不明"
+    label = "文法エラー" if error_type == "syntax" else "実行時エラー"
+    print(f"⚠ {label}: {extract_error_message(log_text, tb)} @ {where}")
 
-    if error_type == "syntax":
-        print("⚠ 文法エラー検出。修正処理を開始します。")
-        filepath, lineno = detect_syntax_error_line(log_text, PROJECT_ROOT)
-        if filepath and lineno:
-            abs_path = os.path.join(PROJECT_ROOT, filepath)
-            print(f"\n対象ファイル: {filepath}（{lineno}行目）")
-
-            print("\n--- 該当行とその前後 ---")
-            context_lines = read_context_lines(abs_path, lineno,CONTEXT_NUM)
-            for lineno_i, line_text in context_lines:
-                print(f"{lineno_i}: {line_text}")
-
-            # context_code = "\n".join(line_text for _, line_text in context_lines)
-            context_code = "\n".join(f"{lineno_i}: {line_text}" for lineno_i, line_text in context_lines)
-            chatgpt_question = (
-                f"以下のPythonコードには文法エラーがあります。\n"
-                f"{lineno} 行目に問題があります。文法的に正しい形に修正してください：\n"
-                f"出力されるコードは、該当する{lineno} 行目に対してだけにして他の行については回答に含めないでください\n"
-                f"```python\n{context_code}\n```"
-            )
+def run_watch(args):
+    """
+    PROJECT_ROOT の .py ファイルの内容が変わるたびに agent を実行する。
+    実行中に変更があれば実行を中止し、変更が落ち着いてから実行し直す。
+    --auto を併用した場合は、変更のたびに自動修正（run_auto）を行う。
+    """
+    # 監視モードを使うときだけ import する
+    from watcher import SourceWatcher, watch
 
-            print("\n=== ChatGPT に送信する質問内容 ===\n")
-            print(chatgpt_question)
-            print("\nこの内容で問い合わせますか？（y[yes] で実行）")
-            confirm = input("> ").strip().lower()
-            if confirm not in ("yes", "y"):
-                print("ChatGPTに問い合わせず、終了しました。")
-                return
-            answer = send_to_chatgpt(chatgpt_question, client, ai_enabled)
-            print("ChatGPTの回答:\n", answer)
+    watcher = SourceWatcher(
+        PROJECT_ROOT,
+        interval=loader.get("watch_interval_sec", 0.5),
+        debounce=loader.get("watch_debounce_sec", 1.0)
+    )
+    print(f"👀 {PROJECT_ROOT} の .py ファイル {len(watcher.files)} 件を監視します（Ctrl+C で終了）。")
+    metrics_enabled = loader.get("metrics_enabled", True)
+
+    def run(cancel_event):
+        reload_settings_if_changed(args)
+        # 監視モードでは 1 回の実行ごとに計測結果を書き出す
+        if metrics_enabled:
+            start_run(METRICS_PATH)
+        try:
+            if args.auto:
+                return run_auto(args)
+            stdout, stderr = run_agent_script(args.abort_on_traceback, cancel_event)
+            if cancel_event.is_set():
+                return None
+            return stdout + "\n" + stderr
+        finally:
+            end_run(cancelled=cancel_event.is_set())
+
+    def on_result(value):
+        if not args.auto:
+            report_run_result(value)
+
+    try:
+        watch(watcher, run, on_result, cancellable=not args.auto)
+    except KeyboardInterrupt:
+        print("\n監視を終了しました。")
+    return 0
+
+# === 複数プロジェクト（--targets） ===
+
+def run_targets(args):
+    """
+    対象（プロジェクトルート・スクリプト・差分の置き場所）ごとに self_runner.py --auto を別プロセスで起動し、
+    multi_workers 個ずつ並行して進める。ChatGPT への同時問い合わせ数（llm_concurrency）は
+    中継サーバー（LLMGate）ですべての対象で共有する。戻り値: 終了コード
+    """
+    # --targets を使うときだけ import する
+    from multi_runner import MultiRunner, load_targets, format_status
+    from llm_gate import LLMGate
+
+    states_root = os.path.join(BASE_DIR, loader.get("multi_state_dir", "Targets"))
+    try:
+        targets = load_targets(args.targets or loader.get("targets", []), states_root)
+    except (OSError, ValueError) as e:
+        print(f"❌ 対象のリストを読み込めませんでした: {e}")
+        return 2
+    if not targets:
+        print("❌ 対象がありません（--targets FILE か config.json の targets で指定してください）。")
+        return 2
+
+    gate = LLMGate(
+        upstream=llm_base_url,
+        concurrency=loader.get("llm_concurrency", 4),
+        rate_per_min=loader.get("llm_rate_per_min", 60),
+        burst=loader.get("llm_burst", 5),
+        timeout=llm_timeout
+    ).start()
+    extra_args = ["--no-cache"] if args.no_cache else []
+    extra_args += ["--prescan" if args.prescan else "--no-prescan"]
+    extra_args += ["--max-iterations", str(args.max_iterations), "--max-minutes", str(args.max_minutes),
+                   "--max-cost", str(args.max_cost)]
+    runner = MultiRunner(
+        targets,
+        os.path.abspath(__file__),
+        workers=loader.get("multi_workers", 2),
+        cycles=loader.get("multi_cycles", 1),
+        interval=loader.get("multi_interval_sec", 60),
+        gate=gate,
+        status_interval=loader.get("multi_status_interval_sec", 10),
+        status_path=os.path.join(states_root, "status.json"),
+        extra_args=extra_args
+    )
+    print(f"🚀 {len(targets)} 件の対象を {runner.workers} 並行で実行します"
+          f"（ChatGPT への同時問い合わせは全体で {gate.concurrency} 件まで）。")
+    try:
+        ok = runner.run()
+    finally:
+        gate.stop()
+    print(format_status(runner.status()))
+    print(f"📄 状態: {runner.status_path}")
+    return 0 if ok else 1
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="agent の実行とエラー自動修正")
+    parser.add_argument("--config", help="config.json の場所（環境変数 SELFMADE_CONFIG でも指定可）")
+    parser.add_argument("--secrets", help="secrets.json の場所（環境変数 SELFMADE_SECRETS でも指定可）")
+    parser.add_argument("--no-cache", action="store_true", help="回答キャッシュを参照せずに ChatGPT に問い合わせる")
+    parser.add_argument("--prescan", action=argparse.BooleanOptionalAction, default=None,
+                        help="agent を実行する前にプロジェクト全体の文法チェックを行う（省略時は config.json の syntax_prescan）")
+    parser.add_argument("--abort-on-traceback", action=argparse.BooleanOptionalAction, default=None,
+                        help="Traceback を検出した時点で agent を停止する（省略時は config.json の run_abort_on_traceback）")
+    parser.add_argument("--auto", action="store_true",
+                        help="確認なしで 実行→修正→再実行 を繰り返す（適用する修正は config.json の auto_policies で判定）")
+    parser.add_argument("--watch", action="store_true",
+                        help="PROJECT_ROOT の .py ファイルが変更されるたびに agent を実行する（--auto と併用すると変更のたびに自動修正する）")
+    parser.add_argument("--targets", nargs="?", const="", metavar="FILE",
+                        help="複数のプロジェクトの自動修正（--auto）を並行して行う。FILE は対象のリストの JSON"
+                             "（省略時は config.json の targets）")
+    parser.add_argument("--max-iterations", type=int, help="--auto の繰り返し回数の上限（省略時は config.json の auto_max_iterations）")
+    parser.add_argument("--max-minutes", type=float, help="--auto の経過時間の上限（分）（省略時は config.json の auto_max_minutes、0 なら無制限）")
+    parser.add_argument("--max-cost", type=float, help="--auto の API 費用の上限（ドル）（省略時は config.json の auto_max_cost_usd、0 なら無制限）")
+    return parser.parse_args(argv)
+
+def apply_config_args(args):
+    """
+    --config / --secrets が指定されていれば設定を読み直す。
+    省略されたオプションには設定値を入れる（config.json を読み直したときも入れ直す）。
+    """
+    if args.config or args.secrets:
+        ConfigLoader.configure(args.config, args.secrets)
+        load_settings()
+    args.from_config = [
+        name for name in ("prescan", "abort_on_traceback", "max_iterations", "max_minutes", "max_cost")
+        if getattr(args, name) is None
+    ]
+    fill_args_from_config(args)
 
-            code = extract_python_code_from_response(answer)
-            if code:
-                new_code_lines = code.splitlines()
-                print("\n--- 修正後のコード ---")
-                for line in new_code_lines:
-                    print(line)
+def fill_args_from_config(args):
+    values = {
+        "prescan": syntax_prescan,
+        "abort_on_traceback": abort_on_traceback,
+        "max_iterations": loader.get("auto_max_iterations", 20),
+        "max_minutes": loader.get("auto_max_minutes", 480),
+        "max_cost": loader.get("auto_max_cost_usd", 5.0),
+    }
+    for name in args.from_config:
+        setattr(args, name, values[name])
 
-                confirm = input("このコードで置き換えますか？（y[yes]/n[no]）: ").strip().lower()
+def reload_settings_if_changed(args):
+    """
+    config.json が更新されていれば読み直す。--watch の実行ごと・--auto の繰り返しごとに呼ぶ。
+    戻り値: 読み直したら True
+    """
+    if not loader.reload_if_changed():
+        return False
+    print("🔄 config.json が更新されたため設定を読み直しました。")
+    load_settings()
+    fill_args_from_config(args)
+    return True
+
+def main(argv=None):
+    args = parse_args(argv)
+    apply_config_args(args)
+    debug.print(f"起動時間: {(time.perf_counter() - _STARTED_AT) * 1000:.1f} ms")
+    if args.targets is not None:
+        return run_targets(args)
+    if args.watch:
+        return run_watch(args)
+    if loader.get("metrics_enabled", True):
+        start_run(METRICS_PATH)
+    try:
+        if args.auto:
+            return 0 if run_auto(args) else 1
+        run_once(args)
+    finally:
+        end_run()
+
+def run_once(args):
+    """
+    agent を 1 回実行し、見つかったエラーを修正する（main の本体）。
+    """
+    use_cache = not args.no_cache
+
+    wait_for_run_command()
+
+    if args.prescan:
+        with span("prescan"):
+            errors = scan_project_syntax(PROJECT_ROOT, SYNTAX_SCAN_CACHE_PATH)
+        if errors:
+            print(f"⚠ 事前スキャンで文法エラーを {len(errors)} 件検出しました。順に修正します。")
+            batch = DiffBatch(PROJECT_ROOT, CONTEXT_NUM)
+            answers = {}
+            if ai_enabled and len(errors) > 1:
+                questions = {
+                    build_syntax_question(os.path.join(PROJECT_ROOT, f), n)[1]: AutoError("syntax", f, n, "SyntaxError")
+                    for f, n in errors
+                }
+                confirm = prompt_input(f"{len(questions)} 件の質問をまとめて ChatGPT に問い合わせますか？（y[yes]/n[no]）: ").strip().lower()
                 if confirm in ("y", "yes"):
-                    # original_lines = [read_target_line_only(abs_path, lineno).rstrip()]
-                    original_lines = [line.rstrip() for _, line in context_lines]
-                    new_code_lines = [line.rstrip() for line in new_code_lines]
-
-                    # インデントを変更前に揃える
-                    # original_indent = len(original_lines[0]) - len(original_lines[0].lstrip())
-                    target_line = next(line for line_no, line in context_lines if line_no == lineno)
-                    original_indent = len(target_line) - len(target_line.lstrip())
-                    # new_code_lines = [" " * original_indent + line.lstrip() for line in new_code_lines]
-                    # new_code_lines = [
-                    #    (" " * original_indent + line.lstrip()) if line.strip() else ""
-                    #    for line in new_code_lines
-                    # ]
-                    combined_new_lines = []
-                    for i, (_, orig_line) in enumerate(context_lines):
-                        if context_lines[i][0] == lineno:
-                            combined_new_lines.append(" " * original_indent + new_code_lines[0].lstrip())
-                        else:
-                            combined_new_lines.append(orig_line)
-                    new_code_lines = combined_new_lines
-
-                    generate_diff_file(
-                        original_lines=original_lines,
-                        new_lines=new_code_lines,
-                        context_line_info=context_lines,
-                        target_filepath=os.path.abspath(abs_path),
-                        output_dir=DIFF_DIR,
-                        lineno = lineno,
-                        context=CONTEXT_NUM
-                    )
-
-                    diff_filename = f"{abs_path.split(os.sep)[-1]}-dff.txt"
-                    diff_path = os.path.join(DIFF_DIR, diff_filename)
-                    show_diff = input("修正後の diff を表示しますか？（y[yes]/n[no]）: ").strip().lower()
-                    if show_diff in ("y", "yes"):
-                        if os.path.exists(diff_path):
-                            with open(diff_path, "r", encoding="utf-8") as f:
-                                print("\n--- 差分内容 ---")
-                                print(f.read())
-                        else:
-                            print("❌ 差分ファイルが見つかりませんでした。")
-
-                    apply_diff = input("この差分をファイルに反映しますか？（y[yes]/n[no]）: ").strip().lower()
-                    if apply_diff in ("y", "yes") and os.path.exists(diff_path):
-                        print(f"🛠 実行コマンド: git apply {diff_path} (cwd={PROJECT_ROOT})")
-                        check_result = subprocess.run(
-                            ["git", "apply", "--check", diff_path],
-                            cwd=PROJECT_ROOT,
-                            check=True
-                        )
-                        if check_result.returncode != 0:
-                            print("❌ パッチ適用チェック失敗:")
-                            print(check_result.stderr)
-                            return
-                        try:
-                            subprocess.run(
-                                ["git", "apply", diff_path],
-                                cwd=PROJECT_ROOT,
-                                shell=True,
-                                check=True  # ← 失敗時は例外を投げる
-                            )
-                            move_diff_to_done(diff_path, os.path.join(DIFF_DIR, "done"))
-                            print("✅ 差分を適用しました。")
-                        except subprocess.CalledProcessError:
-                            print("❌ 差分の適用に失敗しました。")
-
-                    elif apply_diff != "yes":
-                        print("⚠ 差分の適用をキャンセルしました。")
-                else:
-                    print("⚠ 修正をキャンセルしました。")
-            else:
-                print("❌ ChatGPTの回答に修正コードが見つかりませんでした。")
+                    answers = send_many_to_chatgpt(list(questions), use_cache, questions)
+            for filepath, lineno in errors:
+                fix_syntax_error(filepath, lineno, use_cache, batch, answers=answers)
+            if len(batch):
+                try:
+                    diff_path = batch.write(os.path.join(DIFF_DIR, "batch-dff.txt"))
+                except ValueError as e:
+                    print(f"❌ 差分を生成できませんでした: {e}")
+                    return
+                review_and_apply_diff(diff_path, parts=batch.parts())
+            return
+
+    stdout, stderr = run_agent_script(args.abort_on_traceback)
+    log_text = stdout + "\n" + stderr
+
+    error_type = detect_error_type(log_text)
+    # ログの解析は 1 回だけにして、以降の関数には解析結果を渡す
+    tb = parse_last_traceback(log_text, PROJECT_ROOT) if error_type else None
+
+    if error_type == "syntax":
+        print("⚠ 文法エラー検出。修正処理を開始します。")
+        filepath, lineno = detect_syntax_error_line(log_text, PROJECT_ROOT, tb)
+        if filepath and lineno:
+            fix_syntax_error(filepath, lineno, use_cache, error_signature=extract_error_message(log_text, tb))
 
     elif error_type == "runtime":
         print("⚠ 実行時エラー検出。ChatGPT に問い合わせます。")
-        question = f"以下のPython実行時エラーを修正してください:\n{log_text}"
+        error_path, error_lineno = detect_syntax_error_line(log_text, PROJECT_ROOT, tb)
+        error = AutoError("runtime", error_path, error_lineno, extract_error_message(log_text, tb), log_text, tb)
+        local_fix = offer_local_fix(error)
+        if local_fix is not None:
+            try:
+                local_fix.apply()
+            except Exception as e:
+                print(f"❌ 修正の適用に失敗しました: {e}")
+                return
+            print(f"✅ {local_fix.description}")
+            return
+        with span("prompt_build"):
+            prompt = prompt_builder.build_runtime_prompt(log_text, tb)
+        count("prompt_estimated_tokens", prompt.tokens)
+        question = prompt.text
 
         print("\n=== ChatGPT に送信する質問内容 ===\n")
         print(question)
+        print(f"\n📏 {prompt.summary()}")
         print("\nこの内容で問い合わせますか？（y[yes] で実行）")
-        confirm = input("> ").strip().lower()
+        confirm = prompt_input("> ").strip().lower()
         if confirm not in ("yes", "y"):
             print("ChatGPTに問い合わせず、終了しました。")
             return
 
-        answer = send_to_chatgpt(question, client, ai_enabled)
+        answer = pick_answer(error, question, use_cache)
         print("ChatGPTの回答:\n", answer)
 
-        code = extract_python_code_from_response(answer)
-        error_type_detail, error_message = extract_error_type_and_message(log_text)
+        code = extract_python_code_from_response(answer, error_path)
+        error_type_detail, error_message = extract_error_type_and_message(log_text, tb)
 
         if error_type_detail:
             print(f"\n🔎 エラー種別: {error_type_detail}")
@@ -272,16 +1429,24 @@ def main():
                         print(f"🆕 クラス {class_name} を新規作成します")
                         if write_new_class_file(PROJECT_ROOT, class_name, code):
                             print(f"✅ {class_name}.py を作成しました")
+                            record_fix_outcome(question, answer, True)
                         else:
                             print("❌ ファイルの作成に失敗しました（既存の可能性あり）")
+                            record_fix_outcome(question, answer, False)
                     else:
-                        filepath, _ = detect_syntax_error_line(log_text, PROJECT_ROOT)
+                        filepath, error_lineno = detect_syntax_error_line(log_text, PROJECT_ROOT, tb)
                         abs_path = os.path.join(PROJECT_ROOT, filepath)
-                        function_name = input("修正対象の関数名を入力してください: ").strip()
+                        suggested = suggest_function_name(abs_path, error_lineno, code)
+                        if suggested:
+                            function_name = prompt_input(f"修正対象の関数名を入力してください [{suggested}]: ").strip() or suggested
+                        else:
+                            function_name = prompt_input("修正対象の関数名を入力してください: ").strip()
                         if replace_function_in_file(abs_path, function_name, code):
                             print(f"✅ {function_name} 関数を自動修正しました。")
+                            record_fix_outcome(question, answer, True)
                         else:
                             print("❌ 関数置換に失敗しました。")
+                            record_fix_outcome(question, answer, False)
                 else:
                     print("❌ ChatGPTの回答に修正コードが見つかりませんでした。")
         else:
@@ -291,4 +1456,4 @@ def main():
         print("✅ 実行成功。エラーなし。")
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
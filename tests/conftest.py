@@ -0,0 +1,9 @@
+import os
+import sys
+
+# self_runner.py と同じく、AutoFixer / Config のモジュールを直接 import できるようにする
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for name in ("AutoFixer", "Config"):
+    path = os.path.join(BASE_DIR, name)
+    if path not in sys.path:
+        sys.path.insert(0, path)
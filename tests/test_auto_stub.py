@@ -0,0 +1,101 @@
+"""
+スタブの LLM サーバー（llm_stub_server）を相手に self_runner.py --auto を実際に動かすテスト。
+状態ファイル（ログ・差分・キャッシュ・Q&A の記録）はすべて一時ディレクトリに作る。
+"""
+import os
+import sys
+import json
+import sqlite3
+import threading
+import subprocess
+
+import pytest
+
+from llm_stub_server import make_server
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SELF_RUNNER = os.path.join(BASE_DIR, "self_runner.py")
+QATEMP_PATH = os.path.join(BASE_DIR, "QAtemp.txt")
+
+
+@pytest.fixture(autouse=True)
+def keep_qatemp():
+    # self_runner は最後の質問と回答を BASE_DIR の QAtemp.txt に書くので、終わったら元に戻す
+    with open(QATEMP_PATH, "rb") as f:
+        saved = f.read()
+    yield
+    with open(QATEMP_PATH, "wb") as f:
+        f.write(saved)
+
+
+@pytest.fixture
+def stub():
+    servers = []
+
+    def start(answer):
+        server = make_server(port=0, delay=0.0, jitter=0.0, answer=answer, chunk_delay=0.0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def run_auto(tmp_path, base_url, files, **settings):
+    project = tmp_path / "project"
+    project.mkdir()
+    for name, text in files.items():
+        (project / name).write_text(text, encoding="utf-8")
+    state = tmp_path / "state"
+    secrets = tmp_path / "secrets.json"
+    secrets.write_text(json.dumps({"openai_api_key": "stub"}), encoding="utf-8")
+
+    values = {
+        "project_root": str(project),
+        "state_dir": str(state),
+        "llm_cache_dir": str(tmp_path / "LLMCache"),
+        "llm_base_url": base_url,
+        "ai_enabled": True,
+        "metrics_enabled": False,
+    }
+    values.update(settings)
+    env = dict(os.environ, SELFMADE_SECRETS=str(secrets), PYTHONIOENCODING="utf-8")
+    for key, value in values.items():
+        env["SELFMADE_" + key.upper()] = json.dumps(value)
+    completed = subprocess.run(
+        [sys.executable, SELF_RUNNER, "--auto", "--max-iterations", "4"],
+        cwd=str(tmp_path), env=env, capture_output=True, timeout=180
+    )
+    output = completed.stdout.decode("utf-8", "replace") + completed.stderr.decode("utf-8", "replace")
+    return completed.returncode, output, project, state
+
+
+def test_streamed_py_fence_fixes_syntax_error(stub, tmp_path):
+    # ```py のブロックでストリーミングを打ち切っても、そのコードで修正できること
+    base_url = stub("直しました。\n```py\ndef f():\n```\nここから長い説明が続きます。\n")
+    returncode, output, project, _ = run_auto(tmp_path, base_url, {
+        "agent1.py": "import helper\nprint(helper.f())\n",
+        "helper.py": "x = 1\n\ndef f()\n    return 1\n",
+    }, llm_stream=True)
+    assert returncode == 0, output
+    assert (project / "helper.py").read_text(encoding="utf-8") == "x = 1\n\ndef f():\n    return 1\n"
+
+
+def test_candidates_fix_two_syntax_errors_one_at_a_time(stub, tmp_path):
+    # 後ろの行に文法エラーが残る候補も合格にして、1 回に 1 か所ずつ直していくこと
+    base_url = stub("修正です。\n```python\ndef f():\n```\n")
+    returncode, output, project, state = run_auto(tmp_path, base_url, {
+        "agent1.py": "import helper\nprint(helper.f())\n",
+        "helper.py": "x = 1\n\ndef f()\n    return 1\n\ndef f()\n    return 2\n",
+    }, fix_candidates=2, fix_index_enabled=False)
+    assert returncode == 0, output
+    assert (project / "helper.py").read_text(encoding="utf-8") == \
+        "x = 1\n\ndef f():\n    return 1\n\ndef f():\n    return 2\n"
+
+    # 適用した修正は Q&A の記録に applied として残る
+    with sqlite3.connect(str(state / "QA.sqlite3")) as conn:
+        applied = [row[0] for row in conn.execute("SELECT applied FROM exchanges WHERE applied IS NOT NULL")]
+    assert applied and all(applied)
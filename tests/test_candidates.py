@@ -0,0 +1,68 @@
+from candidates import check_compiles, evaluate_candidates, validate_candidate
+from fix_policy import FixProposal
+
+# 文法エラーが 2 つある（3 行目と 6 行目）
+TWO_ERRORS = "x = 1\n\ndef f()\n    return 1\n\ndef g()\n    return 2\n"
+
+
+def proposal(new_text, old_text=TWO_ERRORS, relpath="helper.py"):
+    return FixProposal({relpath: new_text}, old_texts={relpath: old_text})
+
+
+def test_fix_for_the_first_of_two_syntax_errors_is_accepted():
+    fixed_first = TWO_ERRORS.replace("def f()", "def f():")
+    assert check_compiles(proposal(fixed_first)) is None
+
+
+def test_introduced_syntax_error_is_rejected():
+    broken = TWO_ERRORS.replace("def f()", "def f(:")
+    assert "3行目" in check_compiles(proposal(broken))
+
+
+def test_new_file_must_compile():
+    assert check_compiles(proposal("def f(:\n", old_text=None)) is not None
+    assert check_compiles(proposal("def f():\n    pass\n", old_text=None)) is None
+
+
+def test_non_python_files_are_not_compiled():
+    assert check_compiles(proposal("{not python", old_text="{}", relpath="Config/config.json")) is None
+
+
+def test_validate_candidate_runs_agent_on_the_overlay(tmp_path):
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "agent1.py").write_text("import helper\nprint(helper.value())\n", encoding="utf-8")
+    (project / "helper.py").write_text("def value():\n    return 1 / 0\n", encoding="utf-8")
+
+    good = FixProposal({"helper.py": "def value():\n    return 1\n"}, old_texts={"helper.py": None})
+    result = validate_candidate(0, str(project), good, agent_script="agent1.py", timeout=30)
+    assert result.ok, result.reason
+
+    bad = FixProposal({"helper.py": "def value():\n    raise ValueError('no')\n"}, old_texts={"helper.py": None})
+    result = validate_candidate(1, str(project), bad, agent_script="agent1.py", timeout=30)
+    assert not result.ok
+    assert "ValueError" in result.reason
+
+    # オーバーレイで検証するだけで、プロジェクトのファイルは書き換えない
+    assert (project / "helper.py").read_text(encoding="utf-8") == "def value():\n    return 1 / 0\n"
+
+
+def test_candidate_with_a_remaining_later_error_skips_the_agent(tmp_path):
+    fixed_first = TWO_ERRORS.replace("def f()", "def f():")
+    result = validate_candidate(0, str(tmp_path), proposal(fixed_first), agent_script="agent1.py")
+    assert result.ok
+
+
+def test_evaluate_candidates_picks_a_passing_candidate(tmp_path):
+    candidates = [
+        proposal(TWO_ERRORS.replace("def f()", "def f(:")),
+        proposal(TWO_ERRORS.replace("def f()", "def f():")),
+    ]
+    winner, results = evaluate_candidates(str(tmp_path), candidates, max_workers=2)
+    assert winner == 1
+    assert [r.index for r in results] == [0, 1]
+    assert not results[0].ok
+
+
+def test_evaluate_candidates_without_candidates():
+    assert evaluate_candidates("/tmp", []) == (None, [])
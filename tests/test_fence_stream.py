@@ -0,0 +1,82 @@
+from fence_stream import FenceParser, parse_blocks
+from utils import extract_code_blocks, extract_python_code_from_response
+
+ANSWER = (
+    "原因は 3 行目です。agents/foo.py を次のように直してください。\n"
+    "```python\n"
+    "def f():\n"
+    "    return 1\n"
+    "```\n"
+    "設定も変えます。\n"
+    "```json Config/config.json\n"
+    '{"a": 1}\n'
+    "```\n"
+    "補足の説明がここから長く続きます。\n"
+)
+
+
+def test_block_is_returned_when_its_closing_fence_arrives():
+    parser = FenceParser()
+    first_block_at = None
+    blocks = []
+    for i, ch in enumerate(ANSWER):
+        for block in parser.feed(ch):
+            blocks.append(block)
+            if first_block_at is None:
+                first_block_at = i
+    blocks += parser.close()
+
+    assert [b.lang for b in blocks] == ["python", "json"]
+    # 閉じフェンスの行が届いた時点で返り、end はそこまでの文字数
+    end = ANSWER.index("```\n", ANSWER.index("```python") + 1) + len("```\n")
+    assert first_block_at == end - 1
+    assert blocks[0].end == end
+    assert ANSWER[:blocks[0].end].endswith("```\n")
+    assert blocks[0].code == "def f():\n    return 1\n"
+
+
+def test_target_hints():
+    blocks = parse_blocks(ANSWER)
+    assert blocks[0].hint == "agents/foo.py"
+    assert blocks[1].hint == "Config/config.json"
+
+    commented = parse_blocks("```py\n# file: pkg/bar.py\nx = 1\n```\n")
+    assert commented[0].hint == "pkg/bar.py"
+
+
+def test_python_language_aliases():
+    blocks = parse_blocks("```py\na\n```\n```python3\nb\n```\n```Python\nc\n```\n```js\nd\n```\n")
+    assert [b.is_python for b in blocks] == [True, True, True, False]
+    assert [b.code for b in extract_code_blocks("```py\na\n```\n```js\nd\n```\n")] == ["a\n"]
+
+
+def test_unclosed_block_is_returned_by_close():
+    parser = FenceParser()
+    assert parser.feed("```python\nx = 1\n") == []
+    assert parser.in_block
+    blocks = parser.close()
+    assert [b.code for b in blocks] == ["x = 1\n"]
+
+
+def test_longer_fences_and_tildes():
+    blocks = parse_blocks("~~~py\na = '```'\n```\n~~~\n````python\nb\n````\n")
+    assert [b.code for b in blocks] == ["a = '```'\n```\n", "b\n"]
+
+
+def test_extract_python_code_uses_the_same_rule_as_streaming():
+    # ストリーミングで打ち切る ```py のブロックも、修正コードとして取り出せること
+    assert extract_python_code_from_response("直しました\n```py\ndef f():\n```\n") == "def f():"
+    assert extract_python_code_from_response("```js\nx\n```\n") is None
+    assert extract_python_code_from_response("no code") is None
+
+
+def test_extract_python_code_prefers_the_block_for_the_target():
+    answer = (
+        "```python other.py\nA = 1\n```\n"
+        "helper も直します。\n"
+        "```python\n# file: pkg/helper.py\nB = 2\n```\n"
+    )
+    assert extract_python_code_from_response(answer, "pkg/helper.py") == "# file: pkg/helper.py\nB = 2"
+    assert extract_python_code_from_response(answer, "pkg\\helper.py") == "# file: pkg/helper.py\nB = 2"
+    assert extract_python_code_from_response(answer, "unknown.py") == "A = 1"
+    assert extract_python_code_from_response(answer) == "A = 1"
@@ -0,0 +1,150 @@
+import os
+
+import pytest
+
+import file_cache
+from file_editor import DiffBatch
+from patch_apply import PatchError, apply_patch, apply_patch_file, parse_patch
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data.encode("utf-8"))
+    file_cache.invalidate(path)
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8")
+
+
+def test_parse_multiple_files_and_hunks():
+    patch = (
+        "diff --git a/a.py b/a.py\n"
+        "--- a/a.py\n"
+        "+++ b/a.py\n"
+        "@@ -1,2 +1,2 @@\n"
+        " x = 1\n"
+        "-y = 2\n"
+        "+y = 3\n"
+        "@@ -10 +10,2 @@\n"
+        " z = 1\n"
+        "+w = 2\n"
+        "--- a/pkg/b.py\n"
+        "+++ b/pkg/b.py\n"
+        "@@ -1 +1 @@\n"
+        "-old\n"
+        "+new\n"
+    )
+    files = parse_patch(patch)
+    assert [(f.old_path, f.new_path, len(f.hunks)) for f in files] == [("a.py", "a.py", 2), ("pkg/b.py", "pkg/b.py", 1)]
+    assert files[0].hunks[0].old_lines == ["x = 1", "y = 2"]
+    assert files[0].hunks[0].new_lines == ["x = 1", "y = 3"]
+    assert files[0].hunks[1].old_count == 1
+
+
+def test_parse_rejects_short_hunk():
+    with pytest.raises(PatchError):
+        parse_patch("--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,2 @@\n x\n")
+
+
+def test_parse_keeps_unicode_line_separators_inside_lines():
+    # splitlines() だと \x0c や \u2028 でも行が分かれてしまう
+    patch = "--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,2 @@\n s = 'a\x0cb\u2028c'\n-x = 1\n+x = 2\n"
+    hunk = parse_patch(patch)[0].hunks[0]
+    assert hunk.old_lines == ["s = 'a\x0cb\u2028c'", "x = 1"]
+
+
+def test_apply_with_offset_and_crlf(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, "a.py"), "# head\r\n# head\r\nx = 1\r\ny = 2\r\n")
+    patch = "--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,2 @@\n x = 1\n-y = 2\n+y = 3\n"
+    result = apply_patch(patch, root)
+    assert result.ok and result.applied
+    assert result.files[0].hunks[0].offset == 2
+    assert read(os.path.join(root, "a.py")) == "# head\r\n# head\r\nx = 1\r\ny = 3\r\n"
+
+
+def test_failed_hunk_leaves_every_file_untouched(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, "a.py"), "a = 1\n")
+    write(os.path.join(root, "b.py"), "b = 1\n")
+    patch = (
+        "--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-a = 1\n+a = 2\n"
+        "--- a/b.py\n+++ b/b.py\n@@ -1 +1 @@\n-b = 999\n+b = 2\n"
+    )
+    result = apply_patch(patch, root)
+    assert not result.ok and not result.applied
+    assert read(os.path.join(root, "a.py")) == "a = 1\n"
+    assert read(os.path.join(root, "b.py")) == "b = 1\n"
+
+
+def test_check_only_returns_new_texts_without_writing(tmp_path):
+    root = str(tmp_path)
+    write(os.path.join(root, "a.py"), "a = 1\n")
+    result = apply_patch("--- a/a.py\n+++ b/a.py\n@@ -1 +1 @@\n-a = 1\n+a = 2\n", root, check_only=True)
+    assert result.ok and not result.applied
+    assert result.new_texts == {"a.py": "a = 2\n"}
+    assert read(os.path.join(root, "a.py")) == "a = 1\n"
+
+
+def test_no_newline_marker_is_honoured(tmp_path):
+    root = str(tmp_path)
+    path = os.path.join(root, "a.py")
+    write(path, "a\nb\nc")
+    patch = (
+        "--- a/a.py\n+++ b/a.py\n@@ -2,2 +2,2 @@\n b\n-c\n"
+        "\\ No newline at end of file\n+C\n\\ No newline at end of file\n"
+    )
+    assert apply_patch(patch, root).ok
+    assert read(path) == "a\nb\nC"
+
+    # 最後の行に改行を付ける差分
+    patch = "--- a/a.py\n+++ b/a.py\n@@ -3 +3,2 @@\n-C\n\\ No newline at end of file\n+C\n+D\n"
+    assert apply_patch(patch, root).ok
+    assert read(path) == "a\nb\nC\nD\n"
+
+
+@pytest.mark.parametrize("rel_path", ["../outside.py", "sub/../../outside.py"])
+def test_paths_outside_project_root_are_rejected(tmp_path, rel_path):
+    root = os.path.join(str(tmp_path), "project")
+    os.makedirs(os.path.join(root, "sub"))
+    outside = os.path.join(str(tmp_path), "outside.py")
+    write(outside, "x = 1\n")
+    result = apply_patch(f"--- {rel_path}\n+++ {rel_path}\n@@ -1 +1 @@\n-x = 1\n+x = 2\n", root)
+    assert not result.ok
+    assert read(outside) == "x = 1\n"
+
+
+def test_absolute_path_is_rejected(tmp_path):
+    outside = os.path.join(str(tmp_path), "outside.py")
+    write(outside, "x = 1\n")
+    root = os.path.join(str(tmp_path), "project")
+    os.makedirs(root)
+    result = apply_patch(f"--- {outside}\n+++ {outside}\n@@ -1 +1 @@\n-x = 1\n+x = 2\n", root)
+    assert not result.ok
+    assert read(outside) == "x = 1\n"
+
+
+def test_patch_file_keeps_lone_carriage_return(tmp_path):
+    root = str(tmp_path)
+    path = os.path.join(root, "a.py")
+    write(path, "s = 'a\rb'\nx = 1\n")
+    patch_path = os.path.join(root, "a.py-dff.txt")
+    with open(patch_path, "wb") as f:
+        f.write(b"--- a/a.py\n+++ b/a.py\n@@ -1,2 +1,2 @@\n s = 'a\rb'\n-x = 1\n+x = 2\n")
+    assert apply_patch_file(patch_path, root).ok
+    assert read(path) == "s = 'a\rb'\nx = 2\n"
+
+
+def test_diff_batch_round_trip_without_trailing_newline(tmp_path):
+    root = str(tmp_path)
+    path = os.path.join(root, "a.py")
+    write(path, "def f()\n    return 1")
+    batch = DiffBatch(root, context=1)
+    batch.add_fix(path, 2, ["    return 1"], ["    return 2"])
+    patch = batch.render()
+    assert "\\ No newline at end of file" in patch
+    assert apply_patch(patch, root).ok
+    assert read(path) == "def f()\n    return 2"
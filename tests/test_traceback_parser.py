@@ -0,0 +1,126 @@
+import io
+import mmap
+
+from traceback_parser import iter_tracebacks, make_relpath, parse_last_traceback
+
+ROOT = "/work/project"
+
+SIMPLE = (
+    "starting agent\n"
+    "Traceback (most recent call last):\n"
+    '  File "/work/project/agent1.py", line 10, in <module>\n'
+    "    main()\n"
+    '  File "/work/project/agents/foo.py", line 3, in main\n'
+    "    return 1 / 0\n"
+    "           ~~^~~\n"
+    '  File "/usr/lib/python3.11/site.py", line 1, in helper\n'
+    "ZeroDivisionError: division by zero\n"
+)
+
+CHAINED = (
+    "Traceback (most recent call last):\n"
+    '  File "/work/project/a.py", line 1, in f\n'
+    "KeyError: 'x'\n"
+    "\n"
+    "During handling of the above exception, another exception occurred:\n"
+    "\n"
+    "Traceback (most recent call last):\n"
+    '  File "/work/project/b.py", line 2, in g\n'
+    "ValueError: bad\n"
+    "\n"
+    "The above exception was the direct cause of the following exception:\n"
+    "\n"
+    "Traceback (most recent call last):\n"
+    '  File "/work/project/c.py", line 3, in h\n'
+    "RuntimeError: wrapped\n"
+)
+
+SYNTAX = (
+    '  File "/work/project/helper.py", line 3\n'
+    "    def f()\n"
+    "           ^\n"
+    "SyntaxError: expected ':'\n"
+)
+
+
+def test_simple_traceback():
+    tb = parse_last_traceback(SIMPLE, ROOT)
+    assert tb.exc_type == "ZeroDivisionError"
+    assert tb.message == "division by zero"
+    assert [f.lineno for f in tb.frames] == [10, 3, 1]
+    assert tb.last_frame.relpath is None
+    frame = tb.last_project_frame()
+    assert frame.relpath.replace("\\", "/") == "agents/foo.py"
+    assert frame.function == "main"
+
+
+def test_chained_exceptions_are_one_traceback():
+    tracebacks = list(iter_tracebacks(CHAINED, ROOT))
+    assert len(tracebacks) == 1
+    tb = tracebacks[0]
+    assert tb.exc_type == "RuntimeError"
+    assert tb.chain_kind == "cause"
+    assert [(c.exc_type, c.chain_kind) for c in tb.chain] == [("KeyError", None), ("ValueError", "context")]
+
+    last = parse_last_traceback(CHAINED, ROOT)
+    assert last.exc_type == "RuntimeError"
+    assert [c.exc_type for c in last.chain] == ["KeyError", "ValueError"]
+
+
+def test_syntax_error_without_header():
+    tb = parse_last_traceback("compiling...\n" + SYNTAX, ROOT)
+    assert tb.exc_type == "SyntaxError"
+    assert tb.message == "expected ':'"
+    assert tb.last_project_frame().lineno == 3
+
+
+def test_last_of_several_tracebacks():
+    log = SIMPLE + "more output\n" + SYNTAX + "later output\n" + CHAINED + "done\n"
+    assert [tb.exc_type for tb in iter_tracebacks(log, ROOT)] == ["ZeroDivisionError", "SyntaxError", "RuntimeError"]
+    assert parse_last_traceback(log, ROOT).exc_type == "RuntimeError"
+
+
+def test_interrupted_traceback_falls_back_to_the_previous_one():
+    log = SIMPLE + "Traceback (most recent call last):\n" + '  File "/work/project/x.py", line 1, in f\n'
+    assert parse_last_traceback(log, ROOT).exc_type == "ZeroDivisionError"
+
+
+def test_no_traceback():
+    assert parse_last_traceback("all good\nTraceback mentioned in text\n", ROOT) is None
+    assert parse_last_traceback("", ROOT) is None
+    assert list(iter_tracebacks("", ROOT)) == []
+
+
+def test_crlf_log():
+    tb = parse_last_traceback(SIMPLE.replace("\n", "\r\n"), ROOT)
+    assert tb.exc_type == "ZeroDivisionError"
+    assert tb.message == "division by zero"
+
+
+def test_sources_give_the_same_result(tmp_path):
+    log = "日本語の出力\n" * 1000 + SIMPLE + SYNTAX
+    path = tmp_path / "run_log.txt"
+    path.write_bytes(log.encode("utf-8"))
+
+    expected = parse_last_traceback(log, ROOT)
+    from_path = parse_last_traceback(project_root=ROOT, path=str(path))
+    from_bytes = parse_last_traceback(log.encode("utf-8"), ROOT)
+    from_file = parse_last_traceback(io.StringIO(log), ROOT)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        from_mmap = parse_last_traceback(mm, ROOT)
+    for tb in (from_path, from_bytes, from_file, from_mmap):
+        assert (tb.exc_type, tb.message, [f.lineno for f in tb.frames]) == \
+               (expected.exc_type, expected.message, [f.lineno for f in expected.frames])
+    assert len(list(iter_tracebacks(project_root=ROOT, path=str(path)))) == 2
+
+
+def test_empty_log_file(tmp_path):
+    path = tmp_path / "run_log.txt"
+    path.write_bytes(b"")
+    assert parse_last_traceback(project_root=ROOT, path=str(path)) is None
+
+
+def test_make_relpath_handles_windows_paths():
+    assert make_relpath(r"D:\Work\Project\agents\foo.py", "d:/work/project").replace("\\", "/") == "agents/foo.py"
+    assert make_relpath("/work/project2/a.py", ROOT) is None
+    assert make_relpath("/work/project/a.py", None) is None